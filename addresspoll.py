@@ -0,0 +1,141 @@
+import heapq
+import logging
+import time
+
+import gevent
+import gevent.event
+
+from app_core import app, db
+from models import CryptoAddress
+import depwith
+import leases
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_INTERVAL = app.config['ADDRESS_POLL_ACTIVE_INTERVAL']
+ACTIVE_SECONDS = app.config['ADDRESS_POLL_ACTIVE_SECONDS']
+MAX_INTERVAL = app.config['ADDRESS_POLL_MAX_INTERVAL']
+IDLE_SECONDS = app.config['ADDRESS_POLL_IDLE_SECONDS']
+IDLE_INTERVAL = app.config['ADDRESS_POLL_IDLE_INTERVAL']
+BATCH_SIZE = 100
+LEASE = 'address_poll'
+
+# min-heap of (next check timestamp, address id), an entry that does not match '_next' has been rescheduled (or
+# checked) and is skipped when popped
+_heap = []
+_next = {}
+_wakeup = gevent.event.Event()
+_greenlet = None
+
+def check_interval(viewed_at, checked_at):
+    # every ACTIVE_INTERVAL seconds for ACTIVE_SECONDS after the deposit address was viewed, after that the interval
+    # grows with the time since the view (so the check rate decays exponentially) up to MAX_INTERVAL, once the address
+    # has not been viewed for IDLE_SECONDS it is only checked every IDLE_INTERVAL (so a late deposit is still credited)
+    age = checked_at - viewed_at
+    if age < ACTIVE_SECONDS:
+        return ACTIVE_INTERVAL
+    if age >= IDLE_SECONDS:
+        return IDLE_INTERVAL
+    return min(MAX_INTERVAL, max(ACTIVE_INTERVAL, age - ACTIVE_SECONDS))
+
+def schedule(address_id, timestamp):
+    _next[address_id] = timestamp
+    heapq.heappush(_heap, (timestamp, address_id))
+    metrics.gauge_set('address_poll_scheduled', len(_next))
+
+def _schedule_next(address_id, viewed_at, checked_at):
+    schedule(address_id, checked_at + check_interval(viewed_at, checked_at))
+
+def viewed(crypto_address):
+    # check right away (and keep checking aggressively), wakes the drain greenlet, the other instances leave the view
+    # to the lease holder which picks it up from 'viewed_at' in '_sync_views()'
+    if not leases.held(LEASE):
+        return
+    schedule(crypto_address.id, time.time())
+    _wakeup.set()
+
+def _load():
+    # (re)builds the schedule from the database, when we start or take over from another instance
+    _heap.clear()
+    _next.clear()
+    with app.app_context():
+        for address_id, viewed_at, checked_at in CryptoAddress.poll_schedule(db.session):
+            _schedule_next(address_id, viewed_at, checked_at)
+    logger.info('scheduled %d deposit addresses', len(_next))
+
+def _sync_views(since):
+    # addresses viewed on the other app instances are checked right away too
+    now = time.time()
+    with app.app_context():
+        views = CryptoAddress.viewed_since(db.session, since)
+    for address_id, _ in views:
+        if _next.get(address_id, now + 1) > now:
+            schedule(address_id, now)
+
+def _pop_due(now):
+    address_ids = []
+    while _heap and _heap[0][0] <= now and len(address_ids) < BATCH_SIZE:
+        timestamp, address_id = heapq.heappop(_heap)
+        if _next.get(address_id) == timestamp:
+            del _next[address_id]
+            address_ids.append(address_id)
+    return address_ids
+
+def _check(address_ids):
+    start = time.time()
+    with app.app_context():
+        addrs = CryptoAddress.from_ids(db.session, address_ids)
+        views = {addr.id: addr.viewed_at for addr in addrs}
+        checked_at = int(time.time())
+        depwith.crypto_deposits_check(db.session, addrs)
+    for address_id, viewed_at in views.items():
+        # the address may have been viewed (and so rescheduled) while we were checking it
+        if address_id not in _next:
+            _schedule_next(address_id, viewed_at, checked_at)
+    metrics.counter_inc('address_poll_checks', len(address_ids))
+    metrics.timing_record('address_poll_round', time.time() - start)
+
+def _run():
+    leader = False
+    synced_at = 0
+    while True:
+        # only the instance holding the lease checks the addresses
+        if not leases.held(LEASE):
+            leader = False
+            gevent.sleep(ACTIVE_INTERVAL)
+            continue
+        now = time.time()
+        if not leader:
+            _load()
+            leader = True
+            synced_at = now
+        elif now - synced_at >= ACTIVE_INTERVAL:
+            try:
+                # the view timestamps are whole seconds
+                _sync_views(int(synced_at) - 1)
+                synced_at = now
+            except Exception: # pylint: disable=broad-except
+                logger.exception('failed to sync deposit address views')
+        address_ids = _pop_due(now)
+        if address_ids:
+            try:
+                _check(address_ids)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('failed to check %d deposit addresses', len(address_ids))
+                for address_id in address_ids:
+                    if address_id not in _next:
+                        schedule(address_id, time.time() + ACTIVE_INTERVAL)
+            continue
+        # sleep until the next check is due or an address is viewed (but wake to renew the lease and sync the views)
+        _wakeup.clear()
+        _wakeup.wait(min(_heap[0][0] - now, ACTIVE_INTERVAL) if _heap else ACTIVE_INTERVAL)
+
+def start():
+    global _greenlet # pylint: disable=global-statement
+    # the schedule is loaded once we hold the lease
+    _greenlet = gevent.spawn(_run)
+
+def stop():
+    if _greenlet:
+        _greenlet.kill()
@@ -555,6 +555,15 @@ class BrokerOrderModelView(RestrictedModelView):
             FilterByBrokerOrderStatusEqual(BrokerOrder.status, 'Search Status'), \
             FilterByBrokerOrderMarketEqual(BrokerOrder.market, 'Search Market'), ]
 
+class DeadLetterBrokerOrderModelView(BrokerOrderModelView):
+    column_list = ['token', 'date', 'user', 'market', 'side', 'base_amount', 'quote_amount', 'attempts', 'status']
+
+    def get_query(self):
+        return self.session.query(self.model).filter(self.model.status == BrokerOrder.STATUS_DEAD_LETTER)
+
+    def get_count_query(self):
+        return self.session.query(db.func.count('*')).filter(self.model.status == BrokerOrder.STATUS_DEAD_LETTER) # pylint: disable=no-member
+
 class CryptoWithdrawalModelView(RestrictedModelView):
     can_create = False
     can_delete = False
@@ -631,6 +640,7 @@ admin.add_view(RestrictedModelView(Role, db.session, category='Admin'))
 admin.add_view(RestrictedModelView(Topic, db.session, category='Admin'))
 admin.add_view(PushNotificationLocationModelView(PushNotificationLocation, db.session, category='Admin'))
 admin.add_view(BrokerOrderModelView(BrokerOrder, db.session, category='Admin'))
+admin.add_view(DeadLetterBrokerOrderModelView(BrokerOrder, db.session, category='Admin', name='Dead Letter Orders', endpoint='DeadLetterBrokerOrder'))
 admin.add_view(RestrictedModelView(ExchangeOrder, db.session, category='Admin'))
 admin.add_view(CryptoWithdrawalModelView(CryptoWithdrawal, db.session, category='Admin'))
 admin.add_view(CryptoDepositModelView(CryptoDeposit, db.session, category='Admin'))
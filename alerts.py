@@ -0,0 +1,98 @@
+from datetime import datetime
+import logging
+import time
+
+import gevent
+
+from app_core import app, db
+import assets
+from models import PriceAlert
+import dasset
+import triggers
+from triggers import ThresholdIndex, DIRECTION_BELOW, DIRECTION_ABOVE
+import websocket
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# (market, direction) -> ThresholdIndex of active price alert tokens keyed by mid price threshold
+_indexes = {}
+_fcm = None
+
+# the most registration tokens a single FCM multicast message can be sent to
+FCM_MULTICAST_MAX = 500
+
+def add(price_alert):
+    key = price_alert.market, price_alert.direction
+    if key not in _indexes:
+        _indexes[key] = ThresholdIndex(price_alert.direction)
+    _indexes[key].add(price_alert.threshold, price_alert.token)
+
+def remove(price_alert):
+    key = price_alert.market, price_alert.direction
+    if key in _indexes:
+        _indexes[key].remove(price_alert.threshold, price_alert.token)
+
+def markets():
+    return {market for (market, _), index in _indexes.items() if len(index)}
+
+def _order_book_updated(market, order_book):
+    start = time.time()
+    bid = triggers.best_price(market, order_book.bids)
+    ask = triggers.best_price(market, order_book.asks)
+    if bid is None or ask is None:
+        return
+    mid = (bid + ask) // 2
+    tokens = []
+    for direction in (DIRECTION_BELOW, DIRECTION_ABOVE):
+        index = _indexes.get((market, direction))
+        if index:
+            tokens += index.pop_crossed(mid)
+    metrics.timing_record('price_alerts_evaluate', time.time() - start)
+    if tokens:
+        logger.info('%s: %d price alerts crossed', market, len(tokens))
+        metrics.counter_inc('price_alerts_fired', len(tokens))
+        gevent.spawn(_fire, market, mid, tokens)
+
+def _notify(price_alerts, mid):
+    # alerts with the same message are pushed together in multicast messages
+    messages = {}
+    for price_alert in price_alerts:
+        websocket.price_alert_event(price_alert)
+        if not price_alert.fcm_registration_token or not _fcm:
+            continue
+        mid_dec = assets.asset_int_to_dec(price_alert.quote_asset, mid)
+        title = f'{price_alert.market} price alert'
+        body = f'{price_alert.market} is {price_alert.direction} {assets.asset_int_to_dec(price_alert.quote_asset, price_alert.threshold)} ({mid_dec})'
+        messages.setdefault((title, body), []).append(price_alert.fcm_registration_token)
+    for (title, body), registration_tokens in messages.items():
+        for n in range(0, len(registration_tokens), FCM_MULTICAST_MAX):
+            try:
+                _fcm.send_to_tokens(registration_tokens[n:n + FCM_MULTICAST_MAX], title, body, '', '')
+            except Exception: # pylint: disable=broad-except
+                logger.exception('failed to push price alert "%s"', body)
+
+def _fire(market, mid, tokens):
+    with app.app_context():
+        price_alerts = PriceAlert.fire_from_tokens(db.session, tokens, datetime.now())
+        db.session.commit()
+        logger.info('%s: fired %d price alerts', market, len(price_alerts))
+        _notify(price_alerts, mid)
+
+def reload():
+    # rebuilds the indexes from the database, this picks up the alerts created or deleted on the other app instances (an
+    # alert fired elsewhere is not fired again, 'PriceAlert.fire_from_tokens()' only fires active alerts)
+    items = {}
+    with app.app_context():
+        for price_alert in PriceAlert.all_active(db.session):
+            items.setdefault((price_alert.market, price_alert.direction), []).append((price_alert.threshold, price_alert.token))
+    indexes = {key: ThresholdIndex.from_items(key[1], key_items) for key, key_items in items.items()}
+    _indexes.clear()
+    _indexes.update(indexes)
+    logger.info('loaded %d price alerts', sum(len(index) for index in _indexes.values()))
+
+def start(fcm):
+    global _fcm # pylint: disable=global-statement
+    _fcm = fcm
+    reload()
+    dasset.order_book_listener_add(_order_book_updated)
@@ -2,19 +2,20 @@
 
 import logging
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import decimal
 
 from flask import Blueprint, request, jsonify, flash, redirect, render_template
 import flask_security
 from flask_security.utils import encrypt_password, verify_password
 from flask_security.recoverable import send_reset_password_instructions
+from sqlalchemy.exc import IntegrityError
 
 import web_utils
-from web_utils import bad_request, get_json_params, auth_request, auth_request_get_single_param, auth_request_get_params
+from web_utils import bad_request, get_json_params, get_json_params_optional, auth_request, auth_request_get_single_param, auth_request_get_params
 import utils
 import email_utils
-from models import CryptoWithdrawal, FiatDbTransaction, User, UserCreateRequest, UserUpdateEmailRequest, Permission, ApiKey, ApiKeyRequest, BrokerOrder, KycRequest, AddressBook, FiatDeposit, FiatWithdrawal, CryptoAddress, CryptoDeposit, DassetSubaccount
+from models import CryptoWithdrawal, FiatDbTransaction, User, UserCreateRequest, UserUpdateEmailRequest, Permission, ApiKey, ApiKeyRequest, BrokerOrder, KycRequest, AddressBook, FiatDeposit, FiatWithdrawal, CryptoAddress, CryptoDeposit, DassetSubaccount, DassetSubaccountAddress, PriceAlert, RecurringBuy
 from app_core import app, db, limiter, SERVER_VERSION, CLIENT_VERSION_DEPLOYED
 from security import tf_enabled_check, tf_method, tf_code_send, tf_method_set, tf_method_unset, tf_secret_init, tf_code_validate, user_datastore
 import payments_core
@@ -24,17 +25,29 @@ import assets
 from assets import MarketSide, market_side_is
 import websocket
 import fiatdb_core
+import depwith
 import broker
 import coordinator
 import tripwire
+import triggers
+import alerts
+import recurring
+import addresspoll
+import subaccountpool
 
 logger = logging.getLogger(__name__)
 api = Blueprint('api', __name__, template_folder='templates')
 limiter.limit('100/minute')(api)
 
 def _user_subaccount_get_or_create(db_session, user):
-    # create subaccount for user
     if not user.dasset_subaccount:
+        # claim a provisioned subaccount from the pool
+        subaccount = DassetSubaccount.claim(db_session, user)
+        if subaccount:
+            subaccountpool.claimed()
+            return subaccount
+        # the pool is empty, create subaccount for user
+        logger.warning('subaccount pool empty, creating subaccount for %s', user.email)
         subaccount_id = dasset.subaccount_create(user.token)
         if not subaccount_id:
             logger.error('failed to create subaccount for %s', user.email)
@@ -467,7 +480,10 @@ def markets_req():
     _, err_response = auth_request(db)
     if err_response:
         return err_response
-    return jsonify(markets=dasset.markets_req())
+    markets, stale = dasset.markets_read()
+    if markets is None:
+        return bad_request(web_utils.NOT_AVAILABLE)
+    return jsonify(markets=markets, stale=stale)
 
 @api.route('/order_book', methods=['POST'])
 def order_book_req():
@@ -479,8 +495,11 @@ def order_book_req():
     base_asset, quote_asset = assets.assets_from_market(market)
     base_asset_withdraw_fee = assets.asset_withdraw_fee(base_asset)
     quote_asset_withdraw_fee = assets.asset_withdraw_fee(quote_asset)
-    order_book, broker_fee = dasset.order_book_req(market)
-    return jsonify(bids=order_book.bids, asks=order_book.asks, base_asset_withdraw_fee=str(base_asset_withdraw_fee), quote_asset_withdraw_fee=str(quote_asset_withdraw_fee), broker_fee=str(broker_fee))
+    order_book_result, stale = dasset.order_book_read(market)
+    if not order_book_result:
+        return bad_request(web_utils.NOT_AVAILABLE)
+    order_book, broker_fee = order_book_result
+    return jsonify(bids=order_book.bids, asks=order_book.asks, base_asset_withdraw_fee=str(base_asset_withdraw_fee), quote_asset_withdraw_fee=str(quote_asset_withdraw_fee), broker_fee=str(broker_fee), stale=stale)
 
 @api.route('/balances', methods=['POST'])
 def balances_req():
@@ -499,26 +518,30 @@ def crypto_deposit_address_req():
     asset, api_key, err_response = auth_request_get_single_param(db, 'asset')
     if err_response:
         return err_response
-    if not api_key.user.dasset_subaccount:
-        logger.error('user %s dasset subaccount does not exist', api_key.user.email)
-        return bad_request(web_utils.FAILED_EXCHANGE)
     if not assets.asset_is_crypto(asset):
         return bad_request(web_utils.INVALID_ASSET)
     # get subaccount for user
-    subaccount = _user_subaccount_get_or_create(db.session, api_key.user)
-    if not subaccount:
-        return bad_request(web_utils.FAILED_EXCHANGE)
-    db.session.commit() # commit early so we only create subaccount once
+    with coordinator.user_lock(api_key.user.id):
+        subaccount = _user_subaccount_get_or_create(db.session, api_key.user)
+        if not subaccount:
+            return bad_request(web_utils.FAILED_EXCHANGE)
+        db.session.commit() # commit early so we only create subaccount once
     # create address
     crypto_address = CryptoAddress.from_asset(db.session, api_key.user, asset)
     if not crypto_address:
-        address = dasset.address_get_or_create(asset, subaccount.subaccount_id)
+        # pool subaccounts come with their addresses provisioned
+        pool_address = DassetSubaccountAddress.from_subaccount_asset(db.session, subaccount, asset)
+        if pool_address:
+            address = pool_address.address
+        else:
+            address = dasset.address_get_or_create(asset, subaccount.subaccount_id)
         if not address:
             return bad_request(web_utils.FAILED_EXCHANGE)
         crypto_address = CryptoAddress(api_key.user, asset, address)
     crypto_address.viewed_at = int(datetime.timestamp(datetime.now()))
     db.session.add(crypto_address)
     db.session.commit()
+    addresspoll.viewed(crypto_address)
     return jsonify(address=crypto_address.address, asset=asset)
 
 @api.route('/crypto_deposits', methods=['POST'])
@@ -564,25 +587,46 @@ def crypto_withdrawal_create_req():
         else:
             entry = AddressBook(api_key.user, asset, recipient, recipient_description)
         db.session.add(entry)
-    # create withdrawal
-    with coordinator.lock:
+    if not dasset.funds_available_us(asset, amount_dec):
+        return bad_request(web_utils.INSUFFICIENT_LIQUIDITY)
+    amount_int = assets.asset_dec_to_int(asset, amount_dec)
+    # reserve the funds
+    with coordinator.user_lock(api_key.user.id):
         if not fiatdb_core.funds_available_user(db.session, api_key.user, asset, amount_dec):
             return bad_request(web_utils.INSUFFICIENT_BALANCE)
-        if not dasset.funds_available_us(asset, amount_dec):
-            return bad_request(web_utils.INSUFFICIENT_LIQUIDITY)
-        withdrawal_id = dasset.crypto_withdrawal_create(asset, amount_dec, recipient)
+        ftx = fiatdb_core.tx_create(db.session, api_key.user, FiatDbTransaction.ACTION_HOLD, asset, amount_int, f'crypto withdrawal hold: {recipient}')
+        if not ftx:
+            logger.error('failed to create fiatdb hold for crypto withdrawal to %s', recipient)
+            return bad_request(web_utils.FAILED_PAYMENT_CREATE)
+        db.session.add(ftx)
+        db.session.commit()
+    # create withdrawal, outside of the lock as the hold already counts against the users balance
+    withdrawal_id, rejected = dasset.crypto_withdrawal_create(asset, amount_dec, recipient)
+    if not withdrawal_id and not rejected:
+        # the withdrawal may have been sent, keep the hold until the withdrawal sweep reconciles it against the exchange
+        crypto_withdrawal = CryptoWithdrawal(api_key.user, asset, amount_int, recipient, None)
+        crypto_withdrawal.status = crypto_withdrawal.STATUS_UNKNOWN
+        crypto_withdrawal.hold = ftx
+        db.session.add(crypto_withdrawal)
+        db.session.commit()
+        msg = f'{api_key.user.email}, {asset}, {amount_dec}, {recipient}, withdrawal {crypto_withdrawal.token}'
+        logger.error('crypto withdrawal outcome unknown - %s', msg)
+        email_utils.send_email(logger, 'crypto withdrawal outcome unknown', msg)
+        websocket.crypto_withdrawal_new_event(crypto_withdrawal)
+        return bad_request(web_utils.FAILED_EXCHANGE)
+    with coordinator.user_lock(api_key.user.id):
         if not withdrawal_id:
+            fiatdb_core.hold_release(ftx)
+            db.session.add(ftx)
+            db.session.commit()
             return bad_request(web_utils.FAILED_EXCHANGE)
-        amount_int = assets.asset_dec_to_int(asset, amount_dec)
         crypto_withdrawal = CryptoWithdrawal(api_key.user, asset, amount_int, recipient, withdrawal_id)
-        ftx = fiatdb_core.tx_create(db.session, api_key.user, FiatDbTransaction.ACTION_DEBIT, asset, amount_int, f'crypto withdrawal: {crypto_withdrawal.token}')
-        if not ftx:
-            logger.error('failed to create fiatdb transaction for crypto withdrawal %s', crypto_withdrawal.token)
-            return bad_request(web_utils.FAILED_PAYMENT_CREATE)
+        fiatdb_core.hold_confirm(ftx, f'crypto withdrawal: {crypto_withdrawal.token}')
         db.session.add(crypto_withdrawal)
         db.session.add(ftx)
         db.session.commit()
     websocket.crypto_withdrawal_new_event(crypto_withdrawal)
+    depwith.crypto_withdrawal_confirm_start(crypto_withdrawal)
     return jsonify(withdrawal=crypto_withdrawal.to_json())
 
 @api.route('/crypto_withdrawals', methods=['POST'])
@@ -615,16 +659,23 @@ def fiat_deposit_create_req():
     amount_dec = decimal.Decimal(amount_dec)
     if amount_dec <= 0:
         return bad_request(web_utils.INVALID_AMOUNT)
+    # older clients need the payment url in the response so they can wait for it, 'wait' is in seconds and is capped at FIAT_DEPOSIT_WAIT_MAX_SECONDS
+    wait, = get_json_params_optional(request.get_json(force=True), ['wait'])
+    if wait is not None and (isinstance(wait, bool) or not isinstance(wait, (int, float)) or wait < 0):
+        return bad_request(web_utils.INVALID_PARAMETER)
+    if wait:
+        wait = min(wait, app.config['FIAT_DEPOSIT_WAIT_MAX_SECONDS'])
     amount_int = assets.asset_dec_to_int(asset, amount_dec)
+    # the payment url is null until the windcave session is created in the background
     fiat_deposit = FiatDeposit(api_key.user, asset, amount_int)
-    payment_request = payments_core.payment_create(amount_int, fiat_deposit.expiry)
-    if not payment_request:
-        return bad_request(web_utils.FAILED_PAYMENT_CREATE)
-    fiat_deposit.windcave_payment_request = payment_request
     db.session.add(fiat_deposit)
-    db.session.add(payment_request)
     db.session.commit()
     websocket.fiat_deposit_new_event(fiat_deposit)
+    depwith.fiat_deposit_session_create_start(fiat_deposit)
+    if wait:
+        if depwith.fiat_deposit_session_wait(db.session, fiat_deposit, wait):
+            if fiat_deposit.status == fiat_deposit.STATUS_CANCELLED:
+                return bad_request(web_utils.FAILED_PAYMENT_CREATE)
     return jsonify(deposit=fiat_deposit.to_json())
 
 @api.route('/fiat_deposits', methods=['POST'])
@@ -677,7 +728,7 @@ def fiat_withdrawal_create_req():
         else:
             entry = AddressBook(api_key.user, asset, recipient, recipient_description)
         db.session.add(entry)
-    with coordinator.lock:
+    with coordinator.user_lock(api_key.user.id):
         balance = fiatdb_core.user_balance(db.session, asset, api_key.user)
         balance_dec = assets.asset_int_to_dec(asset, balance)
         if balance_dec < amount_dec:
@@ -729,7 +780,24 @@ def address_book_req():
     entries = [entry.to_json() for entry in entries]
     return jsonify(entries=entries, asset=asset)
 
-def _broker_order_validate(user, market, side, amount_dec):
+def _broker_order_quoted(user, market, side, amount_dec, quote_token):
+    def return_error(err_response):
+        return err_response, None
+    base_asset, quote_asset = assets.assets_from_market(market)
+    base_amount = assets.asset_dec_to_int(base_asset, amount_dec)
+    quote = broker.quote_token_redeem(quote_token, user, market, side.value, base_amount)
+    if not quote:
+        return return_error(bad_request(web_utils.INVALID_QUOTE))
+    order = BrokerOrder(user, market, side.value, base_asset, quote_asset, base_amount, quote.quote_amount)
+    order.expiry = datetime.fromtimestamp(quote.expiry)
+    order.quote_key = quote.key
+    # the quote was firm when it was issued so only the users balance needs to be checked again
+    err_msg = broker.order_check_funds(db.session, order, check_exchange=False)
+    if err_msg:
+        return return_error(bad_request(err_msg))
+    return None, order
+
+def _broker_order_validate(user, market, side, amount_dec, quote_token=None):
     def return_error(err_response):
         return err_response, None
     if market not in assets.MARKETS:
@@ -738,6 +806,10 @@ def _broker_order_validate(user, market, side, amount_dec):
     if not side:
         return return_error(bad_request(web_utils.INVALID_SIDE))
     amount_dec = decimal.Decimal(amount_dec)
+    if quote_token is not None and not isinstance(quote_token, str):
+        return return_error(bad_request(web_utils.INVALID_PARAMETER))
+    if quote_token:
+        return _broker_order_quoted(user, market, side, amount_dec, quote_token)
     if market_side_is(side, MarketSide.BID):
         quote_amount_dec, err = dasset.bid_quote_amount(market, amount_dec)
     else:
@@ -770,7 +842,7 @@ def broker_order_validate():
     err_response, order = _broker_order_validate(api_key.user, market, side, amount_dec)
     if err_response:
         return err_response
-    return jsonify(broker_order=order.to_json())
+    return jsonify(broker_order=order.to_json(), quote_token=broker.quote_token_create(order))
 
 @api.route('/broker_order_create', methods=['POST'])
 def broker_order_create():
@@ -778,13 +850,19 @@ def broker_order_create():
     if err_response:
         return err_response
     market, side, amount_dec = params
+    quote_token, = get_json_params_optional(request.get_json(force=True), ['quote_token'])
     if not api_key.user.kyc_validated():
         return bad_request(web_utils.KYC_NOT_VALIDATED)
-    err_response, order = _broker_order_validate(api_key.user, market, side, amount_dec)
+    err_response, order = _broker_order_validate(api_key.user, market, side, amount_dec, quote_token)
     if err_response:
         return err_response
     db.session.add(order)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the quote token was already redeemed
+        db.session.rollback()
+        return bad_request(web_utils.INVALID_QUOTE)
     websocket.broker_order_new_event(order)
     return jsonify(broker_order=order.to_json())
 
@@ -814,9 +892,19 @@ def broker_order_accept():
     side = MarketSide.parse(broker_order.side)
     if not side:
         return bad_request(web_utils.INVALID_SIDE)
-    with coordinator.lock:
-        # check funds
-        err_msg = broker.order_check_funds(db.session, broker_order)
+    # check exchange liquidity before taking the lock
+    err_msg = broker.order_check_funds(db.session, broker_order, check_user=False)
+    if err_msg:
+        return bad_request(err_msg)
+    # the order may be being accepted by a concurrent request (or expired by the sweep)
+    if not BrokerOrder.claim_row(db.session, broker_order.id):
+        return bad_request(web_utils.INVALID_STATUS)
+    with coordinator.user_lock(broker_order.user.id):
+        if broker_order.status != broker_order.STATUS_CREATED:
+            db.session.rollback()
+            return bad_request(web_utils.INVALID_STATUS)
+        # check funds user has with us
+        err_msg = broker.order_check_funds(db.session, broker_order, check_exchange=False)
         if err_msg:
             return bad_request(err_msg)
         # debit users account
@@ -835,9 +923,88 @@ def broker_order_accept():
         db.session.add(broker_order)
         db.session.add(ftx)
         db.session.commit()
+    broker.broker_market_queue.put(broker_order.market)
     websocket.broker_order_update_event(broker_order)
     return jsonify(broker_order=broker_order.to_json())
 
+@api.route('/broker_order_trigger_create', methods=['POST'])
+def broker_order_trigger_create():
+    params, api_key, err_response = auth_request_get_params(db, ["market", "side", "amount_dec", "order_type", "trigger_price_dec"])
+    if err_response:
+        return err_response
+    market, side, amount_dec, order_type, trigger_price_dec = params
+    slippage_bps, = get_json_params_optional(request.get_json(force=True), ['slippage_bps'])
+    if slippage_bps is None:
+        slippage_bps = app.config['TRIGGER_SLIPPAGE_BPS']
+    if not isinstance(slippage_bps, int) or isinstance(slippage_bps, bool) or not 0 <= slippage_bps < 10000:
+        return bad_request(web_utils.INVALID_PARAMETER)
+    if not api_key.user.kyc_validated():
+        return bad_request(web_utils.KYC_NOT_VALIDATED)
+    if market not in assets.MARKETS:
+        return bad_request(web_utils.INVALID_MARKET)
+    side = MarketSide.parse(side)
+    if not side:
+        return bad_request(web_utils.INVALID_SIDE)
+    if order_type not in (BrokerOrder.ORDER_TYPE_LIMIT, BrokerOrder.ORDER_TYPE_STOP):
+        return bad_request(web_utils.INVALID_PARAMETER)
+    amount_dec = decimal.Decimal(amount_dec)
+    trigger_price_dec = decimal.Decimal(trigger_price_dec)
+    if amount_dec <= 0 or trigger_price_dec <= 0:
+        return bad_request(web_utils.INVALID_AMOUNT)
+    dasset_market = dasset.market_req(market)
+    if not dasset_market:
+        return bad_request(web_utils.NOT_AVAILABLE)
+    if amount_dec < decimal.Decimal(dasset_market.min_trade):
+        return bad_request(web_utils.AMOUNT_TOO_LOW)
+    # the order is requoted when triggered, a bid reserves enough for the trigger price plus the slippage (and the broker
+    # fee) and is refunded what it does not use, an ask shows the trigger price (less the broker fee)
+    base_asset, quote_asset = assets.assets_from_market(market)
+    fee = dasset.BROKER_ORDER_FEE / decimal.Decimal(100)
+    if side is MarketSide.BID:
+        slippage = decimal.Decimal(slippage_bps) / decimal.Decimal(10000)
+        quote_amount_dec = amount_dec * trigger_price_dec * (decimal.Decimal(1) + slippage) * (decimal.Decimal(1) + fee)
+    else:
+        quote_amount_dec = amount_dec * trigger_price_dec * (decimal.Decimal(1) - fee)
+    base_amount = assets.asset_dec_to_int(base_asset, amount_dec)
+    quote_amount = assets.asset_dec_to_int(quote_asset, quote_amount_dec)
+    broker_order = BrokerOrder(api_key.user, market, side.value, base_asset, quote_asset, base_amount, quote_amount)
+    broker_order.order_type = order_type
+    broker_order.trigger_price = assets.asset_dec_to_int(quote_asset, trigger_price_dec)
+    broker_order.slippage_bps = slippage_bps
+    broker_order.expiry = datetime.now() + timedelta(days=BrokerOrder.DAYS_TRIGGER_EXPIRY)
+    asset, amount_int = broker.order_required_asset(broker_order, side)
+    with coordinator.user_lock(api_key.user.id):
+        # check funds user has with us
+        err_msg = broker.order_check_funds(db.session, broker_order, check_exchange=False)
+        if err_msg:
+            return bad_request(err_msg)
+        # debit users account
+        ftx = fiatdb_core.tx_create(db.session, api_key.user, FiatDbTransaction.ACTION_DEBIT, asset, amount_int, f'broker order: {broker_order.token}')
+        if not ftx:
+            logger.error('failed to create fiatdb transaction for broker order %s', broker_order.token)
+            return bad_request(web_utils.FAILED_PAYMENT_CREATE)
+        broker_order.status = broker_order.STATUS_WAITING
+        db.session.add(broker_order)
+        db.session.add(ftx)
+        db.session.commit()
+    triggers.add(broker_order)
+    websocket.broker_order_new_event(broker_order)
+    return jsonify(broker_order=broker_order.to_json())
+
+@api.route('/broker_order_cancel', methods=['POST'])
+def broker_order_cancel():
+    token, api_key, err_response = auth_request_get_single_param(db, 'token')
+    if err_response:
+        return err_response
+    broker_order = BrokerOrder.from_token(db.session, token)
+    if not broker_order or broker_order.user != api_key.user:
+        return bad_request(web_utils.NOT_FOUND)
+    err_msg = broker.broker_order_cancel(db.session, broker_order)
+    if err_msg:
+        return bad_request(err_msg)
+    triggers.remove(broker_order)
+    return jsonify(broker_order=broker_order.to_json())
+
 @api.route('/broker_orders', methods=['POST'])
 def broker_orders():
     params, api_key, err_response = auth_request_get_params(db, ["offset", "limit"])
@@ -854,3 +1021,110 @@ def broker_orders():
     orders = [order.to_json() for order in orders]
     total = BrokerOrder.total_for_user(db.session, api_key.user)
     return jsonify(dict(broker_orders=orders, offset=offset, limit=limit, total=total))
+
+@api.route('/recurring_buy_create', methods=['POST'])
+def recurring_buy_create():
+    params, api_key, err_response = auth_request_get_params(db, ["market", "amount_dec", "interval_days"])
+    if err_response:
+        return err_response
+    market, amount_dec, interval_days = params
+    first_run, = get_json_params_optional(request.get_json(force=True), ['first_run'])
+    if not api_key.user.kyc_validated():
+        return bad_request(web_utils.KYC_NOT_VALIDATED)
+    if market not in assets.MARKETS:
+        return bad_request(web_utils.INVALID_MARKET)
+    if not isinstance(interval_days, int) or interval_days < 1:
+        return bad_request(web_utils.INVALID_PARAMETER)
+    amount_dec = decimal.Decimal(amount_dec)
+    if amount_dec <= 0:
+        return bad_request(web_utils.INVALID_AMOUNT)
+    next_run_at = datetime.now()
+    if first_run:
+        try:
+            next_run_at = datetime.fromisoformat(first_run)
+        except ValueError:
+            return bad_request(web_utils.INVALID_PARAMETER)
+    _, quote_asset = assets.assets_from_market(market)
+    recurring_buy = RecurringBuy(api_key.user, market, quote_asset, assets.asset_dec_to_int(quote_asset, amount_dec), interval_days, next_run_at)
+    db.session.add(recurring_buy)
+    db.session.commit()
+    recurring.add(recurring_buy)
+    return jsonify(recurring_buy=recurring_buy.to_json())
+
+@api.route('/recurring_buys', methods=['POST'])
+def recurring_buys():
+    params, api_key, err_response = auth_request_get_params(db, ["offset", "limit"])
+    if err_response:
+        return err_response
+    offset, limit = params
+    if not isinstance(offset, int):
+        return bad_request(web_utils.INVALID_PARAMETER)
+    if not isinstance(limit, int):
+        return bad_request(web_utils.INVALID_PARAMETER)
+    if limit > 1000:
+        return bad_request(web_utils.LIMIT_TOO_LARGE)
+    recurring_buys_ = RecurringBuy.from_user(db.session, api_key.user, offset, limit)
+    recurring_buys_ = [recurring_buy.to_json() for recurring_buy in recurring_buys_]
+    total = RecurringBuy.total_for_user(db.session, api_key.user)
+    return jsonify(dict(recurring_buys=recurring_buys_, offset=offset, limit=limit, total=total))
+
+@api.route('/recurring_buy_cancel', methods=['POST'])
+def recurring_buy_cancel():
+    token, api_key, err_response = auth_request_get_single_param(db, 'token')
+    if err_response:
+        return err_response
+    recurring_buy = RecurringBuy.from_token(db.session, token)
+    if not recurring_buy or recurring_buy.user != api_key.user:
+        return bad_request(web_utils.NOT_FOUND)
+    if recurring_buy.status != RecurringBuy.STATUS_ACTIVE:
+        return bad_request(web_utils.INVALID_STATUS)
+    recurring_buy.status = RecurringBuy.STATUS_CANCELLED
+    db.session.add(recurring_buy)
+    db.session.commit()
+    recurring.remove(recurring_buy)
+    return jsonify(recurring_buy=recurring_buy.to_json())
+
+@api.route('/price_alert_create', methods=['POST'])
+def price_alert_create():
+    params, api_key, err_response = auth_request_get_params(db, ["market", "direction", "threshold_dec"])
+    if err_response:
+        return err_response
+    market, direction, threshold_dec = params
+    fcm_registration_token, = get_json_params_optional(request.get_json(force=True), ['fcm_registration_token'])
+    if market not in assets.MARKETS:
+        return bad_request(web_utils.INVALID_MARKET)
+    if direction not in (triggers.DIRECTION_BELOW, triggers.DIRECTION_ABOVE):
+        return bad_request(web_utils.INVALID_PARAMETER)
+    threshold_dec = decimal.Decimal(threshold_dec)
+    if threshold_dec <= 0:
+        return bad_request(web_utils.INVALID_AMOUNT)
+    _, quote_asset = assets.assets_from_market(market)
+    price_alert = PriceAlert(api_key.user, market, direction, quote_asset, assets.asset_dec_to_int(quote_asset, threshold_dec), fcm_registration_token)
+    db.session.add(price_alert)
+    db.session.commit()
+    alerts.add(price_alert)
+    return jsonify(price_alert=price_alert.to_json())
+
+@api.route('/price_alerts', methods=['POST'])
+def price_alerts():
+    api_key, err_response = auth_request(db)
+    if err_response:
+        return err_response
+    price_alerts_ = [price_alert.to_json() for price_alert in PriceAlert.active_for_user(db.session, api_key.user)]
+    return jsonify(price_alerts=price_alerts_)
+
+@api.route('/price_alert_delete', methods=['POST'])
+def price_alert_delete():
+    token, api_key, err_response = auth_request_get_single_param(db, 'token')
+    if err_response:
+        return err_response
+    price_alert = PriceAlert.from_token(db.session, token)
+    if not price_alert or price_alert.user != api_key.user:
+        return bad_request(web_utils.NOT_FOUND)
+    if price_alert.status != PriceAlert.STATUS_ACTIVE:
+        return bad_request(web_utils.INVALID_PARAMETER)
+    price_alert.status = PriceAlert.STATUS_DELETED
+    db.session.add(price_alert)
+    db.session.commit()
+    alerts.remove(price_alert)
+    return jsonify(price_alert=price_alert.to_json())
@@ -1,5 +1,10 @@
 #!/usr/bin/python3
 
+# patch the standard library before anything else imports it so blocking network calls yield to other greenlets
+from gevent import monkey
+monkey.patch_all()
+
+# pylint: disable=wrong-import-position
 import sys
 import logging
 import signal
@@ -97,7 +102,8 @@ if __name__ == "__main__":
     ch = log_utils.setup_logging(logger, logging.INFO)
     log_utils.log_socketio_version(logger)
 
-    # create tables
+    # create tables (this only creates missing tables, an existing database is upgraded by applying the scripts in
+    # 'migrations/' in order)
     db.create_all()
     create_role(Role.ROLE_ADMIN, "super user")
     create_role(Role.ROLE_FINANCE, "Can view all records, can authorize rewards")
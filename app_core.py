@@ -46,6 +46,13 @@ if os.getenv("LOGO_URL_SRC"):
 else:
     app.config["LOGO_URL_SRC"] = "/static/assets/img/logo.png"
 
+# scheme of the external urls built outside of a request (eg the windcave callback urls of the fiat deposit session
+# workers), within a request the scheme of the request is used
+if os.getenv("PREFERRED_URL_SCHEME"):
+    app.config["PREFERRED_URL_SCHEME"] = os.getenv("PREFERRED_URL_SCHEME")
+else:
+    app.config["PREFERRED_URL_SCHEME"] = "https"
+
 if os.getenv("LOGO_EMAIL_SRC"):
     app.config["LOGO_EMAIL_SRC"] = os.getenv("LOGO_EMAIL_SRC")
 else:
@@ -108,6 +115,136 @@ if os.getenv('EXCHANGE_ACCOUNT_MOCK'):
 else:
     app.config['EXCHANGE_ACCOUNT_MOCK'] = False
 
+if os.getenv('DASSET_URL'):
+    app.config['DASSET_URL'] = os.getenv('DASSET_URL')
+else:
+    app.config['DASSET_URL'] = 'https://api.dassetx.com'
+if os.getenv('DASSET_TIMEOUT'):
+    app.config['DASSET_TIMEOUT'] = float(os.getenv('DASSET_TIMEOUT'))
+else:
+    app.config['DASSET_TIMEOUT'] = 10.0
+if os.getenv('DASSET_BREAKER_FAILURES'):
+    app.config['DASSET_BREAKER_FAILURES'] = int(os.getenv('DASSET_BREAKER_FAILURES'))
+else:
+    app.config['DASSET_BREAKER_FAILURES'] = 5
+if os.getenv('DASSET_BREAKER_SLOW_CALL'):
+    app.config['DASSET_BREAKER_SLOW_CALL'] = float(os.getenv('DASSET_BREAKER_SLOW_CALL'))
+else:
+    app.config['DASSET_BREAKER_SLOW_CALL'] = 5.0
+if os.getenv('DASSET_BREAKER_COOLDOWN'):
+    app.config['DASSET_BREAKER_COOLDOWN'] = float(os.getenv('DASSET_BREAKER_COOLDOWN'))
+else:
+    app.config['DASSET_BREAKER_COOLDOWN'] = 30.0
+if os.getenv('DASSET_CACHE_MAX_AGE'):
+    app.config['DASSET_CACHE_MAX_AGE'] = int(os.getenv('DASSET_CACHE_MAX_AGE'))
+else:
+    app.config['DASSET_CACHE_MAX_AGE'] = 3600
+if os.getenv('DASSET_MAX_CONCURRENCY'):
+    app.config['DASSET_MAX_CONCURRENCY'] = int(os.getenv('DASSET_MAX_CONCURRENCY'))
+else:
+    app.config['DASSET_MAX_CONCURRENCY'] = 10
+if os.getenv('DASSET_RATE_LIMIT'):
+    app.config['DASSET_RATE_LIMIT'] = float(os.getenv('DASSET_RATE_LIMIT'))
+else:
+    app.config['DASSET_RATE_LIMIT'] = 10.0
+if os.getenv('DASSET_RATE_LIMIT_BURST'):
+    app.config['DASSET_RATE_LIMIT_BURST'] = int(os.getenv('DASSET_RATE_LIMIT_BURST'))
+else:
+    app.config['DASSET_RATE_LIMIT_BURST'] = 20
+if os.getenv('BROKER_ORDER_WORKERS'):
+    app.config['BROKER_ORDER_WORKERS'] = int(os.getenv('BROKER_ORDER_WORKERS'))
+else:
+    app.config['BROKER_ORDER_WORKERS'] = 4
+if os.getenv('BROKER_ORDER_POOL_SIZE'):
+    app.config['BROKER_ORDER_POOL_SIZE'] = int(os.getenv('BROKER_ORDER_POOL_SIZE'))
+else:
+    app.config['BROKER_ORDER_POOL_SIZE'] = 10
+if os.getenv('BROKER_ORDER_MAX_ATTEMPTS'):
+    app.config['BROKER_ORDER_MAX_ATTEMPTS'] = int(os.getenv('BROKER_ORDER_MAX_ATTEMPTS'))
+else:
+    app.config['BROKER_ORDER_MAX_ATTEMPTS'] = 8
+if os.getenv('BROKER_ORDER_RETRY_BASE'):
+    app.config['BROKER_ORDER_RETRY_BASE'] = float(os.getenv('BROKER_ORDER_RETRY_BASE'))
+else:
+    app.config['BROKER_ORDER_RETRY_BASE'] = 30.0
+if os.getenv('BROKER_ORDER_RETRY_MAX'):
+    app.config['BROKER_ORDER_RETRY_MAX'] = float(os.getenv('BROKER_ORDER_RETRY_MAX'))
+else:
+    app.config['BROKER_ORDER_RETRY_MAX'] = 3600.0
+if os.getenv('TRIGGER_REFRESH_SECONDS'):
+    app.config['TRIGGER_REFRESH_SECONDS'] = int(os.getenv('TRIGGER_REFRESH_SECONDS'))
+else:
+    app.config['TRIGGER_REFRESH_SECONDS'] = 10
+if os.getenv('TRIGGER_RELOAD_SECONDS'):
+    app.config['TRIGGER_RELOAD_SECONDS'] = int(os.getenv('TRIGGER_RELOAD_SECONDS'))
+else:
+    app.config['TRIGGER_RELOAD_SECONDS'] = 60
+if os.getenv('TRIGGER_SLIPPAGE_BPS'):
+    app.config['TRIGGER_SLIPPAGE_BPS'] = int(os.getenv('TRIGGER_SLIPPAGE_BPS'))
+else:
+    app.config['TRIGGER_SLIPPAGE_BPS'] = 100
+if os.getenv('BROKER_NETTING_WINDOW'):
+    app.config['BROKER_NETTING_WINDOW'] = float(os.getenv('BROKER_NETTING_WINDOW'))
+else:
+    app.config['BROKER_NETTING_WINDOW'] = 2.0
+if os.getenv('COMMIT_BATCH_SIZE'):
+    app.config['COMMIT_BATCH_SIZE'] = int(os.getenv('COMMIT_BATCH_SIZE'))
+else:
+    app.config['COMMIT_BATCH_SIZE'] = 50
+if os.getenv('FIAT_DEPOSIT_WORKERS'):
+    app.config['FIAT_DEPOSIT_WORKERS'] = int(os.getenv('FIAT_DEPOSIT_WORKERS'))
+else:
+    app.config['FIAT_DEPOSIT_WORKERS'] = 2
+if os.getenv('CRYPTO_WITHDRAWAL_CONFIRM_WORKERS'):
+    app.config['CRYPTO_WITHDRAWAL_CONFIRM_WORKERS'] = int(os.getenv('CRYPTO_WITHDRAWAL_CONFIRM_WORKERS'))
+else:
+    app.config['CRYPTO_WITHDRAWAL_CONFIRM_WORKERS'] = 2
+# the longest '/fiat_deposit_create' will block for a 'wait' parameter, larger values are capped to this
+if os.getenv('FIAT_DEPOSIT_WAIT_MAX_SECONDS'):
+    app.config['FIAT_DEPOSIT_WAIT_MAX_SECONDS'] = int(os.getenv('FIAT_DEPOSIT_WAIT_MAX_SECONDS'))
+else:
+    app.config['FIAT_DEPOSIT_WAIT_MAX_SECONDS'] = 15
+if os.getenv('SUBACCOUNT_POOL_SIZE'):
+    app.config['SUBACCOUNT_POOL_SIZE'] = int(os.getenv('SUBACCOUNT_POOL_SIZE'))
+else:
+    app.config['SUBACCOUNT_POOL_SIZE'] = 20
+if os.getenv('SUBACCOUNT_POOL_INTERVAL'):
+    app.config['SUBACCOUNT_POOL_INTERVAL'] = int(os.getenv('SUBACCOUNT_POOL_INTERVAL'))
+else:
+    app.config['SUBACCOUNT_POOL_INTERVAL'] = 60
+if os.getenv('FIAT_DEPOSIT_SWEEP_MINUTES'):
+    app.config['FIAT_DEPOSIT_SWEEP_MINUTES'] = int(os.getenv('FIAT_DEPOSIT_SWEEP_MINUTES'))
+else:
+    app.config['FIAT_DEPOSIT_SWEEP_MINUTES'] = 5
+if os.getenv('ADDRESS_POLL_ACTIVE_INTERVAL'):
+    app.config['ADDRESS_POLL_ACTIVE_INTERVAL'] = int(os.getenv('ADDRESS_POLL_ACTIVE_INTERVAL'))
+else:
+    app.config['ADDRESS_POLL_ACTIVE_INTERVAL'] = 20
+if os.getenv('ADDRESS_POLL_ACTIVE_SECONDS'):
+    app.config['ADDRESS_POLL_ACTIVE_SECONDS'] = int(os.getenv('ADDRESS_POLL_ACTIVE_SECONDS'))
+else:
+    app.config['ADDRESS_POLL_ACTIVE_SECONDS'] = 600
+if os.getenv('ADDRESS_POLL_MAX_INTERVAL'):
+    app.config['ADDRESS_POLL_MAX_INTERVAL'] = int(os.getenv('ADDRESS_POLL_MAX_INTERVAL'))
+else:
+    app.config['ADDRESS_POLL_MAX_INTERVAL'] = 86400
+if os.getenv('ADDRESS_POLL_IDLE_SECONDS'):
+    app.config['ADDRESS_POLL_IDLE_SECONDS'] = int(os.getenv('ADDRESS_POLL_IDLE_SECONDS'))
+else:
+    app.config['ADDRESS_POLL_IDLE_SECONDS'] = 30 * 86400
+if os.getenv('ADDRESS_POLL_IDLE_INTERVAL'):
+    app.config['ADDRESS_POLL_IDLE_INTERVAL'] = int(os.getenv('ADDRESS_POLL_IDLE_INTERVAL'))
+else:
+    app.config['ADDRESS_POLL_IDLE_INTERVAL'] = 86400
+if os.getenv('JOB_LEASE_SECONDS'):
+    app.config['JOB_LEASE_SECONDS'] = int(os.getenv('JOB_LEASE_SECONDS'))
+else:
+    app.config['JOB_LEASE_SECONDS'] = 60
+if os.getenv('RECURRING_BUY_SLOT_SECONDS'):
+    app.config['RECURRING_BUY_SLOT_SECONDS'] = int(os.getenv('RECURRING_BUY_SLOT_SECONDS'))
+else:
+    app.config['RECURRING_BUY_SLOT_SECONDS'] = 60
+
 if os.getenv('REGISTRATION_DISABLE'):
     app.config['SECURITY_REGISTERABLE'] = False
 
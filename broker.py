@@ -1,6 +1,15 @@
 import datetime
+import decimal
+import hmac
 import logging
+import random
+import time
 
+import gevent
+import gevent.pool
+from munch import Munch
+
+from app_core import app, db
 import fiatdb_core
 import dasset
 import assets
@@ -11,9 +20,17 @@ import email_utils
 import web_utils
 import coordinator
 import utils
+import workqueue
+import commitbatch
+import metrics
 
 logger = logging.getLogger(__name__)
 
+BROKER_ORDER_MAX_ATTEMPTS = app.config['BROKER_ORDER_MAX_ATTEMPTS']
+BROKER_ORDER_RETRY_BASE = app.config['BROKER_ORDER_RETRY_BASE']
+BROKER_ORDER_RETRY_MAX = app.config['BROKER_ORDER_RETRY_MAX']
+TRIGGER_SLIPPAGE_BPS = app.config['TRIGGER_SLIPPAGE_BPS']
+
 #
 # Helper functions (public)
 #
@@ -35,31 +52,236 @@ def order_required_asset(order, side):
         return order.quote_asset, order.quote_amount
     return order.base_asset, order.base_amount
 
-def order_check_funds(db_session, order, check_user=True):
+def order_check_funds(db_session, order, check_user=True, check_exchange=True):
     side = MarketSide.parse(order.side)
     if not side:
         return web_utils.INVALID_SIDE
     asset, amount_int = order_required_asset(order, side)
     amount_dec = assets.asset_int_to_dec(asset, amount_int)
     # check funds on dasset
-    if not dasset.funds_available_us(asset, amount_dec):
+    if check_exchange and not dasset.funds_available_us(asset, amount_dec):
         return web_utils.INSUFFICIENT_LIQUIDITY
     # and funds user has with us
     if check_user and not fiatdb_core.funds_available_user(db_session, order.user, asset, amount_dec):
         return web_utils.INSUFFICIENT_BALANCE
     return None
 
+#
+# Quote tokens
+#
+
+# firm quotes handed out by '/broker_order_validate' so '/broker_order_create' does not have to requote, the token carries
+# the quote (signed together with the order it was issued for) so any app instance can redeem it, the quote key is
+# stored on the order created from it ('BrokerOrder.quote_key' is unique) so a token can only be used once
+
+def _quote_sig(quote):
+    message = f'{quote.key}:{quote.user_id}:{quote.market}:{quote.side}:{quote.base_amount}:{quote.quote_amount}:{quote.expiry}'
+    return web_utils.create_hmac_sig(app.config['SECRET_KEY'], message)
+
+def quote_token_create(order):
+    quote = Munch(key=utils.generate_key(), user_id=order.user.id, market=order.market, side=order.side, base_amount=order.base_amount, \
+        quote_amount=order.quote_amount, expiry=int(time.time()) + BrokerOrder.MINUTES_EXPIRY * 60)
+    return f'{quote.key}.{quote.quote_amount}.{quote.expiry}.{_quote_sig(quote)}'
+
+def quote_token_redeem(quote_token, user, market, side, base_amount):
+    # returns the quote, or None if the token is invalid, expired or was issued for a different order
+    parts = quote_token.split('.')
+    if len(parts) != 4:
+        return None
+    key, quote_amount, expiry, sig = parts
+    try:
+        quote = Munch(key=key, user_id=user.id, market=market, side=side, base_amount=base_amount, quote_amount=int(quote_amount), expiry=int(expiry))
+    except ValueError:
+        return None
+    # compare as bytes, compare_digest raises on non ascii strings
+    if not hmac.compare_digest(sig.encode(), _quote_sig(quote).encode()) or quote.expiry < time.time():
+        return None
+    return quote
+
 #
 # Helper functions (private)
 #
 
+def _exchange_order_fetch(broker_order, exchange_orders):
+    exchange_reference = broker_order.exchange_order.exchange_reference
+    if exchange_orders and exchange_reference in exchange_orders:
+        return exchange_orders[exchange_reference]
+    # fall back to a targeted lookup on a miss
+    return dasset.order_status(exchange_reference, broker_order.market)
+
+def _exchange_orders_sync(orders):
+    # group the orders waiting on the exchange by market so we can fetch each market's recent orders once
+    market_refs = {}
+    for broker_order in orders:
+        if broker_order.status == broker_order.STATUS_EXCHANGE and broker_order.exchange_order:
+            market_refs.setdefault(broker_order.market, []).append(broker_order.exchange_order.exchange_reference)
+    exchange_orders = {}
+    for market, exchange_references in market_refs.items():
+        exchange_orders.update(dasset.order_statuses(market, exchange_references))
+    return exchange_orders
+
+def _retry_delay(attempts):
+    # exponential backoff with jitter, between half and all of the capped delay
+    delay = min(BROKER_ORDER_RETRY_BASE * 2 ** (attempts - 1), BROKER_ORDER_RETRY_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def _order_refund_unfilled(db_session, broker_order, side):
+    # refunds the part of the order that did not fill, returns the fiatdb transactions (or an empty list on failure),
+    # the part of an order that was netted against other orders is credited as filled
+    allocation = broker_order.exchange_allocation
+    if allocation is None or allocation >= broker_order.base_amount:
+        ftxs = [order_refund(db_session, broker_order, side)]
+    else:
+        netted_base = broker_order.base_amount - allocation
+        netted_quote = broker_order.quote_amount * netted_base // broker_order.base_amount
+        unfilled_quote = broker_order.quote_amount * allocation // broker_order.base_amount
+        if side is MarketSide.BID:
+            credits = [(broker_order.base_asset, netted_base, 'netted'), (broker_order.quote_asset, unfilled_quote, 'refund')]
+        else:
+            credits = [(broker_order.quote_asset, netted_quote, 'netted'), (broker_order.base_asset, allocation, 'refund')]
+        ftxs = [fiatdb_core.tx_create(db_session, broker_order.user, FiatDbTransaction.ACTION_CREDIT, asset, amount_int, f'broker order {reason}: {broker_order.token}') \
+            for asset, amount_int, reason in credits if amount_int > 0]
+    if not all(ftxs):
+        logger.error('failed to create fiatdb transaction for broker order %s', broker_order.token)
+        return []
+    return ftxs
+
+def _exchange_order_create_failed(db_session, broker_order, side, msg):
+    # records a failed attempt, once out of attempts the order is dead lettered and refunded
+    updated_records = [broker_order]
+    broker_order.attempts = (broker_order.attempts or 0) + 1
+    if broker_order.attempts < BROKER_ORDER_MAX_ATTEMPTS:
+        delay = _retry_delay(broker_order.attempts)
+        broker_order.next_attempt_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+        logger.warning('failed to create exchange order (attempt %d, retry in %ds) - %s', broker_order.attempts, delay, msg)
+        return updated_records
+    logger.error('failed to create exchange order, dead lettering broker order (attempt %d) - %s', broker_order.attempts, msg)
+    broker_order.status = broker_order.STATUS_DEAD_LETTER
+    broker_order.next_attempt_at = None
+    ftxs = _order_refund_unfilled(db_session, broker_order, side)
+    updated_records += ftxs
+    email_utils.send_email(logger, 'broker order dead lettered', f'{msg}, {broker_order.attempts} attempts, refunded: {bool(ftxs)}')
+    metrics.counter_inc('broker_orders_dead_lettered')
+    return updated_records
+
+def _broker_order_complete(db_session, broker_order, side):
+    # credit the user with the proceeds of the order
+    if side is MarketSide.ASK:
+        asset = broker_order.quote_asset
+        amount_int = broker_order.quote_amount
+    else:
+        asset = broker_order.base_asset
+        amount_int = broker_order.base_amount
+    ftx = fiatdb_core.tx_create(db_session, broker_order.user, FiatDbTransaction.ACTION_CREDIT, asset, amount_int, f'broker order completed: {broker_order.token}')
+    if not ftx:
+        logger.error('failed to create fiatdb transaction for broker order %s', broker_order.token)
+        return []
+    broker_order.status = broker_order.STATUS_COMPLETED
+    return [ftx, broker_order]
+
+def _exchange_order_killed(db_session, broker_order, side):
+    # the fill or kill order could not be filled
+    msg = f'exchange order killed - {broker_order.token}, {broker_order.exchange_order.exchange_reference}'
+    allocation = broker_order.exchange_allocation
+    if allocation is not None and allocation < broker_order.base_amount:
+        # the rest of the order was netted against other orders, so retry the allocation on its own
+        broker_order.exchange_order = None
+        broker_order.status = broker_order.STATUS_READY
+        return _exchange_order_create_failed(db_session, broker_order, side, msg)
+    logger.warning(msg)
+    broker_order.status = broker_order.STATUS_FAILED
+    return [broker_order] + _order_refund_unfilled(db_session, broker_order, side)
+
+def _allocate(amount, orders):
+    # splits 'amount' across 'orders' pro rata to their base amounts, the remainder goes to the earliest orders
+    total = sum(broker_order.base_amount for broker_order in orders)
+    allocations = [amount * broker_order.base_amount // total for broker_order in orders]
+    for n in range(amount - sum(allocations)):
+        allocations[n] += 1
+    return allocations
+
+def _net_price(side, base_asset, base_amount, quote_asset, quote_amount):
+    # the limit price at which the residual order still covers what we owe (or are owed by) the netted orders
+    base_amount_dec = assets.asset_int_to_dec(base_asset, base_amount)
+    quote_amount_dec = assets.asset_int_to_dec(quote_asset, quote_amount)
+    quant = decimal.Decimal(10) ** -assets.asset_decimals(quote_asset)
+    rounding = decimal.ROUND_DOWN if side is MarketSide.BID else decimal.ROUND_UP
+    return (quote_amount_dec / base_amount_dec).quantize(quant, rounding=rounding)
+
+def _broker_orders_net_claimed(db_session, market, orders):
+    # returns the updated records, or an empty list if the orders should be processed individually
+    base_asset, quote_asset = assets.assets_from_market(market)
+    bids = [o for o in orders if MarketSide.parse(o.side) is MarketSide.BID]
+    asks = [o for o in orders if MarketSide.parse(o.side) is MarketSide.ASK]
+    bid_base = sum(o.base_amount for o in bids)
+    ask_base = sum(o.base_amount for o in asks)
+    bid_quote = sum(o.quote_amount for o in bids)
+    ask_quote = sum(o.quote_amount for o in asks)
+    updated_records = []
+    # fully netted, no exchange order needed as long as the bids cover what the asks are owed
+    if bid_base == ask_base:
+        if bid_quote < ask_quote:
+            logger.warning('%s netting: bid quote amount (%d) does not cover ask quote amount (%d)', market, bid_quote, ask_quote)
+            return []
+        for broker_order in orders:
+            records = _broker_order_complete(db_session, broker_order, MarketSide.parse(broker_order.side))
+            if not records:
+                return []
+            broker_order.exchange_allocation = 0
+            updated_records += records
+        return updated_records
+    if bid_base > ask_base:
+        side, residual_orders, residual, net_quote = MarketSide.BID, bids, bid_base - ask_base, bid_quote - ask_quote
+    else:
+        side, residual_orders, residual, net_quote = MarketSide.ASK, asks, ask_base - bid_base, ask_quote - bid_quote
+    if net_quote <= 0:
+        logger.warning('%s netting: net quote amount (%d) is not positive', market, net_quote)
+        return []
+    residual_dec = assets.asset_int_to_dec(base_asset, residual)
+    price = _net_price(side, base_asset, residual, quote_asset, net_quote)
+    dasset_market = dasset.market_req(market)
+    if not dasset_market or residual_dec < decimal.Decimal(dasset_market.min_trade):
+        logger.info('%s netting: residual %s is below the minimum trade size', market, residual_dec)
+        return []
+    # check funds on dasset
+    if side is MarketSide.BID:
+        funds_available = dasset.funds_available_us(quote_asset, residual_dec * price)
+    else:
+        funds_available = dasset.funds_available_us(base_asset, residual_dec)
+    if not funds_available:
+        logger.error('%s netting: insufficient liquidity for residual %s', market, residual_dec)
+        return []
+    # create exchange order for the residual
+    exchange_order_id = dasset.order_create(market, side, residual_dec, price)
+    if not exchange_order_id:
+        msg = f'{market}, {side.value}, {residual_dec}, {price}, {len(orders)} broker orders'
+        logger.error('failed to create netted exchange order - %s', msg)
+        email_utils.send_email(logger, 'failed to create netted exchange order', msg)
+        return []
+    exchange_order = ExchangeOrder(exchange_order_id, market, side.value, residual)
+    updated_records.append(exchange_order)
+    allocations = dict(zip([o.id for o in residual_orders], _allocate(residual, residual_orders)))
+    for broker_order in orders:
+        broker_order.exchange_allocation = allocations.get(broker_order.id, 0)
+        updated_records.append(broker_order)
+        if broker_order.exchange_allocation:
+            broker_order.exchange_order = exchange_order
+            broker_order.status = broker_order.STATUS_EXCHANGE
+            continue
+        # matched in full against the other side, so it does not wait on the exchange order (if the credit fails it
+        # stays READY and the sweep completes it)
+        updated_records += _broker_order_complete(db_session, broker_order, MarketSide.parse(broker_order.side))
+    return updated_records
+
 # pylint: disable=too-many-statements
-def _broker_order_action(db_session, broker_order):
+def _broker_order_action(db_session, broker_order, exchange_orders=None):
     logger.info('processing broker order %s (%s)..', broker_order.token, broker_order.status)
     updated_records = []
-    base_amount_dec = assets.asset_int_to_dec(broker_order.base_asset, broker_order.base_amount)
+    # an order partly netted against other orders only places its allocation on the exchange
+    amount_int = broker_order.base_amount if broker_order.exchange_allocation is None else broker_order.exchange_allocation
+    base_amount_dec = assets.asset_int_to_dec(broker_order.base_asset, amount_int)
     quote_amount_dec = assets.asset_int_to_dec(broker_order.quote_asset, broker_order.quote_amount)
-    price = quote_amount_dec / base_amount_dec
+    price = quote_amount_dec / assets.asset_int_to_dec(broker_order.base_asset, broker_order.base_amount)
     price = utils.round_dec(price, assets.asset_decimals(broker_order.quote_asset))
     side = MarketSide.parse(broker_order.side)
     # check side
@@ -70,58 +292,54 @@ def _broker_order_action(db_session, broker_order):
         return updated_records
     # check balance
     if broker_order.status == broker_order.STATUS_READY:
+        if not broker_order.attempt_due(datetime.datetime.now()):
+            return updated_records
+        # matched in full against other orders when netted
+        if amount_int == 0:
+            return _broker_order_complete(db_session, broker_order, side)
         err_msg = order_check_funds(db_session, broker_order, check_user=False)
         if err_msg:
             logger.error('"%s" for broker order %s', err_msg, broker_order.token)
             broker_order.status = broker_order.STATUS_FAILED
             updated_records.append(broker_order)
-            ftx = order_refund(db_session, broker_order, side)
-            if not ftx:
-                logger.error('failed to create fiatdb transaction for broker order %s', broker_order.token)
-                return updated_records
-            updated_records.append(ftx)
+            updated_records += _order_refund_unfilled(db_session, broker_order, side)
             return updated_records
         # create exchange order
         exchange_order_id = dasset.order_create(broker_order.market, side, base_amount_dec, price)
         if not exchange_order_id:
             msg = f'{broker_order.token}, {broker_order.market}, {broker_order.side}, {base_amount_dec}, {quote_amount_dec}, {price}'
-            logger.error('failed to create exchange order - %s', msg)
-            email_utils.send_email(logger, 'failed to create exchange order', msg)
-            return updated_records
-        exchange_order = ExchangeOrder(exchange_order_id)
+            return _exchange_order_create_failed(db_session, broker_order, side, msg)
+        exchange_order = ExchangeOrder(exchange_order_id, broker_order.market, broker_order.side, amount_int)
         broker_order.exchange_order = exchange_order
+        broker_order.exchange_allocation = amount_int
         broker_order.status = broker_order.STATUS_EXCHANGE
         updated_records.append(exchange_order)
         updated_records.append(broker_order)
         return updated_records
     # finalize
     if broker_order.status == broker_order.STATUS_EXCHANGE:
-        # check exchange order
-        if dasset.order_status_check(broker_order.exchange_order.exchange_reference, broker_order.market):
-            if side is MarketSide.ASK:
-                asset = broker_order.quote_asset
-                amount_int = broker_order.quote_amount
-            else:
-                asset = broker_order.base_asset
-                amount_int = broker_order.base_amount
-            ftx = fiatdb_core.tx_create(db_session, broker_order.user, FiatDbTransaction.ACTION_CREDIT, asset, amount_int, f'broker order completed: {broker_order.token}')
-            if not ftx:
-                logger.error('failed to create fiatdb transaction for broker order %s', broker_order.token)
-                return updated_records
-            updated_records.append(ftx)
-            broker_order.status = broker_order.STATUS_COMPLETED
-            updated_records.append(broker_order)
-        else:
+        # check exchange order, a pending order is left for the next sweep
+        exchange_order = _exchange_order_fetch(broker_order, exchange_orders)
+        if dasset.order_completed(exchange_order):
+            updated_records += _broker_order_complete(db_session, broker_order, side)
+        elif dasset.order_killed(exchange_order):
+            updated_records += _exchange_order_killed(db_session, broker_order, side)
+        elif not exchange_order:
             msg = f'{broker_order.token}, {broker_order.exchange_order.exchange_reference}'
-            logger.error('failed to complete exchange order - %s', msg)
-            email_utils.send_email(logger, 'failed to complete exchange order', msg)
+            logger.error('failed to find exchange order - %s', msg)
+            email_utils.send_email(logger, 'failed to find exchange order', msg)
         return updated_records
-    # check expiry
-    if broker_order.status == broker_order.STATUS_CREATED:
+    # check trigger order expiry
+    if broker_order.status == broker_order.STATUS_WAITING:
         if datetime.datetime.now() > broker_order.expiry:
             broker_order.status = broker_order.STATUS_EXPIRED
             updated_records.append(broker_order)
-            return updated_records
+            ftx = order_refund(db_session, broker_order, side)
+            if not ftx:
+                logger.error('failed to create fiatdb transaction for broker order %s', broker_order.token)
+                return updated_records
+            updated_records.append(ftx)
+        return updated_records
     return updated_records
 
 def _email_msg(broker_order, msg):
@@ -139,27 +357,244 @@ def _broker_order_email(broker_order):
         email_utils.send_email(logger, 'Order Completed', _email_msg(broker_order, ''), broker_order.user.email)
     if broker_order.status == broker_order.STATUS_EXPIRED:
         email_utils.send_email(logger, 'Order Expired', _email_msg(broker_order, ''), broker_order.user.email)
+    if broker_order.status == broker_order.STATUS_DEAD_LETTER:
+        email_utils.send_email(logger, 'Order Failed', _email_msg(broker_order, 'We were unable to place your order on the exchange and your funds have been refunded.'), broker_order.user.email)
 
 #
 # Public functions
 #
 
-def broker_order_update_and_commit(db_session, broker_order):
-    while True:
-        with coordinator.lock:
-            updated_records = _broker_order_action(db_session, broker_order)
-            # commit db if records updated
+def _broker_order_notify(broker_order):
+    _broker_order_email(broker_order)
+    websocket.broker_order_update_event(broker_order)
+
+def broker_order_update_and_commit(db_session, broker_order, exchange_orders=None, batch=None):
+    if not batch:
+        with commitbatch.CommitBatch(db_session) as batch:
+            broker_order_update_and_commit(db_session, broker_order, exchange_orders, batch)
+        return
+    # a waiting order only needs attention once expired, leave the others unclaimed for 'broker_order_promote()'
+    if broker_order.status == broker_order.STATUS_WAITING and datetime.datetime.now() <= broker_order.expiry:
+        return
+    # the exchange calls run without the user lock (the claimed row keeps the order to us), the lock is only taken to
+    # write the ledger records
+    with batch.item(f'broker order {broker_order.token}'):
+        while True:
+            # the order may be processed by a queue worker, the sweep or another instance, skip it if it is claimed
+            if not BrokerOrder.claim_row(db_session, broker_order.id):
+                logger.info('broker order %s is claimed elsewhere, skipping', broker_order.token)
+                break
+            placing = broker_order.status == broker_order.STATUS_READY
+            if placing and batch.items:
+                # commit the earlier items before placing the exchange order, then claim the order again
+                batch.checkpoint()
+                continue
+            updated_records = _broker_order_action(db_session, broker_order, exchange_orders)
+            # add updated records to the batch
             if not updated_records:
-                return
-            for rec in updated_records:
-                db_session.add(rec)
-            db_session.commit()
-            # send updates
-            _broker_order_email(broker_order)
-            websocket.broker_order_update_event(broker_order)
+                break
+            with coordinator.user_lock(broker_order.user_id):
+                for rec in updated_records:
+                    db_session.add(rec)
+                db_session.flush()
+            batch.notify(broker_order.token, lambda: _broker_order_notify(broker_order))
+            if placing:
+                # the exchange order cannot be undone, commit it before anything else can fail
+                batch.checkpoint()
+
+def broker_orders_net(db_session, market):
+    # nets the READY orders of a market against each other and sends a single exchange order for the residual,
+    # returns the orders considered, any left READY should be processed with 'broker_order_update_and_commit()'
+    orders = BrokerOrder.ready_in_market(db_session, market)
+    if len(orders) < 2:
+        return orders
+    # claim the orders for the exchange call, the orders claimed by a worker (or another instance) are left to it
+    now = datetime.datetime.now()
+    claimed = BrokerOrder.claim_ready_in_market(db_session, market)
+    netted = [o for o in claimed if o.exchange_allocation is None and MarketSide.parse(o.side) and o.attempt_due(now)]
+    if len(netted) < 2:
+        db_session.rollback()
+        return orders
+    updated_records = _broker_orders_net_claimed(db_session, market, netted)
+    if not updated_records:
+        db_session.rollback()
+        return orders
+    # commit straight after the exchange order is placed, the users are only locked for the credits
+    with coordinator.user_locks([broker_order.user_id for broker_order in netted]):
+        for rec in updated_records:
+            db_session.add(rec)
+        db_session.commit()
+    logger.info('%s netting: %d broker orders netted', market, len(netted))
+    metrics.counter_inc('broker_orders_netted', len(netted))
+    for broker_order in netted:
+        _broker_order_email(broker_order)
+        websocket.broker_order_update_event(broker_order)
+    return orders
+
+def _broker_orders_process_isolated(tokens, exchange_orders):
+    # runs in a pool greenlet with its own app context (and so its own db session), processes the orders (in ascending
+    # user id order) in a commit batch, returns a (success, seconds) tuple per order
+    results = []
+    try:
+        with app.app_context(), commitbatch.CommitBatch(db.session) as batch:
+            for token in tokens:
+                start = time.time()
+                failures = batch.failures
+                broker_order = BrokerOrder.from_token(db.session, token)
+                if broker_order:
+                    broker_order_update_and_commit(db.session, broker_order, exchange_orders, batch)
+                else:
+                    logger.error('broker order %s not found', token)
+                elapsed = time.time() - start
+                metrics.timing_record('broker_order_process', elapsed)
+                results.append((batch.failures == failures, elapsed))
+    except Exception: # pylint: disable=broad-except
+        logger.exception('failed to process %d broker orders', len(tokens))
+        results = [(False, seconds) for _, seconds in results]
+        results += [(False, 0)] * (len(tokens) - len(results))
+    return results
+
+def broker_orders_expire(db_session):
+    # expires the unaccepted orders past their expiry with a single update and notifies their users in a batch
+    ids = BrokerOrder.expire_created(db_session, datetime.datetime.now())
+    db_session.commit()
+    if not ids:
+        return
+    logger.info('expired %d broker orders', len(ids))
+    metrics.counter_inc('broker_orders_expired', len(ids))
+    for broker_order in BrokerOrder.from_ids(db_session, ids):
+        _broker_order_email(broker_order)
+        websocket.broker_order_update_event(broker_order)
 
 def broker_orders_update(db_session):
+    broker_orders_expire(db_session)
+    for market in BrokerOrder.ready_markets(db_session):
+        broker_orders_net(db_session, market)
     orders = BrokerOrder.all_active(db_session)
     logger.info('num orders: %d', len(orders))
-    for broker_order in orders:
-        broker_order_update_and_commit(db_session, broker_order)
+    exchange_orders = _exchange_orders_sync(orders)
+    # each worker processes a chunk of orders in a single commit batch
+    tokens = [broker_order.token for broker_order in sorted(orders, key=lambda broker_order: broker_order.user_id)]
+    size = app.config['COMMIT_BATCH_SIZE']
+    chunks = [tokens[n:n + size] for n in range(0, len(tokens), size)]
+    # release the sweep's own transaction, each order is reloaded by its worker
+    db_session.commit()
+    start = time.time()
+    pool = gevent.pool.Pool(app.config['BROKER_ORDER_POOL_SIZE'])
+    results = [result for chunk_results in pool.map(lambda chunk: _broker_orders_process_isolated(chunk, exchange_orders), chunks) for result in chunk_results]
+    elapsed = time.time() - start
+    # cycle summary
+    failures = len([success for success, _ in results if not success])
+    rate = len(results) / elapsed if elapsed else 0
+    p95 = metrics.percentile([seconds for _, seconds in results], 95)
+    metrics.gauge_set('broker_sweep_orders', len(results))
+    metrics.gauge_set('broker_sweep_orders_per_sec', rate)
+    metrics.gauge_set('broker_sweep_failures', failures)
+    metrics.gauge_set('broker_sweep_p95', p95)
+    metrics.counter_inc('broker_order_failures', failures)
+    logger.info('broker sweep: %d orders in %.1fs (%.1f/s), %d failures, p95 %.2fs', len(results), elapsed, rate, failures, p95)
+
+def _broker_order_requote(db_session, broker_order, side):
+    # requotes a triggered order against the live order book, returns the updated records (None if the market could not
+    # be read), the order fails and is refunded if the price moved past the users slippage bound
+    base_amount_dec = assets.asset_int_to_dec(broker_order.base_asset, broker_order.base_amount)
+    if side is MarketSide.BID:
+        quote_amount_dec, err = dasset.bid_quote_amount(broker_order.market, base_amount_dec)
+        # the debit already covers the trigger price plus the slippage
+        limit = broker_order.quote_amount
+    else:
+        quote_amount_dec, err = dasset.ask_quote_amount(broker_order.market, base_amount_dec)
+        bps = TRIGGER_SLIPPAGE_BPS if broker_order.slippage_bps is None else broker_order.slippage_bps
+        slippage = decimal.Decimal(bps) / decimal.Decimal(10000)
+        fee = dasset.BROKER_ORDER_FEE / decimal.Decimal(100)
+        trigger_price_dec = assets.asset_int_to_dec(broker_order.quote_asset, broker_order.trigger_price)
+        limit = assets.asset_dec_to_int(broker_order.quote_asset, base_amount_dec * trigger_price_dec * (decimal.Decimal(1) - slippage) * (decimal.Decimal(1) - fee))
+    if err == dasset.QuoteResult.MARKET_API_FAIL:
+        return None
+    quote_amount = assets.asset_dec_to_int(broker_order.quote_asset, quote_amount_dec) if err == dasset.QuoteResult.OK else None
+    if quote_amount is None or (side is MarketSide.BID and quote_amount > limit) or (side is MarketSide.ASK and quote_amount < limit):
+        logger.warning('broker order %s requote failed (%s, %s), limit %d', broker_order.token, err, quote_amount, limit)
+        broker_order.status = broker_order.STATUS_FAILED
+        return [broker_order] + _order_refund_unfilled(db_session, broker_order, side)
+    updated_records = [broker_order]
+    if side is MarketSide.BID and quote_amount < broker_order.quote_amount:
+        # refund the part of the debit the requote did not use
+        ftx = fiatdb_core.tx_create(db_session, broker_order.user, FiatDbTransaction.ACTION_CREDIT, broker_order.quote_asset, broker_order.quote_amount - quote_amount, \
+            f'broker order refund: {broker_order.token}')
+        if not ftx:
+            logger.error('failed to create fiatdb transaction for broker order %s', broker_order.token)
+            return None
+        updated_records.append(ftx)
+    broker_order.quote_amount = quote_amount
+    broker_order.status = broker_order.STATUS_READY
+    return updated_records
+
+# seconds to wait before each retry of a promotion that could not claim (or requote) the order
+BROKER_ORDER_PROMOTE_BACKOFF = (1, 2, 5, 10, 20, 30)
+
+def _broker_order_promote_retry(token, attempt):
+    with app.app_context():
+        broker_order_promote(db.session, token, attempt)
+
+def broker_order_promote(db_session, token, attempt=0):
+    # moves a triggered order in to the READY pipeline once it is requoted
+    broker_order = BrokerOrder.from_token(db_session, token)
+    if not broker_order:
+        logger.error('broker order %s not found', token)
+        return
+    updated_records = None
+    # a sweep batch may hold the row, so skip it (a blocking lock would stall the process) and try again shortly
+    if BrokerOrder.claim_row(db_session, broker_order.id):
+        if broker_order.status != broker_order.STATUS_WAITING:
+            db_session.rollback()
+            return
+        updated_records = _broker_order_requote(db_session, broker_order, MarketSide.parse(broker_order.side))
+    if updated_records is None:
+        db_session.rollback()
+        if attempt < len(BROKER_ORDER_PROMOTE_BACKOFF):
+            gevent.spawn_later(BROKER_ORDER_PROMOTE_BACKOFF[attempt], _broker_order_promote_retry, token, attempt + 1)
+        else:
+            # the order is still waiting, so it is put back in the trigger index by the next 'triggers.reload()'
+            msg = f'{token}, {attempt} attempts'
+            logger.error('failed to promote triggered broker order - %s', msg)
+            email_utils.send_email(logger, 'failed to promote triggered broker order', msg)
+        return
+    with coordinator.user_lock(broker_order.user_id):
+        for rec in updated_records:
+            db_session.add(rec)
+        db_session.commit()
+    logger.info('broker order %s triggered (%s)', broker_order.token, broker_order.status)
+    _broker_order_notify(broker_order)
+    if broker_order.status == broker_order.STATUS_READY:
+        broker_market_queue.put(broker_order.market)
+
+def broker_order_cancel(db_session, broker_order):
+    # cancels a waiting order and refunds the user, returns an error message on failure (including when the order is
+    # claimed by a worker, eg being promoted)
+    if not BrokerOrder.claim_row(db_session, broker_order.id):
+        return web_utils.INVALID_STATUS
+    with coordinator.user_lock(broker_order.user.id):
+        if broker_order.status != broker_order.STATUS_WAITING:
+            db_session.rollback()
+            return web_utils.INVALID_STATUS
+        ftx = order_refund(db_session, broker_order, MarketSide.parse(broker_order.side))
+        if not ftx:
+            return web_utils.FAILED_PAYMENT_CREATE
+        broker_order.status = broker_order.STATUS_CANCELLED
+        db_session.add(broker_order)
+        db_session.add(ftx)
+        db_session.commit()
+    _broker_order_email(broker_order)
+    websocket.broker_order_update_event(broker_order)
+    return None
+
+def _broker_market_process(db_session, market):
+    orders = broker_orders_net(db_session, market)
+    exchange_orders = _exchange_orders_sync(orders)
+    with commitbatch.CommitBatch(db_session) as batch:
+        for broker_order in sorted(orders, key=lambda broker_order: broker_order.user_id):
+            broker_order_update_and_commit(db_session, broker_order, exchange_orders, batch)
+
+# executes accepted orders shortly after they are accepted (collecting the orders of the same market accepted within
+# the netting window), 'broker_orders_update()' remains as a periodic safety net
+broker_market_queue = workqueue.WorkQueue('broker_markets', _broker_market_process, app.config['BROKER_ORDER_WORKERS'], delay=app.config['BROKER_NETTING_WINDOW'])
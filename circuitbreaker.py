@@ -0,0 +1,69 @@
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    # trips open after 'failures' consecutive failed (or slow) calls, fails fast for 'cooldown' seconds and then lets
+    # a single trial call through (half open) to decide whether to close again
+
+    def __init__(self, name: str, failures: int, slow_call: float, cooldown: float):
+        self.name = name
+        self.failures = failures
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.state = STATE_CLOSED
+        self.failure_count = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def _state_set(self, state: str):
+        if state != self.state:
+            logger.warning('circuit breaker %s: %s -> %s', self.name, self.state, state)
+            self.state = state
+            metrics.gauge_set(f'breaker_{self.name}_open', 0 if state == STATE_CLOSED else 1)
+
+    def allow(self) -> bool:
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN:
+            if time.time() - self.opened_at < self.cooldown:
+                metrics.counter_inc(f'breaker_{self.name}_rejected')
+                return False
+            self._state_set(STATE_HALF_OPEN)
+        # half open, only one trial call at a time
+        if self.trial_in_flight:
+            metrics.counter_inc(f'breaker_{self.name}_rejected')
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def is_trial(self) -> bool:
+        return self.state == STATE_HALF_OPEN and self.trial_in_flight
+
+    def trial_release(self):
+        # called once the trial call is over however it ended (eg the greenlet was killed before 'record'), otherwise
+        # the breaker would reject every call from then on
+        self.trial_in_flight = False
+
+    def record(self, success: bool, elapsed: float):
+        if self.state == STATE_HALF_OPEN:
+            self.trial_in_flight = False
+        if success and elapsed > self.slow_call:
+            logger.warning('circuit breaker %s: slow call (%.1fs)', self.name, elapsed)
+            success = False
+        if success:
+            self.failure_count = 0
+            self._state_set(STATE_CLOSED)
+            return
+        self.failure_count += 1
+        if self.state == STATE_HALF_OPEN or self.failure_count >= self.failures:
+            self.opened_at = time.time()
+            self._state_set(STATE_OPEN)
+            metrics.counter_inc(f'breaker_{self.name}_tripped')
@@ -0,0 +1,84 @@
+import logging
+from contextlib import contextmanager, ExitStack
+
+from app_core import app
+import coordinator
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class CommitBatch:
+    # accumulates the records of many items and commits them together, each item runs in its own savepoint so a failing
+    # item is rolled back alone, notifications are deferred until the batch that contains them has committed
+    #
+    # only pure db state changes are batched, an item about to make a call that cannot be undone (an exchange order or
+    # transfer) must 'checkpoint()' right before and right after it so the call is never lost with a later rollback
+    #
+    # the user lock of an item is only held for that item, items must therefore claim their rows ('claim_row()') so
+    # nothing else processes them until the batch has committed
+
+    def __init__(self, db_session, size=None):
+        self.db_session = db_session
+        self.size = size or app.config['COMMIT_BATCH_SIZE']
+        self.items = 0
+        self.failures = 0
+        self.savepoint = None
+        self.notifications = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.db_session.rollback()
+            self.notifications = {}
+            return False
+        self.commit()
+        return False
+
+    def notify(self, key, func):
+        # a later notification with the same key replaces an earlier one (it will see the final state anyway)
+        self.notifications.pop(key, None)
+        self.notifications[key] = func
+
+    @contextmanager
+    def item(self, name, user_id=None):
+        with ExitStack() as locks:
+            if user_id is not None:
+                locks.enter_context(coordinator.user_lock(user_id))
+            self.savepoint = self.db_session.begin_nested()
+            try:
+                yield
+                self.db_session.flush()
+                self.savepoint.commit()
+            except Exception: # pylint: disable=broad-except
+                logger.exception('failed to process %s, rolling it back', name)
+                self.savepoint.rollback()
+                self.failures += 1
+                metrics.counter_inc('commit_batch_item_failures')
+                return
+            finally:
+                self.savepoint = None
+        self.items += 1
+        if self.items >= self.size:
+            self.commit()
+
+    def checkpoint(self):
+        # commits the batch so far including the current item, the current item continues in a new savepoint (note
+        # that the commit releases its row locks, claim the rows again before changing them)
+        self.db_session.flush()
+        self.savepoint.commit()
+        self.commit()
+        self.savepoint = self.db_session.begin_nested()
+
+    def commit(self):
+        self.db_session.commit()
+        metrics.counter_inc('commit_batch_commits')
+        metrics.counter_inc('commit_batch_items', self.items)
+        self.items = 0
+        notifications, self.notifications = self.notifications, {}
+        for func in notifications.values():
+            try:
+                func()
+            except Exception: # pylint: disable=broad-except
+                logger.exception('failed to send notification')
@@ -1,3 +1,64 @@
 import threading
+import time
+from contextlib import contextmanager
 
-lock = threading.Lock()
+import metrics
+
+# keyed locks, an entry only exists while a holder or waiter references it
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _entry_get(key):
+    with _locks_guard:
+        entry = _locks.get(key)
+        if not entry:
+            entry = _locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+        return entry
+
+def _entry_put(key, entry):
+    with _locks_guard:
+        entry[1] -= 1
+        if not entry[1]:
+            del _locks[key]
+
+def _acquire(key):
+    entry = _entry_get(key)
+    start = time.time()
+    entry[0].acquire()
+    metrics.timing_record('coordinator_lock_wait', time.time() - start)
+    return entry
+
+def _release(key, entry):
+    entry[0].release()
+    _entry_put(key, entry)
+
+@contextmanager
+def user_lock(user_id, asset=None):
+    # serializes balance changing operations of a single user (or a single asset of a user), note that
+    # (user_id) and (user_id, asset) are distinct keys and do not exclude each other
+    key = (user_id, asset)
+    entry = _acquire(key)
+    start = time.time()
+    try:
+        yield
+    finally:
+        _release(key, entry)
+        metrics.timing_record('coordinator_lock_hold', time.time() - start)
+
+@contextmanager
+def user_locks(user_ids):
+    # locks several users at once, always in the same order so that two holders cannot deadlock
+    keys = [(user_id, None) for user_id in sorted(set(user_ids))]
+    entries = []
+    start = None
+    try:
+        for key in keys:
+            entries.append((key, _acquire(key)))
+        start = time.time()
+        yield
+    finally:
+        for key, entry in reversed(entries):
+            _release(key, entry)
+        if start:
+            metrics.timing_record('coordinator_lock_hold', time.time() - start)
@@ -1,8 +1,13 @@
 import logging
 import decimal
 import json
+import datetime
+import email.utils
+import time
 from enum import Enum
 
+import gevent.pool
+import dateutil.parser
 import requests
 from munch import Munch
 import pyotp
@@ -10,21 +15,56 @@ import pyotp
 import utils
 from app_core import app
 import assets
+import ratelimit
+import circuitbreaker
+import metrics
 
 logger = logging.getLogger(__name__)
 
 DASSET_API_SECRET = app.config['DASSET_API_SECRET']
 DASSET_ACCOUNT_ID = app.config['DASSET_ACCOUNT_ID']
 BROKER_ORDER_FEE = decimal.Decimal(app.config['BROKER_ORDER_FEE'])
-
-URL_BASE = 'https://api.dassetx.com/api'
-URL_BASE_NOAPI = 'https://api.dassetx.com'
-URL_BASE_SUBACCOUNT = 'https://api.dassetx.com/prod/api'
+DASSET_MAX_CONCURRENCY = app.config['DASSET_MAX_CONCURRENCY']
+DASSET_RATE_LIMIT = app.config['DASSET_RATE_LIMIT']
+DASSET_RATE_LIMIT_BURST = app.config['DASSET_RATE_LIMIT_BURST']
+DASSET_TIMEOUT = app.config['DASSET_TIMEOUT']
+DASSET_BREAKER_FAILURES = app.config['DASSET_BREAKER_FAILURES']
+DASSET_BREAKER_SLOW_CALL = app.config['DASSET_BREAKER_SLOW_CALL']
+DASSET_BREAKER_COOLDOWN = app.config['DASSET_BREAKER_COOLDOWN']
+DASSET_CACHE_MAX_AGE = app.config['DASSET_CACHE_MAX_AGE']
+
+URL_BASE_NOAPI = app.config['DASSET_URL']
+URL_BASE = URL_BASE_NOAPI + '/api'
+URL_BASE_SUBACCOUNT = URL_BASE_NOAPI + '/prod/api'
 
 CRYPTO_WITHDRAWAL_STATUS_COMPLETED = 'completed'
 CRYPTO_WITHDRAWAL_STATUS_2FA = '2fa'
 CRYPTO_WITHDRAWAL_STATUS_UNKNOWN = 'unknown'
 
+# content of the stand in response for a request the circuit breaker did not let through
+CIRCUIT_OPEN = 'circuit open'
+
+ORDERS_RECENT_LIMIT = 1000
+WITHDRAWALS_RECENT_LIMIT = 1000
+
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_DEFAULT_RETRY = 1
+
+# request priority classes, see ratelimit.Scheduler
+PRIORITY_ORDER = ratelimit.PRIORITY_HIGH # order placement, withdrawals and transfers
+PRIORITY_QUOTE = ratelimit.PRIORITY_MEDIUM # quotes and other requests a user is waiting on
+PRIORITY_POLL = ratelimit.PRIORITY_LOW # deposit polling, status checks and balance refresh
+
+# caps the number of in flight requests to the dasset API across all greenlets
+_upstream = ratelimit.PrioritySemaphore(DASSET_MAX_CONCURRENCY)
+_scheduler = ratelimit.Scheduler('dasset', DASSET_RATE_LIMIT, DASSET_RATE_LIMIT_BURST)
+# circuit breaker per endpoint, see circuitbreaker.CircuitBreaker
+_breakers = {}
+# last good value of reads that can be served stale while the exchange is unavailable
+_cache = {}
+# functions called with (market, order_book) whenever a fresh order book is fetched
+_order_book_listeners = []
+
 class QuoteResult(Enum):
     OK = 0
     AMOUNT_TOO_LOW = 1
@@ -89,7 +129,68 @@ def _parse_withdrawal(item):
 # Dasset API Requests
 #
 
-def _req_get(endpoint, params=None, subaccount_id=None, noapi_in_path=False):
+def _retry_after(r):
+    value = r.headers.get('Retry-After')
+    if value:
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(value)
+                return max((when - datetime.datetime.now(when.tzinfo)).total_seconds(), 0)
+            except (TypeError, ValueError):
+                pass
+    return RATE_LIMIT_DEFAULT_RETRY
+
+def _breaker(name):
+    if name not in _breakers:
+        _breakers[name] = circuitbreaker.CircuitBreaker(f'dasset_{name}', DASSET_BREAKER_FAILURES, DASSET_BREAKER_SLOW_CALL, DASSET_BREAKER_COOLDOWN)
+    return _breakers[name]
+
+def _breaker_name(endpoint):
+    return endpoint.split('/')[1]
+
+def _unavailable(message):
+    # stands in for the response when the request could not be made so callers can keep checking 'status_code'
+    return Munch(status_code=503, content=message, headers={})
+
+def _request(method, url, headers, priority, breaker_name, **kwargs):
+    breaker = _breaker(breaker_name)
+    if not breaker.allow():
+        logger.warning('circuit open - %s %s', method, url)
+        return _unavailable(CIRCUIT_OPEN)
+    trial = breaker.is_trial()
+    try:
+        return _request_send(method, url, headers, priority, breaker, **kwargs)
+    finally:
+        if trial:
+            breaker.trial_release()
+
+def _request_send(method, url, headers, priority, breaker, **kwargs):
+    # every request is scheduled against the budget of the account (and subaccount) it is made on behalf of, the priority
+    # classes are ordered across the whole account, for the budgets and the upstream connection slots alike
+    account = headers['x-account-id']
+    budget = (account, headers.get('x-subaccount-id'))
+    attempt = 0
+    while True:
+        _scheduler.acquire(budget, priority, account)
+        start = time.time()
+        try:
+            with _upstream.slot(priority):
+                r = requests.request(method, url, headers=headers, timeout=DASSET_TIMEOUT, **kwargs)
+        except requests.exceptions.RequestException as ex:
+            logger.error('request failed - %s %s: %s', method, url, ex)
+            breaker.record(False, time.time() - start)
+            return _unavailable(str(ex))
+        if r.status_code != 429 or attempt >= RATE_LIMIT_RETRIES:
+            breaker.record(r.status_code < 500, time.time() - start)
+            return r
+        attempt += 1
+        retry_after = _retry_after(r)
+        logger.warning('rate limited - %s %s (attempt %d, retry after %.1fs)', method, url, attempt, retry_after)
+        _scheduler.retry_after(budget, retry_after)
+
+def _req_get(endpoint, params=None, subaccount_id=None, noapi_in_path=False, priority=PRIORITY_POLL, breaker_name=None):
     url = URL_BASE + endpoint
     if noapi_in_path:
         url = URL_BASE_NOAPI + endpoint
@@ -98,13 +199,13 @@ def _req_get(endpoint, params=None, subaccount_id=None, noapi_in_path=False):
     headers['x-account-id'] = DASSET_ACCOUNT_ID
     if subaccount_id:
         headers['x-subaccount-id'] = subaccount_id
-    r = requests.get(url, headers=headers, params=params)
+    r = _request('GET', url, headers, priority, breaker_name or _breaker_name(endpoint), params=params)
     logger.info('GET - %s', url)
     headers['x-api-key'] = 'xxxxx'
     logger.info('HEADERS - %s', headers)
     return r
 
-def _req_post(endpoint, params, subaccount_id=None, noapi_in_path=False):
+def _req_post(endpoint, params, subaccount_id=None, noapi_in_path=False, priority=PRIORITY_POLL, breaker_name=None):
     url = URL_BASE + endpoint
     if noapi_in_path:
         url = URL_BASE_NOAPI + endpoint
@@ -113,27 +214,27 @@ def _req_post(endpoint, params, subaccount_id=None, noapi_in_path=False):
     headers['x-account-id'] = DASSET_ACCOUNT_ID
     if subaccount_id:
         headers['x-subaccount-id'] = subaccount_id
-    r = requests.post(url, headers=headers, data=json.dumps(params))
+    r = _request('POST', url, headers, priority, breaker_name or _breaker_name(endpoint), data=json.dumps(params))
     logger.info('POST - %s', url)
     headers['x-api-key'] = 'xxxxx'
     logger.info('HEADERS - %s', headers)
     logger.info('PARAMS - %s', params)
     return r
 
-def _req_put(endpoint, params):
+def _req_put(endpoint, params, priority=PRIORITY_POLL, breaker_name=None):
     url = URL_BASE + endpoint
     headers = {}
     headers['x-api-key'] = DASSET_API_SECRET
     headers['x-account-id'] = DASSET_ACCOUNT_ID
     logger.info('   POST - %s', url)
-    r = requests.put(url, headers=headers, data=json.dumps(params))
+    r = _request('PUT', url, headers, priority, breaker_name or _breaker_name(endpoint), data=json.dumps(params))
     return r
 
 def assets_req(asset=None):
     endpoint = '/currencies'
     if asset:
         endpoint = f'/currencies/{asset}'
-    r = _req_get(endpoint)
+    r = _req_get(endpoint, priority=PRIORITY_QUOTE)
     if r.status_code == 200:
         return [_parse_asset(a) for a in r.json() if a['symbol'] in assets.ASSETS]
     logger.error('request failed: %d, %s', r.status_code, r.content)
@@ -141,7 +242,7 @@ def assets_req(asset=None):
 
 def markets_req():
     endpoint = '/markets'
-    r = _req_get(endpoint)
+    r = _req_get(endpoint, priority=PRIORITY_QUOTE)
     if r.status_code == 200:
         markets = r.json()
         markets = [_parse_market(m) for m in markets if m['symbol'] in assets.MARKETS]
@@ -149,18 +250,17 @@ def markets_req():
     logger.error('request failed: %d, %s', r.status_code, r.content)
     return None
 
-def market_req(name):
-    markets = markets_req()
-    for market in markets:
-        if market.symbol == name:
-            return market
-    return None
-
 def order_book_req(symbol):
     endpoint = f'/markets/{symbol}/orderbook'
-    r = _req_get(endpoint)
+    r = _req_get(endpoint, priority=PRIORITY_QUOTE, breaker_name='orderbook')
     if r.status_code == 200:
-        return _parse_order_book(r.json()[0]), BROKER_ORDER_FEE
+        order_book = _parse_order_book(r.json()[0])
+        for listener in _order_book_listeners:
+            try:
+                listener(symbol, order_book)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('order book listener failed')
+        return order_book, BROKER_ORDER_FEE
     logger.error('request failed: %d, %s', r.status_code, r.content)
     return None
 
@@ -185,7 +285,7 @@ def _order_create_req(market, side, amount, price):
         dasset_side = 'BUY'
     else:
         dasset_side = 'SELL'
-    r = _req_post(endpoint, params=dict(amount=float(amount), tradingPair=market, side=dasset_side, orderType='LIMIT', timeInForce='FILL_OR_KILL', limit=float(price)))
+    r = _req_post(endpoint, params=dict(amount=float(amount), tradingPair=market, side=dasset_side, orderType='LIMIT', timeInForce='FILL_OR_KILL', limit=float(price)), priority=PRIORITY_ORDER)
     if r.status_code == 200:
         return r.json()[0]['order']['orderId']
     logger.error('request failed: %d, %s', r.status_code, r.content)
@@ -217,27 +317,43 @@ def _order_status_req(order_id, market):
     logger.error('exchange order %s not found for market %s', order_id, market)
     return None
 
+def _orders_recent_req(market, limit):
+    orders = _orders_req(market, 0, limit)
+    if not orders:
+        return None
+    return {item['id']: _parse_order(item) for item in orders['results']}
+
 def _crypto_withdrawal_create_req(asset, amount, address):
     assert isinstance(amount, decimal.Decimal)
     endpoint = '/crypto/withdrawals'
-    r = _req_post(endpoint, params=dict(currencySymbol=asset, quantity=float(amount), cryptoAddress=address))
+    r = _req_post(endpoint, params=dict(currencySymbol=asset, quantity=float(amount), cryptoAddress=address), priority=PRIORITY_ORDER, breaker_name='withdrawals')
     if r.status_code == 200:
         withdrawal = _parse_withdrawal(r.json()[0])
-        return withdrawal['id']
+        return withdrawal['id'], False
     logger.error('request failed: %d, %s', r.status_code, r.content)
-    return None
+    # a server error or timeout may still have created the withdrawal, only a client error (or a request that was
+    # never sent) is a definite rejection
+    return None, r.status_code < 500 or r.content == CIRCUIT_OPEN
 
 def _crypto_withdrawal_status_req(withdrawal_id):
     endpoint = f'/crypto/withdrawals/{withdrawal_id}'
-    r = _req_get(endpoint)
+    r = _req_get(endpoint, breaker_name='withdrawals')
     if r.status_code == 200:
         return _parse_withdrawal(r.json()[0])
     logger.error('request failed: %d, %s', r.status_code, r.content)
     return None
 
+def _crypto_withdrawals_recent_req(limit):
+    endpoint = '/crypto/withdrawals'
+    r = _req_get(endpoint, params=dict(limit=limit, page=1), breaker_name='withdrawals')
+    if r.status_code == 200:
+        return {str(withdrawal.id): withdrawal for withdrawal in (_parse_withdrawal(item) for item in r.json()[0]['results'])}
+    logger.error('request failed: %d, %s', r.status_code, r.content)
+    return None
+
 def _crypto_withdrawal_confirm_req(withdrawal_id, totp_code):
     endpoint = '/crypto/withdrawals/confirm'
-    r = _req_post(endpoint, params=dict(txId=withdrawal_id, token=totp_code), noapi_in_path=True)
+    r = _req_post(endpoint, params=dict(txId=withdrawal_id, token=totp_code), noapi_in_path=True, priority=PRIORITY_ORDER, breaker_name='withdrawals')
     if r.status_code == 200:
         return True
     logger.error('request failed: %d, %s', r.status_code, r.content)
@@ -245,7 +361,7 @@ def _crypto_withdrawal_confirm_req(withdrawal_id, totp_code):
 
 def _addresses_req(asset, subaccount_id):
     endpoint = f'/addresses/{asset}'
-    r = _req_get(endpoint, subaccount_id=subaccount_id)
+    r = _req_get(endpoint, subaccount_id=subaccount_id, priority=PRIORITY_QUOTE)
     if r.status_code == 200:
         addrs = []
         for item in r.json():
@@ -257,7 +373,7 @@ def _addresses_req(asset, subaccount_id):
 
 def _addresses_create_req(asset, subaccount_id):
     endpoint = '/addresses'
-    r = _req_post(endpoint, params=dict(currencySymbol=asset), subaccount_id=subaccount_id)
+    r = _req_post(endpoint, params=dict(currencySymbol=asset), subaccount_id=subaccount_id, priority=PRIORITY_QUOTE)
     if r.status_code == 200:
         return r.json()[0]['status'] == 'REQUESTED'
     logger.error('request failed: %d, %s', r.status_code, r.content)
@@ -265,7 +381,7 @@ def _addresses_create_req(asset, subaccount_id):
 
 def _crypto_deposits_pending_req(asset, subaccount_id):
     endpoint = '/crypto/deposits/open'
-    r = _req_get(endpoint, params=dict(currencySymbol=asset, status='PENDING'), subaccount_id=subaccount_id, noapi_in_path=True)
+    r = _req_get(endpoint, params=dict(currencySymbol=asset, status='PENDING'), subaccount_id=subaccount_id, noapi_in_path=True, breaker_name='deposits')
     if r.status_code == 200:
         deposits = r.json()
         deposits = [_parse_deposit(d) for d in deposits]
@@ -275,7 +391,7 @@ def _crypto_deposits_pending_req(asset, subaccount_id):
 
 def _crypto_deposits_closed_req(asset, subaccount_id):
     endpoint = '/crypto/deposits/closed'
-    r = _req_get(endpoint, params=dict(currencySymbol=asset), subaccount_id=subaccount_id, noapi_in_path=True)
+    r = _req_get(endpoint, params=dict(currencySymbol=asset), subaccount_id=subaccount_id, noapi_in_path=True, breaker_name='deposits')
     if r.status_code == 200:
         deposits = r.json()
         deposits = [_parse_deposit(d) for d in deposits if d['currencySymbol'] == asset]
@@ -285,7 +401,7 @@ def _crypto_deposits_closed_req(asset, subaccount_id):
 
 def _crypto_deposit_status_req(deposit_id):
     endpoint = f'/crypto/deposits/{deposit_id}'
-    r = _req_get(endpoint)
+    r = _req_get(endpoint, breaker_name='deposits')
     if r.status_code == 200:
         return _parse_deposit(r.json()[0])
     logger.error('request failed: %d, %s', r.status_code, r.content)
@@ -293,7 +409,7 @@ def _crypto_deposit_status_req(deposit_id):
 
 def _subaccount_req(reference):
     endpoint = '/subaccount'
-    r = _req_put(endpoint, params=dict(reference=reference))
+    r = _req_put(endpoint, params=dict(reference=reference), priority=PRIORITY_QUOTE)
     if r.status_code == 200:
         return r.json()[0]
     logger.error('request failed: %d, %s', r.status_code, r.content)
@@ -301,12 +417,26 @@ def _subaccount_req(reference):
 
 def _transfer_req(to_master, from_subaccount_id, to_subaccount_id, asset, amount):
     endpoint = '/transfer'
-    r = _req_put(endpoint, params=dict(toMasterAccount=to_master, fromSubaccountId=from_subaccount_id, toSubaccountId=to_subaccount_id, symbol=asset, quantity=str(amount)))
+    r = _req_put(endpoint, params=dict(toMasterAccount=to_master, fromSubaccountId=from_subaccount_id, toSubaccountId=to_subaccount_id, symbol=asset, quantity=str(amount)), priority=PRIORITY_ORDER)
     if r.status_code == 200:
         return True
     logger.error('request failed: %d, %s', r.status_code, r.content)
     return False
 
+def _cached_read(key, value):
+    # stores the last good value of a read, or falls back to it (flagged as stale) when the read failed
+    now = time.time()
+    if value is not None:
+        _cache[key] = (value, now)
+        return value, False
+    if key in _cache:
+        cached_value, updated = _cache[key]
+        if now - updated < DASSET_CACHE_MAX_AGE:
+            logger.warning('serving stale %s (%d seconds old)', key, now - updated)
+            metrics.counter_inc('dasset_stale_reads')
+            return cached_value, True
+    return None, False
+
 #
 # Public functions
 #
@@ -314,10 +444,37 @@ def _transfer_req(to_master, from_subaccount_id, to_subaccount_id, asset, amount
 def crypto_deposit_completed(deposit):
     return deposit and deposit.status == 'COMPLETED'
 
+def order_completed(order):
+    return order and order.status == 'Completed'
+
+def order_killed(order):
+    # a fill or kill order that could not be filled
+    return order and order.status == 'Cancelled'
+
 #
 # Public functions that rely on an exchange request
 #
 
+def markets_read():
+    # returns (markets, stale)
+    return _cached_read('markets', markets_req())
+
+def market_req(name):
+    markets, _ = markets_read()
+    if not markets:
+        return None
+    for market in markets:
+        if market.symbol == name:
+            return market
+    return None
+
+def order_book_listener_add(listener):
+    _order_book_listeners.append(listener)
+
+def order_book_read(symbol):
+    # returns ((order_book, broker_fee), stale)
+    return _cached_read(f'orderbook:{symbol}', order_book_req(symbol))
+
 def bid_quote_amount(market, amount):
     assert isinstance(amount, decimal.Decimal)
     dasset_market = market_req(market)
@@ -327,9 +484,10 @@ def bid_quote_amount(market, amount):
     if amount < min_trade:
         return decimal.Decimal(-1), QuoteResult.AMOUNT_TOO_LOW
 
+    # quotes are never priced off a stale order book
     order_book_result = order_book_req(market)
     if not order_book_result:
-        return QuoteResult.MARKET_API_FAIL
+        return decimal.Decimal(-1), QuoteResult.MARKET_API_FAIL
     order_book, broker_fee = order_book_result
 
     filled = decimal.Decimal(0)
@@ -360,9 +518,10 @@ def ask_quote_amount(market, amount):
     if amount < min_trade:
         return decimal.Decimal(-1), QuoteResult.AMOUNT_TOO_LOW
 
+    # quotes are never priced off a stale order book
     order_book_result = order_book_req(market)
     if not order_book_result:
-        return QuoteResult.MARKET_API_FAIL
+        return decimal.Decimal(-1), QuoteResult.MARKET_API_FAIL
     order_book, broker_fee = order_book_result
 
     filled = decimal.Decimal(0)
@@ -384,6 +543,35 @@ def ask_quote_amount(market, amount):
 
     return decimal.Decimal(-1), QuoteResult.INSUFFICIENT_LIQUIDITY
 
+def bid_base_amount(market, quote_amount):
+    # the base amount bought by spending 'quote_amount' (including the broker fee), the inverse of 'bid_quote_amount()'
+    assert isinstance(quote_amount, decimal.Decimal)
+    dasset_market = market_req(market)
+    if not dasset_market:
+        return decimal.Decimal(-1), QuoteResult.MARKET_API_FAIL
+
+    # quotes are never priced off a stale order book
+    order_book_result = order_book_req(market)
+    if not order_book_result:
+        return decimal.Decimal(-1), QuoteResult.MARKET_API_FAIL
+    order_book, broker_fee = order_book_result
+
+    spend = quote_amount / (decimal.Decimal(1) + broker_fee / decimal.Decimal(100))
+    spent = decimal.Decimal(0)
+    filled = decimal.Decimal(0)
+    for level in order_book.asks:
+        rate = decimal.Decimal(level['rate'])
+        quantity = decimal.Decimal(level['quantity'])
+        if spent + quantity * rate >= spend:
+            filled += (spend - spent) / rate
+            if filled < decimal.Decimal(dasset_market.min_trade):
+                return decimal.Decimal(-1), QuoteResult.AMOUNT_TOO_LOW
+            return filled, QuoteResult.OK
+        spent += quantity * rate
+        filled += quantity
+
+    return decimal.Decimal(-1), QuoteResult.INSUFFICIENT_LIQUIDITY
+
 def account_balances(asset=None, subaccount_id=None):
     if _account_mock():
         balances = []
@@ -407,9 +595,17 @@ def order_status(order_id, market):
 
 def order_status_check(order_id, market):
     order = order_status(order_id, market)
-    if not order:
-        return False
-    return order.status == 'Completed'
+    return order_completed(order)
+
+def order_statuses(market, order_ids):
+    # returns a dict of exchange order id -> order for the most recent orders in a market,
+    # orders not in the dict should be looked up individually with 'order_status()'
+    if _account_mock():
+        return {order_id: Munch(id=order_id, status='Completed') for order_id in order_ids}
+    orders = _orders_recent_req(market, ORDERS_RECENT_LIMIT)
+    if orders is None:
+        return {}
+    return orders
 
 def address_get_or_create(asset, subaccount_id):
     if _account_mock():
@@ -423,15 +619,25 @@ def address_get_or_create(asset, subaccount_id):
             return addrs[0]
     return None
 
+def addresses_provisioned(asset, subaccount_id):
+    # the provisioned addresses of a subaccount (None if the request failed)
+    if _account_mock():
+        return [f'{asset}-{subaccount_id}']
+    return _addresses_req(asset, subaccount_id)
+
+def address_request(asset, subaccount_id):
+    # the address is provisioned by dasset some time later
+    if _account_mock():
+        return True
+    return _addresses_create_req(asset, subaccount_id)
+
 def crypto_withdrawal_create(asset, amount, address):
+    # returns (withdrawal id, rejected), if neither is set the withdrawal may or may not have been created
     if _account_mock():
-        return utils.generate_key()
+        return utils.generate_key(), False
     return _crypto_withdrawal_create_req(asset, amount, address)
 
-def crypto_withdrawal_status_check(withdrawal_id):
-    if _account_mock():
-        return CRYPTO_WITHDRAWAL_STATUS_COMPLETED
-    withdrawal = _crypto_withdrawal_status_req(withdrawal_id)
+def _crypto_withdrawal_status(withdrawal):
     if not withdrawal:
         return CRYPTO_WITHDRAWAL_STATUS_UNKNOWN
     if withdrawal.status == 'Completed':
@@ -440,6 +646,47 @@ def crypto_withdrawal_status_check(withdrawal_id):
         return CRYPTO_WITHDRAWAL_STATUS_2FA
     return CRYPTO_WITHDRAWAL_STATUS_UNKNOWN
 
+def crypto_withdrawal_status_check(withdrawal_id):
+    if _account_mock():
+        return CRYPTO_WITHDRAWAL_STATUS_COMPLETED
+    return _crypto_withdrawal_status(_crypto_withdrawal_status_req(withdrawal_id))
+
+def crypto_withdrawal_statuses(withdrawal_ids):
+    # returns a dict of withdrawal id -> status from a single listing of the recent withdrawals, withdrawals missing
+    # from the listing (or all of them if it fails) are checked individually with a bounded fan out
+    if _account_mock():
+        return {withdrawal_id: CRYPTO_WITHDRAWAL_STATUS_COMPLETED for withdrawal_id in withdrawal_ids}
+    statuses = {}
+    recent = _crypto_withdrawals_recent_req(WITHDRAWALS_RECENT_LIMIT) or {}
+    for withdrawal_id in withdrawal_ids:
+        if str(withdrawal_id) in recent:
+            statuses[withdrawal_id] = _crypto_withdrawal_status(recent[str(withdrawal_id)])
+    missing = [withdrawal_id for withdrawal_id in withdrawal_ids if withdrawal_id not in statuses]
+    if missing:
+        logger.info('checking %d crypto withdrawals individually', len(missing))
+        pool = gevent.pool.Pool(DASSET_MAX_CONCURRENCY)
+        statuses.update(pool.map(lambda withdrawal_id: (withdrawal_id, crypto_withdrawal_status_check(withdrawal_id)), missing))
+    return statuses
+
+def crypto_withdrawals_recent():
+    # returns the recent exchange withdrawals (with their creation time parsed in to 'created'), or None on failure, the
+    # listing is cut off at WITHDRAWALS_RECENT_LIMIT withdrawals
+    if _account_mock():
+        return []
+    recent = _crypto_withdrawals_recent_req(WITHDRAWALS_RECENT_LIMIT)
+    if recent is None:
+        return None
+    withdrawals = list(recent.values())
+    for withdrawal in withdrawals:
+        try:
+            withdrawal.created = dateutil.parser.isoparse(withdrawal.date)
+        except ValueError:
+            withdrawal.created = None
+            continue
+        if not withdrawal.created.tzinfo:
+            withdrawal.created = withdrawal.created.replace(tzinfo=datetime.timezone.utc)
+    return withdrawals
+
 def crypto_withdrawal_confirm(withdrawal_id):
     key = app.config['DASSET_TOTP_KEY']
     totp = pyotp.TOTP(key)
@@ -477,7 +724,11 @@ def transfer(to_subaccount_id, from_subaccount_id, asset, amount):
 
 def funds_available_us(asset, amount):
     assert isinstance(amount, decimal.Decimal)
-    for balance in account_balances(asset):
+    # never served stale, a failed read means the funds are not known to be there
+    balances = account_balances(asset)
+    if not balances:
+        return False
+    for balance in balances:
         if balance.symbol == asset:
             return balance.available >= amount
     return False
@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+
+# Local stand in for the dasset API so the broker, deposit and quote paths can be load tested without the real
+# exchange, point the app at it with DASSET_URL=http://localhost:5100
+
+# pylint: disable=invalid-name
+# pylint: disable=global-statement
+
+import sys
+import argparse
+import logging
+import random
+import time
+import decimal
+from decimal import Decimal as Dec
+
+import gevent
+from gevent.pywsgi import WSGIServer
+from flask import Flask, request, jsonify
+
+logger = logging.getLogger(__name__)
+app = Flask(__name__)
+
+ARGS = None
+MASTER = 'master'
+
+ASSETS = dict(NZD='New Zealand Dollar', BTC='Bitcoin', ETH='Ethereum', DOGE='Dogecoin', LTC='Litecoin', WAVES='Waves')
+MARKETS = {
+    'BTC-NZD': dict(base='BTC', quote='NZD', mid=Dec(60000), precision=2, min_trade='0.0001'),
+    'ETH-NZD': dict(base='ETH', quote='NZD', mid=Dec(4000), precision=2, min_trade='0.001'),
+    'DOGE-NZD': dict(base='DOGE', quote='NZD', mid=Dec('0.25'), precision=4, min_trade='10'),
+    'LTC-NZD': dict(base='LTC', quote='NZD', mid=Dec(200), precision=2, min_trade='0.01'),
+    'WAVES-BTC': dict(base='WAVES', quote='BTC', mid=Dec('0.0003'), precision=8, min_trade='1'),
+}
+
+ORDER_BOOKS = {}
+BALANCES = {}
+ORDERS = {}
+WITHDRAWALS = {}
+ADDRESSES = {}
+DEPOSITS = {}
+REQUEST_TIMES = []
+
+def construct_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='0.0.0.0', help='the address to listen on')
+    parser.add_argument('--port', type=int, default=5100, help='the port to listen on')
+    parser.add_argument('--latency-dist', type=str, default='lognormal', choices=('none', 'fixed', 'uniform', 'exponential', 'lognormal'), help='the distribution of the response latency')
+    parser.add_argument('--latency-mean', type=float, default=150, help='the mean response latency (ms)')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='the shape of the lognormal latency distribution')
+    parser.add_argument('--error-rate', type=float, default=0, help='the fraction of requests that fail with a 500 error')
+    parser.add_argument('--rate-limit', type=float, default=0, help='requests per second before responding with 429 (0 to disable)')
+    parser.add_argument('--book-levels', type=int, default=20, help='the number of levels on each side of the order books')
+    parser.add_argument('--book-churn', type=float, default=1, help='seconds between synthetic order book updates')
+    parser.add_argument('--volatility', type=float, default=0.001, help='the standard deviation of each mid price move')
+    parser.add_argument('--deposit-rate', type=float, default=0, help='the chance per address per second of a new deposit')
+    parser.add_argument('--deposit-confirm-time', type=float, default=30, help='seconds before a deposit completes')
+    parser.add_argument('--address-delay', type=float, default=5, help='seconds before a requested address is provisioned')
+    parser.add_argument('--withdrawal-time', type=float, default=30, help='seconds before a confirmed withdrawal completes')
+    return parser
+
+def _key():
+    return random.randint(10**9, 10**10 - 1)
+
+def _now_iso():
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+def _account():
+    return request.headers.get('x-subaccount-id') or MASTER
+
+def _balances(account):
+    if account not in BALANCES:
+        start = Dec(10**9) if account == MASTER else Dec(0)
+        BALANCES[account] = {symbol: start for symbol in ASSETS}
+    return BALANCES[account]
+
+#
+# Synthetic market data
+#
+
+def _order_book_build(market):
+    info = MARKETS[market]
+    quant = Dec(10) ** -info['precision']
+    mid = info['mid']
+    bids = []
+    asks = []
+    for n in range(ARGS.book_levels):
+        spread = mid * Dec('0.001') * (n + 1)
+        quantity = Dec(random.uniform(0.1, 10)).quantize(Dec('0.0001')) * Dec(info['min_trade']) * 100
+        bids.append(dict(rate=str((mid - spread).quantize(quant)), quantity=str(quantity)))
+        asks.append(dict(rate=str((mid + spread).quantize(quant)), quantity=str(quantity)))
+    ORDER_BOOKS[market] = dict(bid=bids, ask=asks)
+
+def _order_book_churn():
+    while True:
+        for market, info in MARKETS.items():
+            info['mid'] = info['mid'] * Dec(1 + random.gauss(0, ARGS.volatility))
+            _order_book_build(market)
+        gevent.sleep(ARGS.book_churn)
+
+def _deposits_churn():
+    while True:
+        now = time.time()
+        for account, addrs in ADDRESSES.items():
+            for asset, items in addrs.items():
+                for item in items:
+                    if item['status'] == 'REQUESTED' and now - item['created'] > ARGS.address_delay:
+                        item['status'] = 'PROVISIONED'
+                    if item['status'] == 'PROVISIONED' and random.random() < ARGS.deposit_rate:
+                        deposit = dict(id=_key(), currencySymbol=asset, cryptoAddress=item['cryptoAddress'], quantity=str(Dec(random.uniform(0.01, 1)).quantize(Dec('0.0001'))), \
+                            updatedAt=_now_iso(), status='PENDING', txId=f'{_key()}{_key()}', created=now)
+                        DEPOSITS.setdefault(account, []).append(deposit)
+        for deposits in DEPOSITS.values():
+            for deposit in deposits:
+                if deposit['status'] == 'PENDING' and now - deposit['created'] > ARGS.deposit_confirm_time:
+                    deposit['status'] = 'COMPLETED'
+                    deposit['updatedAt'] = _now_iso()
+                    for account, items in DEPOSITS.items():
+                        if deposit in items:
+                            _balances(account)[deposit['currencySymbol']] += Dec(deposit['quantity'])
+        gevent.sleep(1)
+
+#
+# Latency, errors and rate limits
+#
+
+def _latency():
+    mean = ARGS.latency_mean / 1000
+    if ARGS.latency_dist == 'fixed':
+        return mean
+    if ARGS.latency_dist == 'uniform':
+        return random.uniform(0, 2 * mean)
+    if ARGS.latency_dist == 'exponential':
+        return random.expovariate(1 / mean) if mean > 0 else 0
+    if ARGS.latency_dist == 'lognormal':
+        sigma = ARGS.latency_sigma
+        return random.lognormvariate(0, sigma) * mean / (2.718281828 ** (sigma * sigma / 2))
+    return 0
+
+@app.before_request
+def before_request():
+    gevent.sleep(_latency())
+    if ARGS.rate_limit:
+        now = time.time()
+        while REQUEST_TIMES and REQUEST_TIMES[0] < now - 1:
+            REQUEST_TIMES.pop(0)
+        if len(REQUEST_TIMES) >= ARGS.rate_limit:
+            response = jsonify(dict(message='rate limit exceeded'))
+            response.status_code = 429
+            response.headers['Retry-After'] = '1'
+            return response
+        REQUEST_TIMES.append(now)
+    if random.random() < ARGS.error_rate:
+        response = jsonify(dict(message='simulated error'))
+        response.status_code = 500
+        return response
+    return None
+
+#
+# Dasset API
+#
+
+@app.route('/api/currencies', methods=['GET'])
+@app.route('/api/currencies/<asset>', methods=['GET'])
+def currencies(asset=None):
+    items = [dict(symbol=symbol, name=name, coinType='', status='OK', minConfirmations=1) for symbol, name in ASSETS.items() if not asset or symbol == asset]
+    return jsonify(items)
+
+@app.route('/api/markets', methods=['GET'])
+def markets():
+    items = [dict(symbol=symbol, baseCurrencySymbol=info['base'], quoteCurrencySymbol=info['quote'], precision=info['precision'], status='OK', minTradeSize=info['min_trade']) for symbol, info in MARKETS.items()]
+    return jsonify(items)
+
+@app.route('/api/markets/<market>/orderbook', methods=['GET'])
+def orderbook(market):
+    if market not in ORDER_BOOKS:
+        return jsonify(dict(message='market not found')), 404
+    return jsonify([ORDER_BOOKS[market]])
+
+@app.route('/api/balances', methods=['GET'])
+@app.route('/api/balances/<asset>', methods=['GET'])
+def balances(asset=None):
+    items = []
+    for symbol, amount in _balances(_account()).items():
+        if asset and symbol != asset:
+            continue
+        items.append(dict(currencySymbol=symbol, currencyName=ASSETS[symbol], total=str(amount), available=str(amount)))
+    return jsonify(items)
+
+@app.route('/api/orders', methods=['POST'])
+def order_create():
+    params = request.get_json(force=True)
+    market = params['tradingPair']
+    if market not in MARKETS:
+        return jsonify(dict(message='market not found')), 404
+    info = MARKETS[market]
+    amount = Dec(str(params['amount']))
+    limit = Dec(str(params['limit']))
+    buy = params['side'] == 'BUY'
+    # fill or kill against the synthetic order book
+    levels = ORDER_BOOKS[market]['ask' if buy else 'bid']
+    filled = Dec(0)
+    total = Dec(0)
+    for level in levels:
+        rate = Dec(level['rate'])
+        if buy and rate > limit or not buy and rate < limit:
+            break
+        quantity = min(Dec(level['quantity']), amount - filled)
+        filled += quantity
+        total += quantity * rate
+        if filled >= amount:
+            break
+    status = 'Completed' if filled >= amount else 'Cancelled'
+    if status == 'Completed':
+        master = _balances(MASTER)
+        if buy:
+            master[info['base']] += amount
+            master[info['quote']] -= total
+        else:
+            master[info['base']] -= amount
+            master[info['quote']] += total
+    order_id = str(_key())
+    order = dict(id=order_id, type='BUY' if buy else 'SELL', baseSymbol=info['base'], quoteSymbol=info['quote'], timestamp=_now_iso(), status=status, \
+        baseAmount=str(amount), quoteAmount=str(total), details=dict(filled=str(filled if status == 'Completed' else 0)))
+    ORDERS.setdefault(market, []).insert(0, order)
+    return jsonify([dict(order=dict(orderId=order_id))])
+
+@app.route('/api/orders', methods=['GET'])
+def orders():
+    market = request.args.get('marketSymbol')
+    limit = int(request.args.get('limit', 100))
+    page = int(request.args.get('page', 1))
+    items = ORDERS.get(market, [])
+    offset = (page - 1) * limit
+    return jsonify([dict(results=items[offset:offset + limit], total=len(items))])
+
+def _withdrawal_status(withdrawal):
+    if withdrawal['status'] == 'Pending' and time.time() - withdrawal['confirmed'] > ARGS.withdrawal_time:
+        withdrawal['status'] = 'Completed'
+    return withdrawal
+
+def _withdrawal_json(withdrawal):
+    return {k: v for k, v in withdrawal.items() if k != 'confirmed'}
+
+@app.route('/api/crypto/withdrawals', methods=['POST'])
+def crypto_withdrawal_create():
+    params = request.get_json(force=True)
+    asset = params['currencySymbol']
+    amount = Dec(str(params['quantity']))
+    master = _balances(MASTER)
+    if master[asset] < amount:
+        return jsonify(dict(message='insufficient balance')), 400
+    master[asset] -= amount
+    withdrawal = dict(id=str(_key()), currencySymbol=asset, amount=str(amount), createdAt=_now_iso(), status='awaiting_mfa_confirmation', cryptoAddress=params['cryptoAddress'], confirmed=0)
+    WITHDRAWALS[withdrawal['id']] = withdrawal
+    return jsonify([_withdrawal_json(withdrawal)])
+
+@app.route('/api/crypto/withdrawals', methods=['GET'])
+def crypto_withdrawals():
+    limit = int(request.args.get('limit', 100))
+    page = int(request.args.get('page', 1))
+    items = [_withdrawal_json(_withdrawal_status(withdrawal)) for withdrawal in reversed(list(WITHDRAWALS.values()))]
+    offset = (page - 1) * limit
+    return jsonify([dict(results=items[offset:offset + limit], total=len(items))])
+
+@app.route('/api/crypto/withdrawals/<withdrawal_id>', methods=['GET'])
+def crypto_withdrawal_status(withdrawal_id):
+    if withdrawal_id not in WITHDRAWALS:
+        return jsonify(dict(message='withdrawal not found')), 404
+    return jsonify([_withdrawal_json(_withdrawal_status(WITHDRAWALS[withdrawal_id]))])
+
+@app.route('/crypto/withdrawals/confirm', methods=['POST'])
+def crypto_withdrawal_confirm():
+    params = request.get_json(force=True)
+    withdrawal = WITHDRAWALS.get(str(params['txId']))
+    if not withdrawal or withdrawal['status'] != 'awaiting_mfa_confirmation':
+        return jsonify(dict(message='withdrawal not awaiting confirmation')), 400
+    withdrawal['status'] = 'Pending'
+    withdrawal['confirmed'] = time.time()
+    return jsonify(dict(message='ok'))
+
+@app.route('/api/addresses/<asset>', methods=['GET'])
+def addresses(asset):
+    items = ADDRESSES.get(_account(), {}).get(asset, [])
+    return jsonify([dict(cryptoAddress=item['cryptoAddress'], status=item['status']) for item in items])
+
+@app.route('/api/addresses', methods=['POST'])
+def address_create():
+    params = request.get_json(force=True)
+    asset = params['currencySymbol']
+    item = dict(cryptoAddress=f'{asset}-{_key()}', status='REQUESTED', created=time.time())
+    ADDRESSES.setdefault(_account(), {}).setdefault(asset, []).append(item)
+    return jsonify([dict(status='REQUESTED')])
+
+def _deposits(status_open):
+    asset = request.args.get('currencySymbol')
+    items = []
+    for deposit in DEPOSITS.get(_account(), []):
+        if asset and deposit['currencySymbol'] != asset:
+            continue
+        if (deposit['status'] == 'PENDING') == status_open:
+            items.append({k: v for k, v in deposit.items() if k != 'created'})
+    return jsonify(items)
+
+@app.route('/crypto/deposits/open', methods=['GET'])
+def crypto_deposits_open():
+    return _deposits(True)
+
+@app.route('/crypto/deposits/closed', methods=['GET'])
+def crypto_deposits_closed():
+    return _deposits(False)
+
+@app.route('/api/crypto/deposits/<deposit_id>', methods=['GET'])
+def crypto_deposit_status(deposit_id):
+    for deposits in DEPOSITS.values():
+        for deposit in deposits:
+            if str(deposit['id']) == deposit_id:
+                return jsonify([{k: v for k, v in deposit.items() if k != 'created'}])
+    return jsonify(dict(message='deposit not found')), 404
+
+@app.route('/api/subaccount', methods=['PUT'])
+def subaccount():
+    subaccount_id = str(_key())
+    _balances(subaccount_id)
+    return jsonify([subaccount_id])
+
+@app.route('/api/transfer', methods=['PUT'])
+def transfer():
+    params = request.get_json(force=True)
+    source = params['fromSubaccountId'] or MASTER
+    dest = MASTER if params['toMasterAccount'] else params['toSubaccountId']
+    asset = params['symbol']
+    amount = Dec(params['quantity'])
+    if _balances(source)[asset] < amount:
+        return jsonify(dict(message='insufficient balance')), 400
+    _balances(source)[asset] -= amount
+    _balances(dest)[asset] += amount
+    return jsonify(dict(message='ok'))
+
+def run(args):
+    global ARGS
+    ARGS = args
+    decimal.getcontext().prec = 28
+    for market in MARKETS:
+        _order_book_build(market)
+    gevent.spawn(_order_book_churn)
+    gevent.spawn(_deposits_churn)
+    logger.info('dasset simulator listening on %s:%d', args.host, args.port)
+    WSGIServer((args.host, args.port), app, log=None).serve_forever()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='[%(name)s %(levelname)s] %(message)s')
+    run(construct_parser().parse_args(sys.argv[1:]))
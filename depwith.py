@@ -1,6 +1,12 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import decimal
 import logging
+import time
 
+import gevent
+import gevent.pool
+
+from app_core import app
 import payments_core
 import dasset
 import assets
@@ -8,8 +14,11 @@ from models import CryptoAddress, CryptoDeposit, CryptoWithdrawal, FiatDbTransac
 import websocket
 import email_utils
 import fiatdb_core
-import coordinator
 import tripwire
+import coordinator
+import workqueue
+import commitbatch
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -27,21 +36,19 @@ def _fiat_deposit_update(db_session, fiat_deposit):
                 updated_records.append(fiat_deposit)
                 return updated_records
             if payment_req.status == payment_req.STATUS_COMPLETED:
-                fiat_deposit.status = fiat_deposit.STATUS_COMPLETED
                 ftx = fiatdb_core.tx_create(db_session, fiat_deposit.user, FiatDbTransaction.ACTION_CREDIT, fiat_deposit.asset, fiat_deposit.amount, f'fiat deposit: {fiat_deposit.token}')
-                if ftx:
-                    updated_records.append(payment_req)
-                    updated_records.append(fiat_deposit)
-                    updated_records.append(ftx)
-                else:
+                if not ftx:
                     logger.error('failed to create fiatdb transaction for fiat deposit %s', fiat_deposit.token)
+                    return updated_records
+                # a stale copy of the deposit (eg loaded before another worker completed it) must not credit it again
+                if not FiatDeposit.mark_completed(db_session, fiat_deposit.id):
+                    logger.warning('fiat deposit %s is no longer created, not crediting it', fiat_deposit.token)
+                    return updated_records
+                fiat_deposit.status = fiat_deposit.STATUS_COMPLETED
+                updated_records.append(payment_req)
+                updated_records.append(fiat_deposit)
+                updated_records.append(ftx)
                 return updated_records
-    # check expiry
-    if fiat_deposit.status == fiat_deposit.STATUS_CREATED:
-        if datetime.now() > fiat_deposit.expiry:
-            fiat_deposit.status = fiat_deposit.STATUS_EXPIRED
-            updated_records.append(fiat_deposit)
-            return updated_records
     return updated_records
 
 def _fiat_deposit_email_msg(fiat_deposit, msg):
@@ -55,25 +62,118 @@ def _fiat_deposit_email(fiat_deposit):
     if fiat_deposit.status == fiat_deposit.STATUS_EXPIRED:
         email_utils.send_email(logger, 'Deposit Expired', _fiat_deposit_email_msg(fiat_deposit, ''), fiat_deposit.user.email)
 
-def fiat_deposit_update_and_commit(db_session, deposit):
-    while True:
-        with coordinator.lock:
+def _fiat_deposit_notify(fiat_deposit):
+    _fiat_deposit_email(fiat_deposit)
+    websocket.fiat_deposit_update_event(fiat_deposit)
+
+def fiat_deposit_update_and_commit(db_session, deposit, batch=None):
+    if not batch:
+        with commitbatch.CommitBatch(db_session) as batch:
+            fiat_deposit_update_and_commit(db_session, deposit, batch)
+        return
+    with batch.item(f'fiat deposit {deposit.token}', deposit.user_id):
+        # the deposit may be processed by a queue worker, the sweep or another instance, skip it if it is claimed
+        if not FiatDeposit.claim_row(db_session, deposit.id):
+            logger.info('fiat deposit %s is claimed elsewhere, skipping', deposit.token)
+            return
+        while True:
             updated_records = _fiat_deposit_update(db_session, deposit)
-            # commit db if records updated
+            # add updated records to the batch
             if not updated_records:
-                return
+                break
             for rec in updated_records:
                 db_session.add(rec)
-            db_session.commit()
-        # send updates
+            batch.notify(deposit.token, lambda: _fiat_deposit_notify(deposit))
+
+def fiat_deposits_expire(db_session):
+    # expires the deposits with a single update and notifies their users in a batch, a deposit is only expired once it
+    # is past its expiry by the sweep window so the sweep has checked its payment at least once after expiry
+    before = datetime.now() - timedelta(minutes=app.config['FIAT_DEPOSIT_SWEEP_MINUTES'])
+    ids = FiatDeposit.expire_created(db_session, before)
+    db_session.commit()
+    if not ids:
+        return
+    logger.info('expired %d fiat deposits', len(ids))
+    for deposit in FiatDeposit.from_ids(db_session, ids):
         _fiat_deposit_email(deposit)
         websocket.fiat_deposit_update_event(deposit)
 
 def fiat_deposits_update(db_session):
-    deposits = FiatDeposit.all_active(db_session)
+    # deposits are completed by windcave notifications ('fiat_deposit_queue'), this sweep only checks the payment of
+    # deposits nearing (or just past) expiry in case of a missed notification
+    fiat_deposits_expire(db_session)
+    before = datetime.now() + timedelta(minutes=app.config['FIAT_DEPOSIT_SWEEP_MINUTES'])
+    deposits = FiatDeposit.active_expiring(db_session, before)
     logger.info('num deposits: %d', len(deposits))
-    for deposit in deposits:
-        fiat_deposit_update_and_commit(db_session, deposit)
+    with commitbatch.CommitBatch(db_session) as batch:
+        for deposit in sorted(deposits, key=lambda deposit: deposit.user_id):
+            fiat_deposit_update_and_commit(db_session, deposit, batch)
+    # the session of a deposit queued on an instance that went down before creating it
+    for token in FiatDeposit.without_session(db_session, datetime.now() - timedelta(seconds=FIAT_DEPOSIT_SESSION_REQUEUE_SECONDS)):
+        logger.warning('fiat deposit %s has no windcave session, queueing it', token)
+        fiat_deposit_session_queue.put(token)
+
+def _fiat_deposit_process(db_session, token):
+    deposit = FiatDeposit.from_token(db_session, token)
+    if not deposit:
+        logger.error('fiat deposit %s not found', token)
+        return
+    fiat_deposit_update_and_commit(db_session, deposit)
+
+# fetches the status of a deposit (and credits the user) when windcave notifies us of its payment
+fiat_deposit_queue = workqueue.WorkQueue('fiat_deposits', _fiat_deposit_process, app.config['FIAT_DEPOSIT_WORKERS'])
+
+# seconds between polls of a deposit waiting on its windcave session
+FIAT_DEPOSIT_SESSION_POLL = 0.25
+# seconds after which the sweep queues the session of a deposit that still has none
+FIAT_DEPOSIT_SESSION_REQUEUE_SECONDS = 60
+
+def fiat_deposit_session_create_start(fiat_deposit):
+    # call once the deposit is committed
+    fiat_deposit_session_queue.put(fiat_deposit.token)
+
+def fiat_deposit_session_wait(db_session, fiat_deposit, timeout):
+    # returns true if the windcave session was created (or failed) within 'timeout' seconds, polls the database as the
+    # session may be created by the sweep of another instance
+    deadline = time.time() + timeout
+    while True:
+        # end the transaction so every poll reads the latest deposit (and no transaction is held while we sleep)
+        db_session.rollback()
+        if fiat_deposit.status != fiat_deposit.STATUS_CREATED or fiat_deposit.windcave_payment_request_id:
+            return True
+        if time.time() >= deadline:
+            return False
+        gevent.sleep(min(FIAT_DEPOSIT_SESSION_POLL, max(deadline - time.time(), 0)))
+
+def _fiat_deposit_session_create(db_session, token):
+    deposit = FiatDeposit.from_token(db_session, token)
+    if not deposit:
+        logger.error('fiat deposit %s not found', token)
+        return
+    # the session may be being created by another worker (eg queued by the sweep), skip it if so
+    if not FiatDeposit.claim_row(db_session, deposit.id):
+        return
+    if deposit.status != deposit.STATUS_CREATED or deposit.windcave_payment_request:
+        db_session.rollback()
+        return
+    try:
+        payment_request = payments_core.payment_create(deposit.amount, deposit.expiry)
+    except Exception: # pylint: disable=broad-except
+        logger.exception('failed to create windcave session for fiat deposit %s', token)
+        metrics.counter_inc('fiat_deposit_session_failures')
+        payment_request = None
+    if payment_request:
+        deposit.windcave_payment_request = payment_request
+        db_session.add(payment_request)
+    else:
+        deposit.status = deposit.STATUS_CANCELLED
+    db_session.add(deposit)
+    db_session.commit()
+    # the client gets the payment url (or learns of the failure) from the update event
+    websocket.fiat_deposit_update_event(deposit)
+
+# creates the windcave sessions of new deposits so the windcave latency stays out of '/fiat_deposit_create'
+fiat_deposit_session_queue = workqueue.WorkQueue('fiat_deposit_sessions', _fiat_deposit_session_create, app.config['FIAT_DEPOSIT_WORKERS'])
 
 def _fiat_withdrawal_update(fiat_withdrawal):
     logger.info('processing fiat withdrawal %s (%s)..', fiat_withdrawal.token, fiat_withdrawal.status)
@@ -100,25 +200,34 @@ def _fiat_withdrawal_email(fiat_withdrawal):
     if fiat_withdrawal.status == fiat_withdrawal.STATUS_COMPLETED:
         email_utils.send_email(logger, 'Withdrawal Completed', _fiat_withdrawal_email_msg(fiat_withdrawal, ''), fiat_withdrawal.user.email)
 
-def fiat_withdrawal_update_and_commit(db_session, withdrawal):
-    while True:
-        with coordinator.lock:
+def _fiat_withdrawal_notify(fiat_withdrawal):
+    _fiat_withdrawal_email(fiat_withdrawal)
+    websocket.fiat_withdrawal_update_event(fiat_withdrawal)
+
+def fiat_withdrawal_update_and_commit(db_session, withdrawal, batch=None):
+    if not batch:
+        with commitbatch.CommitBatch(db_session) as batch:
+            fiat_withdrawal_update_and_commit(db_session, withdrawal, batch)
+        return
+    with batch.item(f'fiat withdrawal {withdrawal.token}', withdrawal.user_id):
+        if not FiatWithdrawal.claim_row(db_session, withdrawal.id):
+            logger.info('fiat withdrawal %s is claimed elsewhere, skipping', withdrawal.token)
+            return
+        while True:
             updated_records = _fiat_withdrawal_update(withdrawal)
-            # commit db if records updated
+            # add updated records to the batch
             if not updated_records:
-                return
+                break
             for rec in updated_records:
                 db_session.add(rec)
-            db_session.commit()
-        # send updates
-        _fiat_withdrawal_email(withdrawal)
-        websocket.fiat_withdrawal_update_event(withdrawal)
+            batch.notify(withdrawal.token, lambda: _fiat_withdrawal_notify(withdrawal))
 
 def fiat_withdrawals_update(db_session):
     withdrawals = FiatWithdrawal.all_active(db_session)
     logger.info('num withdrawals: %d', len(withdrawals))
-    for withdrawal in withdrawals:
-        fiat_withdrawal_update_and_commit(db_session, withdrawal)
+    with commitbatch.CommitBatch(db_session) as batch:
+        for withdrawal in sorted(withdrawals, key=lambda withdrawal: withdrawal.user_id):
+            fiat_withdrawal_update_and_commit(db_session, withdrawal, batch)
 
 def _crypto_deposit_email_msg(deposit, verb, msg):
     amount = assets.asset_int_to_dec(deposit.asset, deposit.amount)
@@ -131,10 +240,72 @@ def _crypto_deposit_email(deposit):
     else:
         email_utils.send_email(logger, 'Deposit Incoming', _crypto_deposit_email_msg(deposit, 'incoming', ''), deposit.user.email)
 
-def crypto_deposits_check(db_session):
-    # query for list of addresses that need to be checked
-    addrs = CryptoAddress.need_to_be_checked(db_session)
-    # sort in to groups of assets for each user
+def _crypto_deposits_poll(jobs):
+    # query the exchange for every (user, asset) pair concurrently, dasset caps the requests actually in flight
+    def poll(job):
+        _, subaccount_id, asset = job
+        try:
+            return job, dasset.crypto_deposits(asset, subaccount_id)
+        except Exception as e: # pylint: disable=broad-except
+            logger.error('failed to get crypto deposits for subaccount %s (%s): %s', subaccount_id, asset, e)
+            return job, []
+    pool = gevent.pool.Pool(dasset.DASSET_MAX_CONCURRENCY)
+    return pool.map(poll, jobs)
+
+def _crypto_deposit_update(db_session, batch, user, subaccount_id, asset, dasset_deposit, deposits, addrs):
+    # 'deposits' and 'addrs' are the deposits (by txid) and addresses (by address) of the polling round
+    completed = dasset.crypto_deposit_completed(dasset_deposit)
+    amount_int = assets.asset_dec_to_int(asset, dasset_deposit.amount)
+    crypto_deposit = deposits.get(dasset_deposit.txid)
+    if not crypto_deposit:
+        crypto_deposit = CryptoDeposit(user, asset, amount_int, dasset_deposit.id, dasset_deposit.txid, completed)
+        deposits[dasset_deposit.txid] = crypto_deposit
+        db_session.add(crypto_deposit)
+        batch.notify(('new', dasset_deposit.txid), lambda: _crypto_deposit_notify(crypto_deposit, True))
+    elif not crypto_deposit.confirmed and completed:
+        if not _crypto_deposit_confirm(db_session, batch, user, subaccount_id, asset, dasset_deposit, crypto_deposit):
+            return
+    if not crypto_deposit.crypto_address_id and not crypto_deposit.crypto_address:
+        addr = addrs.get(dasset_deposit.address)
+        if addr:
+            crypto_deposit.crypto_address = addr
+            db_session.add(crypto_deposit)
+
+def _crypto_deposit_confirm(db_session, batch, user, subaccount_id, asset, dasset_deposit, crypto_deposit):
+    # the transfer cannot be undone so the earlier items are committed before it and the credit right after it
+    batch.checkpoint()
+    # the round's deposits are loaded before they are claimed, another round (or instance) may have confirmed it
+    if not CryptoDeposit.claim_row(db_session, crypto_deposit.id) or crypto_deposit.confirmed:
+        return False
+    # transfer the funds to the master account
+    if not dasset.transfer(None, subaccount_id, asset, dasset_deposit.amount):
+        logger.error('failed to transfer funds from subaccount to master %s', dasset_deposit.id)
+        return False
+    # and credit the users account, the user is only locked for the db update
+    with coordinator.user_lock(user.id):
+        ftx = fiatdb_core.tx_create(db_session, user, FiatDbTransaction.ACTION_CREDIT, crypto_deposit.asset, crypto_deposit.amount, f'crypto deposit: {crypto_deposit.token}')
+        if ftx:
+            db_session.add(ftx)
+        else:
+            # the funds have moved, so mark the deposit confirmed anyway rather than transfer them again
+            msg = f'crypto deposit {crypto_deposit.token} transferred but not credited'
+            logger.error(msg)
+            email_utils.send_email(logger, 'failed to credit crypto deposit', msg)
+        crypto_deposit.confirmed = True
+        db_session.add(crypto_deposit)
+        batch.notify(('update', dasset_deposit.txid), lambda: _crypto_deposit_notify(crypto_deposit, False))
+        batch.checkpoint()
+    return True
+
+def _crypto_deposit_notify(deposit, new):
+    _crypto_deposit_email(deposit)
+    if new:
+        websocket.crypto_deposit_new_event(deposit)
+    else:
+        websocket.crypto_deposit_update_event(deposit)
+
+def crypto_deposits_check(db_session, addrs):
+    # checks the deposits to 'addrs' (scheduled by 'addresspoll'), sort in to groups of assets for each user
     user_assets = {}
     for addr in addrs:
         if addr.user.email not in user_assets:
@@ -145,52 +316,33 @@ def crypto_deposits_check(db_session):
         # update checked at time of CryptoAddress
         addr.checked_at = int(datetime.timestamp(datetime.now()))
         db_session.add(addr)
-    # check for new deposits, update existing deposits
-    new_crypto_deposits = []
-    updated_crypto_deposits = []
+    # build the list of exchange queries, the pool workers only do network I/O so they do not touch the db session
+    jobs = []
     for user, asset_list in user_assets.values():
         if not user.dasset_subaccount:
             logger.error('user %s dasset subaccount does not exist', user.email)
             continue
         for asset in asset_list:
-            dasset_deposits = dasset.crypto_deposits(asset, user.dasset_subaccount.subaccount_id)
+            jobs.append((user, user.dasset_subaccount.subaccount_id, asset))
+    results = _crypto_deposits_poll(jobs)
+    # resolve the txids and addresses of the whole round with two queries, deposits that are already confirmed need
+    # nothing more
+    deposits = CryptoDeposit.from_txids(db_session, list({dasset_deposit.txid for _, dasset_deposits in results for dasset_deposit in dasset_deposits}))
+    pending = []
+    for job, dasset_deposits in results:
+        dasset_deposits = [d for d in dasset_deposits if not (d.txid in deposits and deposits[d.txid].confirmed)]
+        if dasset_deposits:
+            pending.append((job, dasset_deposits))
+    addrs = CryptoAddress.from_addrs(db_session, list({dasset_deposit.address for _, dasset_deposits in pending for dasset_deposit in dasset_deposits}))
+    # check for new deposits, update existing deposits (only changed deposits are written, in batches)
+    with commitbatch.CommitBatch(db_session) as batch:
+        for (user, subaccount_id, asset), dasset_deposits in sorted(pending, key=lambda result: result[0][0].id):
             for dasset_deposit in dasset_deposits:
-                with coordinator.lock:
-                    completed = dasset.crypto_deposit_completed(dasset_deposit)
-                    crypto_deposit = CryptoDeposit.from_txid(db_session, dasset_deposit.txid)
-                    if not crypto_deposit:
-                        amount_int = assets.asset_dec_to_int(asset, dasset_deposit.amount)
-                        crypto_deposit = CryptoDeposit(user, asset, amount_int, dasset_deposit.id, dasset_deposit.txid, completed)
-                        new_crypto_deposits.append(crypto_deposit)
-                    elif not crypto_deposit.confirmed and completed:
-                        # if deposit now completed transfer the funds to the master account
-                        if not dasset.transfer(None, user.dasset_subaccount.subaccount_id, asset, dasset_deposit.amount):
-                            logger.error('failed to transfer funds from subaccount to master %s', dasset_deposit.id)
-                            continue
-                        # and credit the users account
-                        ftx = fiatdb_core.tx_create(db_session, user, FiatDbTransaction.ACTION_CREDIT, asset, amount_int, f'crypto deposit: {crypto_deposit.token}')
-                        if not ftx:
-                            logger.error('failed to create fiatdb transaction for crypto deposit %s', crypto_deposit.token)
-                            continue
-                        db_session.add(ftx)
-                        # update crypto deposit
-                        crypto_deposit.confirmed = completed
-                        updated_crypto_deposits.append(crypto_deposit)
-                    if not crypto_deposit.crypto_address:
-                        addr = CryptoAddress.from_addr(db_session, dasset_deposit.address)
-                        if addr:
-                            crypto_deposit.crypto_address = addr
-                    db_session.add(crypto_deposit)
-                    db_session.commit()
-    # send updates
-    for deposit in new_crypto_deposits:
-        _crypto_deposit_email(deposit)
-        websocket.crypto_deposit_new_event(deposit)
-    for deposit in updated_crypto_deposits:
-        _crypto_deposit_email(deposit)
-        websocket.crypto_deposit_update_event(deposit)
+                with batch.item(f'crypto deposit {dasset_deposit.txid}'):
+                    _crypto_deposit_update(db_session, batch, user, subaccount_id, asset, dasset_deposit, deposits, addrs)
 
-def _crypto_withdrawal_update(crypto_withdrawal):
+def _crypto_withdrawal_update(crypto_withdrawal, status=None):
+    # 'status' is the exchange withdrawal status if already known (from 'dasset.crypto_withdrawal_statuses()')
     logger.info('processing crypto withdrawal %s (%s)..', crypto_withdrawal.token, crypto_withdrawal.status)
     updated_records = []
     # check withdrawals enabled
@@ -199,12 +351,17 @@ def _crypto_withdrawal_update(crypto_withdrawal):
     # check payout
     if crypto_withdrawal.status == crypto_withdrawal.STATUS_CREATED:
         # check exchange withdrawal
-        status = dasset.crypto_withdrawal_status_check(crypto_withdrawal.exchange_reference)
+        if not status:
+            status = dasset.crypto_withdrawal_status_check(crypto_withdrawal.exchange_reference)
         if status == dasset.CRYPTO_WITHDRAWAL_STATUS_COMPLETED:
             crypto_withdrawal.status = crypto_withdrawal.STATUS_COMPLETED
             updated_records.append(crypto_withdrawal)
-        elif status == dasset.CRYPTO_WITHDRAWAL_STATUS_2FA:
-            if not dasset.crypto_withdrawal_confirm(crypto_withdrawal.exchange_reference):
+        elif status == dasset.CRYPTO_WITHDRAWAL_STATUS_2FA and not crypto_withdrawal.mfa_confirmed_at:
+            if dasset.crypto_withdrawal_confirm(crypto_withdrawal.exchange_reference):
+                crypto_withdrawal.mfa_confirmed_at = datetime.now()
+                updated_records.append(crypto_withdrawal)
+                metrics.counter_inc('crypto_withdrawals_confirmed')
+            else:
                 logger.error('failed to confirm crypto withdrawal %s', crypto_withdrawal.token)
         elif status == dasset.CRYPTO_WITHDRAWAL_STATUS_UNKNOWN:
             logger.error('failed to get crypto withdrawal %s status', crypto_withdrawal.token)
@@ -220,22 +377,153 @@ def _crypto_withdrawal_email(crypto_withdrawal):
     if crypto_withdrawal.status == crypto_withdrawal.STATUS_COMPLETED:
         email_utils.send_email(logger, 'Withdrawal Completed', _crypto_withdrawal_email_msg(crypto_withdrawal, ''), crypto_withdrawal.user.email)
 
-def crypto_withdrawal_update_and_commit(db_session, withdrawal):
-    while True:
-        with coordinator.lock:
-            updated_records = _crypto_withdrawal_update(withdrawal)
-            # commit db if records updated
+def _crypto_withdrawal_notify(crypto_withdrawal):
+    _crypto_withdrawal_email(crypto_withdrawal)
+    websocket.crypto_withdrawal_update_event(crypto_withdrawal)
+
+def crypto_withdrawal_update_and_commit(db_session, withdrawal, batch=None, status=None):
+    if not batch:
+        with commitbatch.CommitBatch(db_session) as batch:
+            crypto_withdrawal_update_and_commit(db_session, withdrawal, batch, status)
+        return
+    if not status and withdrawal.status == withdrawal.STATUS_CREATED and tripwire.WITHDRAWAL.ok:
+        status = dasset.crypto_withdrawal_status_check(withdrawal.exchange_reference)
+    # the funds were taken when the withdrawal was created so the user is not locked, claiming the row is enough
+    with batch.item(f'crypto withdrawal {withdrawal.token}'):
+        while True:
+            # the sweep and the confirm queue (of any instance) may both have the withdrawal, skip it if it is claimed
+            if not CryptoWithdrawal.claim_row(db_session, withdrawal.id):
+                logger.info('crypto withdrawal %s is claimed elsewhere, skipping', withdrawal.token)
+                break
+            confirming = withdrawal.status == withdrawal.STATUS_CREATED and status == dasset.CRYPTO_WITHDRAWAL_STATUS_2FA and not withdrawal.mfa_confirmed_at
+            if confirming and batch.items:
+                # commit the earlier items before confirming, then claim the withdrawal again
+                batch.checkpoint()
+                continue
+            updated_records = _crypto_withdrawal_update(withdrawal, status)
+            # add updated records to the batch
             if not updated_records:
-                return
+                break
             for rec in updated_records:
                 db_session.add(rec)
-            db_session.commit()
-        # send updates
-        _crypto_withdrawal_email(withdrawal)
-        websocket.crypto_withdrawal_update_event(withdrawal)
+            batch.notify(withdrawal.token, lambda: _crypto_withdrawal_notify(withdrawal))
+            if confirming:
+                # record the confirmation straight away so it is never sent twice
+                batch.checkpoint()
+
+# seconds a withdrawal of unknown outcome is given to show up in the exchange listing before its hold is released
+CRYPTO_WITHDRAWAL_RECONCILE_SECONDS = 600
+# allowance for the clock difference with the exchange when matching a withdrawal of unknown outcome
+CRYPTO_WITHDRAWAL_RECONCILE_SKEW = timedelta(minutes=5)
+
+def crypto_withdrawal_release(crypto_withdrawal):
+    # cancels a withdrawal of unknown outcome and releases its hold, returns the updated records (empty on failure)
+    if crypto_withdrawal.status != crypto_withdrawal.STATUS_UNKNOWN:
+        return []
+    ftx = fiatdb_core.hold_release(crypto_withdrawal.hold)
+    if not ftx:
+        logger.error('failed to release the hold of crypto withdrawal %s', crypto_withdrawal.token)
+        return []
+    crypto_withdrawal.status = crypto_withdrawal.STATUS_CANCELLED
+    return [crypto_withdrawal, ftx]
+
+def _crypto_withdrawal_reconcile(crypto_withdrawal, recent, taken):
+    # settles a withdrawal of unknown outcome against the recent exchange withdrawals, if the exchange has a matching
+    # withdrawal the hold becomes its debit, if not the hold is released once the listing reaches back past the time
+    # the withdrawal was attempted ('taken' is the set of exchange references already recorded)
+    since = crypto_withdrawal.date.astimezone(timezone.utc) - CRYPTO_WITHDRAWAL_RECONCILE_SKEW
+    amount = assets.asset_int_to_dec(crypto_withdrawal.asset, crypto_withdrawal.amount)
+    for withdrawal in recent:
+        if str(withdrawal.id) in taken or not withdrawal.created or withdrawal.created < since:
+            continue
+        if withdrawal.symbol != crypto_withdrawal.asset or withdrawal.address != crypto_withdrawal.recipient or decimal.Decimal(str(withdrawal.amount)) != amount:
+            continue
+        ftx = fiatdb_core.hold_confirm(crypto_withdrawal.hold, f'crypto withdrawal: {crypto_withdrawal.token}')
+        if not ftx:
+            logger.error('failed to confirm the hold of crypto withdrawal %s', crypto_withdrawal.token)
+            return []
+        logger.info('crypto withdrawal %s found on the exchange (%s)', crypto_withdrawal.token, withdrawal.id)
+        taken.add(str(withdrawal.id))
+        crypto_withdrawal.exchange_reference = str(withdrawal.id)
+        crypto_withdrawal.status = crypto_withdrawal.STATUS_CREATED
+        return [crypto_withdrawal, ftx]
+    if datetime.now() - crypto_withdrawal.date < timedelta(seconds=CRYPTO_WITHDRAWAL_RECONCILE_SECONDS):
+        return []
+    dates = [withdrawal.created for withdrawal in recent if withdrawal.created]
+    if len(recent) >= dasset.WITHDRAWALS_RECENT_LIMIT and (not dates or min(dates) >= since):
+        logger.error('crypto withdrawal %s is older than the listed exchange withdrawals, release it manually', crypto_withdrawal.token)
+        return []
+    logger.info('crypto withdrawal %s not found on the exchange, releasing the hold', crypto_withdrawal.token)
+    return crypto_withdrawal_release(crypto_withdrawal)
+
+def _crypto_withdrawal_reconcile_and_commit(db_session, batch, withdrawal, recent, taken):
+    with batch.item(f'crypto withdrawal {withdrawal.token}'):
+        if not CryptoWithdrawal.claim_row(db_session, withdrawal.id) or withdrawal.status != withdrawal.STATUS_UNKNOWN:
+            return
+        updated_records = _crypto_withdrawal_reconcile(withdrawal, recent, taken)
+        if not updated_records:
+            return
+        with coordinator.user_lock(withdrawal.user_id):
+            for rec in updated_records:
+                db_session.add(rec)
+            db_session.flush()
+        batch.notify(withdrawal.token, lambda: _crypto_withdrawal_notify(withdrawal))
+
+def _crypto_withdrawals_reconcile(db_session, withdrawals):
+    recent = dasset.crypto_withdrawals_recent()
+    if recent is None:
+        logger.error('failed to list the recent crypto withdrawals')
+        return
+    taken = CryptoWithdrawal.exchange_references_in(db_session, [str(withdrawal.id) for withdrawal in recent])
+    with commitbatch.CommitBatch(db_session) as batch:
+        for withdrawal in withdrawals:
+            _crypto_withdrawal_reconcile_and_commit(db_session, batch, withdrawal, recent, taken)
 
 def crypto_withdrawals_update(db_session):
     withdrawals = CryptoWithdrawal.all_active(db_session)
     logger.info('num withdrawals: %d', len(withdrawals))
-    for withdrawal in withdrawals:
-        crypto_withdrawal_update_and_commit(db_session, withdrawal)
+    if not withdrawals or not tripwire.WITHDRAWAL.ok:
+        return
+    # settle the withdrawals of unknown outcome first, those found on the exchange are synced with the others below
+    unknown = [withdrawal for withdrawal in withdrawals if withdrawal.status == withdrawal.STATUS_UNKNOWN]
+    if unknown:
+        _crypto_withdrawals_reconcile(db_session, unknown)
+    # sync the exchange status of all the withdrawals at once
+    statuses = dasset.crypto_withdrawal_statuses([withdrawal.exchange_reference for withdrawal in withdrawals if withdrawal.status == withdrawal.STATUS_CREATED])
+    metrics.gauge_set('crypto_withdrawals_2fa', len([status for status in statuses.values() if status == dasset.CRYPTO_WITHDRAWAL_STATUS_2FA]))
+    metrics.gauge_set('crypto_withdrawals_unknown', len([status for status in statuses.values() if status == dasset.CRYPTO_WITHDRAWAL_STATUS_UNKNOWN]))
+    # and apply the state changes in batches
+    with commitbatch.CommitBatch(db_session) as batch:
+        for withdrawal in sorted(withdrawals, key=lambda withdrawal: withdrawal.user_id):
+            crypto_withdrawal_update_and_commit(db_session, withdrawal, batch, statuses.get(withdrawal.exchange_reference))
+
+# seconds to wait before each status check of a new withdrawal, so a withdrawal costs at most this many status checks
+# and one 2fa confirmation before it is left to the sweep
+CRYPTO_WITHDRAWAL_CONFIRM_BACKOFF = (1, 2, 5, 10, 20, 30)
+
+def crypto_withdrawal_confirm_start(crypto_withdrawal):
+    # call once the withdrawal is committed
+    gevent.spawn_later(CRYPTO_WITHDRAWAL_CONFIRM_BACKOFF[0], crypto_withdrawal_confirm_queue.put, (crypto_withdrawal.token, 0))
+
+def _crypto_withdrawal_confirm_process(db_session, key):
+    token, attempt = key
+    withdrawal = CryptoWithdrawal.from_token(db_session, token)
+    if not withdrawal:
+        logger.error('crypto withdrawal %s not found', token)
+        return
+    if withdrawal.status != withdrawal.STATUS_CREATED or not tripwire.WITHDRAWAL.ok:
+        return
+    status = dasset.crypto_withdrawal_status_check(withdrawal.exchange_reference)
+    # confirms the 2fa (unless already confirmed) or completes the withdrawal
+    crypto_withdrawal_update_and_commit(db_session, withdrawal, status=status)
+    if withdrawal.status != withdrawal.STATUS_CREATED:
+        return
+    attempt += 1
+    if attempt < len(CRYPTO_WITHDRAWAL_CONFIRM_BACKOFF):
+        gevent.spawn_later(CRYPTO_WITHDRAWAL_CONFIRM_BACKOFF[attempt], crypto_withdrawal_confirm_queue.put, (token, attempt))
+    else:
+        logger.info('crypto withdrawal %s not completed yet, leaving it to the sweep', withdrawal.token)
+
+# confirms the 2fa of a new withdrawal (and picks up its completion) right after it is created instead of waiting for
+# the next sweep
+crypto_withdrawal_confirm_queue = workqueue.WorkQueue('crypto_withdrawal_confirm', _crypto_withdrawal_confirm_process, app.config['CRYPTO_WITHDRAWAL_CONFIRM_WORKERS'])
@@ -1,3 +1,4 @@
+from datetime import datetime
 from decimal import Decimal
 import logging
 import threading
@@ -7,6 +8,7 @@ from sqlalchemy.sql import func
 
 from models import User, FiatDbTransaction
 from assets import ASSETS, asset_int_to_dec
+from utils import generate_key
 
 logger = logging.getLogger(__name__)
 _lock = threading.Lock()
@@ -18,7 +20,7 @@ def __balance(session: scoped_session, asset: str, user: User):
     if user:
         query = query.filter(FiatDbTransaction.user_id == user.id)
     credit = query.filter(FiatDbTransaction.action == FiatDbTransaction.ACTION_CREDIT).scalar()
-    debit = query.filter(FiatDbTransaction.action == FiatDbTransaction.ACTION_DEBIT).scalar()
+    debit = query.filter(FiatDbTransaction.action.in_((FiatDbTransaction.ACTION_DEBIT, FiatDbTransaction.ACTION_HOLD))).scalar()
     if credit is None and debit is None:
         return 0
     if debit is None:
@@ -42,6 +44,22 @@ def user_balances(session: scoped_session, user: User):
             balances[asset] = __balance(session, asset, user)
         return balances
 
+def user_balances_bulk(session: scoped_session, asset: str, user_ids: list):
+    # the balances of many users in a single grouped query
+    with _lock:
+        rows = session.query(FiatDbTransaction.user_id, FiatDbTransaction.action, func.sum(FiatDbTransaction.amount)) \
+            .filter(FiatDbTransaction.asset == asset) \
+            .filter(FiatDbTransaction.user_id.in_(user_ids)) \
+            .filter(FiatDbTransaction.action.in_((FiatDbTransaction.ACTION_CREDIT, FiatDbTransaction.ACTION_DEBIT, FiatDbTransaction.ACTION_HOLD))) \
+            .group_by(FiatDbTransaction.user_id, FiatDbTransaction.action).all()
+        balances = {user_id: 0 for user_id in user_ids}
+        for user_id, action, amount in rows:
+            if action == FiatDbTransaction.ACTION_CREDIT:
+                balances[user_id] += amount
+            else:
+                balances[user_id] -= amount
+        return balances
+
 def funds_available_user(session: scoped_session, user: User, asset: str, amount: Decimal):
     balance = user_balance(session, asset, user)
     balance_dec = asset_int_to_dec(asset, balance)
@@ -59,9 +77,45 @@ def tx_create(session: scoped_session, user: User, action: str, asset: str, amou
             error = f'{action}: {user.email} is not active'
         elif amount <= 0:
             error = f'{action}: amount ({amount}) is less then or equal to zero'
-        elif not action in (FiatDbTransaction.ACTION_CREDIT, FiatDbTransaction.ACTION_DEBIT):
+        elif not action in (FiatDbTransaction.ACTION_CREDIT, FiatDbTransaction.ACTION_DEBIT, FiatDbTransaction.ACTION_HOLD):
             error = 'invalid action'
         if error:
             logger.error(error)
             return None
         return FiatDbTransaction(user, action, asset, amount, attachment)
+
+def tx_mappings_create(action: str, asset: str, entries: list):
+    # row mappings for 'session.bulk_insert_mappings()' from (user_id, amount, attachment) entries, the users are
+    # assumed to be active
+    logger.info('%s: %s: %d transactions', action, asset, len(entries))
+    with _lock:
+        if not action in (FiatDbTransaction.ACTION_CREDIT, FiatDbTransaction.ACTION_DEBIT):
+            logger.error('invalid action')
+            return None
+        now = datetime.now()
+        mappings = []
+        for user_id, amount, attachment in entries:
+            if amount <= 0:
+                logger.error('%s: amount (%s) is less then or equal to zero', action, amount)
+                return None
+            mappings.append(dict(user_id=user_id, token=generate_key(), date=now, action=action, asset=asset, amount=amount, attachment=attachment))
+        return mappings
+
+def hold_confirm(ftx: FiatDbTransaction, attachment: str):
+    logger.info('%s: confirm hold %s: %s', ftx.user.email, ftx.token, attachment)
+    with _lock:
+        if ftx.action != FiatDbTransaction.ACTION_HOLD:
+            logger.error('%s is not a hold', ftx.token)
+            return None
+        ftx.action = FiatDbTransaction.ACTION_DEBIT
+        ftx.attachment = attachment
+        return ftx
+
+def hold_release(ftx: FiatDbTransaction):
+    logger.info('%s: release hold %s', ftx.user.email, ftx.token)
+    with _lock:
+        if ftx.action != FiatDbTransaction.ACTION_HOLD:
+            logger.error('%s is not a hold', ftx.token)
+            return None
+        ftx.action = FiatDbTransaction.ACTION_RELEASED
+        return ftx
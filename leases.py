@@ -0,0 +1,76 @@
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from sqlalchemy import and_, or_
+from sqlalchemy.sql import func
+from sqlalchemy.dialects import postgresql
+
+from app_core import app, db
+from models import JobLease
+from utils import generate_key
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = app.config['JOB_LEASE_SECONDS']
+INSTANCE_ID = f'{socket.gethostname()}-{os.getpid()}-{generate_key(6)}'
+
+# name -> time of our last successful acquire/renew
+_held = {}
+_created = set()
+
+def _acquire(db_session, name):
+    # takes (or renews) the lease if it is free, expired or already ours, the database clock is used throughout so the
+    # instances do not need synchronized clocks
+    if name not in _created:
+        db_session.execute(postgresql.insert(JobLease.__table__).values(name=name).on_conflict_do_nothing(index_elements=['name']))
+        _created.add(name)
+    table = JobLease.__table__
+    stmt = table.update() \
+        .where(and_(table.c.name == name, or_(table.c.holder == INSTANCE_ID, table.c.expires_at.is_(None), table.c.expires_at < func.now()))) \
+        .values(holder=INSTANCE_ID, heartbeat_at=func.now(), expires_at=func.now() + timedelta(seconds=LEASE_SECONDS))
+    acquired = db_session.execute(stmt).rowcount == 1
+    db_session.commit()
+    return acquired
+
+def held(name):
+    # true if this instance holds the lease 'name' (acquiring it if possible)
+    if name in _held and time.time() - _held[name] < LEASE_SECONDS / 3:
+        return True
+    try:
+        with app.app_context():
+            acquired = _acquire(db.session, name)
+    except Exception: # pylint: disable=broad-except
+        logger.exception('failed to acquire lease %s', name)
+        acquired = False
+    if acquired:
+        if name not in _held:
+            logger.info('acquired lease %s', name)
+        _held[name] = time.time()
+    elif name in _held:
+        logger.warning('lost lease %s', name)
+        del _held[name]
+    metrics.gauge_set(f'lease_{name}_held', 1 if acquired else 0)
+    return acquired
+
+def heartbeat():
+    # renews the leases we hold, called regularly (well within LEASE_SECONDS) so long running jobs keep their lease
+    for name in list(_held):
+        held(name)
+
+def run(name, func_):
+    # runs the job 'func_' if this instance holds its lease and records the run
+    if not held(name):
+        return
+    start = time.time()
+    try:
+        func_()
+    finally:
+        elapsed = time.time() - start
+        with app.app_context():
+            table = JobLease.__table__
+            db.session.execute(table.update().where(table.c.name == name).values(last_run_at=func.now(), last_run_holder=INSTANCE_ID, last_run_seconds=elapsed))
+            db.session.commit()
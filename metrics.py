@@ -0,0 +1,54 @@
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+TIMING_SAMPLES = 1000
+
+@dataclass
+class Timing:
+    name: str
+    count: int = 0
+    total: float = 0
+    max: float = 0
+    samples: deque = field(default_factory=lambda: deque(maxlen=TIMING_SAMPLES))
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def mean(self) -> float:
+        if not self.count:
+            return 0
+        return self.total / self.count
+
+    def percentile(self, pct: float) -> float:
+        return percentile(list(self.samples), pct)
+
+COUNTERS = {}
+GAUGES = {}
+TIMINGS = {}
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def counter_inc(name: str, amount: int = 1):
+    COUNTERS[name] = COUNTERS.get(name, 0) + amount
+
+def gauge_set(name: str, value: float):
+    GAUGES[name] = value
+
+def gauge_inc(name: str, amount: float = 1):
+    GAUGES[name] = GAUGES.get(name, 0) + amount
+
+def timing_record(name: str, seconds: float):
+    if name not in TIMINGS:
+        TIMINGS[name] = Timing(name=name)
+    TIMINGS[name].record(seconds)
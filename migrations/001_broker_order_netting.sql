@@ -0,0 +1,8 @@
+-- per market netting of broker orders: the part of a broker order placed on the exchange and what each exchange order
+-- was placed for
+BEGIN;
+ALTER TABLE broker_order ADD COLUMN exchange_allocation BIGINT;
+ALTER TABLE exchange_order ADD COLUMN market VARCHAR;
+ALTER TABLE exchange_order ADD COLUMN side VARCHAR;
+ALTER TABLE exchange_order ADD COLUMN base_amount BIGINT;
+COMMIT;
@@ -0,0 +1,5 @@
+-- firm quote tokens: the key of the quote a broker order was created from, so a quote token is only redeemed once
+BEGIN;
+ALTER TABLE broker_order ADD COLUMN quote_key VARCHAR(255);
+CREATE UNIQUE INDEX broker_order_quote_key_key ON broker_order (quote_key);
+COMMIT;
@@ -0,0 +1,7 @@
+-- exchange order retries with backoff: the failed attempts of a broker order and when it may be retried
+BEGIN;
+ALTER TABLE broker_order ADD COLUMN attempts INTEGER;
+UPDATE broker_order SET attempts = 0;
+ALTER TABLE broker_order ALTER COLUMN attempts SET NOT NULL;
+ALTER TABLE broker_order ADD COLUMN next_attempt_at TIMESTAMP WITHOUT TIME ZONE;
+COMMIT;
@@ -0,0 +1,5 @@
+-- crypto withdrawals of unknown outcome: they have no exchange reference until reconciled and refer to their hold
+BEGIN;
+ALTER TABLE crypto_withdrawal ALTER COLUMN exchange_reference DROP NOT NULL;
+ALTER TABLE crypto_withdrawal ADD COLUMN hold_id INTEGER REFERENCES fiat_db_transaction (id);
+COMMIT;
@@ -0,0 +1,8 @@
+-- limit and stop broker orders: the order type, its trigger price and the slippage allowed when it is triggered
+BEGIN;
+ALTER TABLE broker_order ADD COLUMN order_type VARCHAR;
+UPDATE broker_order SET order_type = 'market';
+ALTER TABLE broker_order ALTER COLUMN order_type SET NOT NULL;
+ALTER TABLE broker_order ADD COLUMN trigger_price BIGINT;
+ALTER TABLE broker_order ADD COLUMN slippage_bps INTEGER;
+COMMIT;
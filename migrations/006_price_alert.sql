@@ -0,0 +1,16 @@
+-- price alerts
+BEGIN;
+CREATE TABLE price_alert (
+    id SERIAL PRIMARY KEY,
+    token VARCHAR(255) NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL REFERENCES "user" (id),
+    date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    market VARCHAR NOT NULL,
+    direction VARCHAR NOT NULL,
+    quote_asset VARCHAR NOT NULL,
+    threshold BIGINT NOT NULL,
+    fcm_registration_token VARCHAR,
+    status VARCHAR NOT NULL,
+    fired_at TIMESTAMP WITHOUT TIME ZONE
+);
+COMMIT;
@@ -0,0 +1,19 @@
+-- recurring buys
+BEGIN;
+CREATE TABLE recurring_buy (
+    id SERIAL PRIMARY KEY,
+    token VARCHAR(255) NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL REFERENCES "user" (id),
+    date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    market VARCHAR NOT NULL,
+    quote_asset VARCHAR NOT NULL,
+    quote_amount BIGINT NOT NULL,
+    interval_days INTEGER NOT NULL,
+    next_run_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    last_run_at TIMESTAMP WITHOUT TIME ZONE,
+    last_result VARCHAR,
+    last_broker_order_token VARCHAR(255),
+    status VARCHAR NOT NULL
+);
+CREATE INDEX ix_recurring_buy_next_run_at ON recurring_buy (next_run_at);
+COMMIT;
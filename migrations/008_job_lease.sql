@@ -0,0 +1,13 @@
+-- job leases, so a periodic job runs on one app instance
+BEGIN;
+CREATE TABLE job_lease (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE,
+    holder VARCHAR(255),
+    heartbeat_at TIMESTAMP WITHOUT TIME ZONE,
+    expires_at TIMESTAMP WITHOUT TIME ZONE,
+    last_run_at TIMESTAMP WITHOUT TIME ZONE,
+    last_run_holder VARCHAR(255),
+    last_run_seconds FLOAT
+);
+COMMIT;
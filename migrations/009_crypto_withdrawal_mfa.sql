@@ -0,0 +1,4 @@
+-- when the 2fa of a crypto withdrawal was confirmed, so it is only confirmed once
+BEGIN;
+ALTER TABLE crypto_withdrawal ADD COLUMN mfa_confirmed_at TIMESTAMP WITHOUT TIME ZONE;
+COMMIT;
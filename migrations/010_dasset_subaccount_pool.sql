@@ -0,0 +1,14 @@
+-- the pool of pre-provisioned dasset subaccounts: a pool subaccount has no user until it is claimed, the existing
+-- subaccounts all belong to users so they are not part of the pool
+BEGIN;
+ALTER TABLE dasset_subaccount ALTER COLUMN user_id DROP NOT NULL;
+ALTER TABLE dasset_subaccount ADD COLUMN provisioned BOOLEAN;
+UPDATE dasset_subaccount SET provisioned = false;
+ALTER TABLE dasset_subaccount ALTER COLUMN provisioned SET NOT NULL;
+CREATE TABLE dasset_subaccount_address (
+    id SERIAL PRIMARY KEY,
+    dasset_subaccount_id INTEGER NOT NULL REFERENCES dasset_subaccount (id),
+    asset VARCHAR(255) NOT NULL,
+    address VARCHAR(255) NOT NULL UNIQUE
+);
+COMMIT;
@@ -9,7 +9,8 @@ import logging
 from flask import url_for
 from flask_security import UserMixin, RoleMixin
 from marshmallow import Schema, fields
-from sqlalchemy import and_, exists
+from sqlalchemy import and_, exists, select
+from sqlalchemy.orm import joinedload
 
 from app_core import db
 from utils import generate_key
@@ -26,6 +27,14 @@ class FromTokenMixin():
     def from_token(cls, session, token):
         return session.query(cls).filter(cls.token == token).first()
 
+class ClaimMixin():
+    @classmethod
+    def claim_row(cls, session, id_):
+        # locks the row until the end of the transaction and reloads it, returns None if another transaction (of any
+        # app instance) has it locked, the holder is already processing it so we skip it rather than wait on it
+        # pylint: disable=no-member
+        return session.query(cls).filter(cls.id == id_).populate_existing().with_for_update(skip_locked=True).first()
+
 class FromUserMixin():
     @classmethod
     def from_user(cls, session, user, offset, limit):
@@ -366,6 +375,9 @@ class BrokerOrderSchema(Schema):
     quote_asset = fields.String()
     quote_amount = fields.Integer()
     quote_amount_dec = fields.Method('get_quote_amount_dec')
+    order_type = fields.String()
+    trigger_price_dec = fields.Method('get_trigger_price_dec')
+    slippage_bps = fields.Integer()
     status = fields.String()
 
     def get_base_amount_dec(self, obj):
@@ -374,16 +386,28 @@ class BrokerOrderSchema(Schema):
     def get_quote_amount_dec(self, obj):
         return str(assets.asset_int_to_dec(obj.quote_asset, obj.quote_amount))
 
-class BrokerOrder(db.Model, FromUserMixin, FromTokenMixin):
+    def get_trigger_price_dec(self, obj):
+        if obj.trigger_price is None:
+            return None
+        return str(assets.asset_int_to_dec(obj.quote_asset, obj.trigger_price))
+
+class BrokerOrder(db.Model, FromUserMixin, FromTokenMixin, ClaimMixin):
     STATUS_CREATED = 'created'
+    STATUS_WAITING = 'waiting'
     STATUS_READY = 'ready'
     STATUS_EXCHANGE = 'exchanging'
     STATUS_COMPLETED = 'completed'
     STATUS_EXPIRED = 'expired'
     STATUS_FAILED = 'failed'
     STATUS_CANCELLED = 'cancelled'
+    STATUS_DEAD_LETTER = 'dead_letter'
+
+    ORDER_TYPE_MARKET = 'market'
+    ORDER_TYPE_LIMIT = 'limit'
+    ORDER_TYPE_STOP = 'stop'
 
     MINUTES_EXPIRY = 15
+    DAYS_TRIGGER_EXPIRY = 30
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -399,7 +423,19 @@ class BrokerOrder(db.Model, FromUserMixin, FromTokenMixin):
     base_amount = db.Column(db.BigInteger, nullable=False)
     quote_amount = db.Column(db.BigInteger, nullable=False)
     exchange_order_id = db.Column(db.Integer, db.ForeignKey('exchange_order.id'))
-    exchange_order = db.relationship('ExchangeOrder')
+    exchange_order = db.relationship('ExchangeOrder', backref=db.backref('broker_orders', lazy='dynamic'))
+    # the part of 'base_amount' filled by the exchange order, the rest was netted against opposing broker orders
+    exchange_allocation = db.Column(db.BigInteger)
+    # failed attempts at creating the exchange order and when to try again
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime())
+    # limit and stop orders wait (with the users funds debited) until the market crosses the trigger price
+    order_type = db.Column(db.String, nullable=False, default='market')
+    trigger_price = db.Column(db.BigInteger)
+    # how far (in basis points) the price may move past the trigger price when the order is requoted on triggering
+    slippage_bps = db.Column(db.Integer)
+    # the key of the quote token the order was created from, unique so a token can only be redeemed once
+    quote_key = db.Column(db.String(255), unique=True)
 
     status = db.Column(db.String, nullable=False)
 
@@ -414,6 +450,8 @@ class BrokerOrder(db.Model, FromUserMixin, FromTokenMixin):
         self.quote_asset = quote_asset
         self.base_amount = base_amount
         self.quote_amount = quote_amount
+        self.attempts = 0
+        self.order_type = self.ORDER_TYPE_MARKET
         self.status = self.STATUS_CREATED
 
     def to_json(self):
@@ -422,19 +460,217 @@ class BrokerOrder(db.Model, FromUserMixin, FromTokenMixin):
 
     @classmethod
     def all_active(cls, session):
-        return session.query(cls).filter(and_(cls.status != cls.STATUS_COMPLETED, and_(cls.status != cls.STATUS_EXPIRED, and_(cls.status != cls.STATUS_FAILED, cls.status != cls.STATUS_CANCELLED)))).all()
+        # created orders (unaccepted quotes) are left to 'expire_created()'
+        return session.query(cls).filter(cls.status.in_((cls.STATUS_WAITING, cls.STATUS_READY, cls.STATUS_EXCHANGE))).all()
+
+    @classmethod
+    def expire_created(cls, session, now):
+        # expires the created orders past their expiry in a single statement, returns their ids, orders claimed elsewhere
+        # (eg being accepted) are skipped rather than waited on
+        table = cls.__table__
+        expired = select([table.c.id]).where(and_(table.c.status == cls.STATUS_CREATED, table.c.expiry < now)).with_for_update(skip_locked=True)
+        stmt = table.update().where(table.c.id.in_(expired)).values(status=cls.STATUS_EXPIRED).returning(cls.id, cls.user_id)
+        return [row[0] for row in session.execute(stmt)]
+
+    @classmethod
+    def from_ids(cls, session, ids):
+        return session.query(cls).options(joinedload(cls.user)).filter(cls.id.in_(ids)).all()
+
+    @classmethod
+    def all_waiting(cls, session):
+        return session.query(cls).filter(cls.status == cls.STATUS_WAITING).all()
+
+    def attempt_due(self, now):
+        return not self.next_attempt_at or self.next_attempt_at <= now
+
+    @classmethod
+    def ready_in_market(cls, session, market):
+        return session.query(cls).filter(and_(cls.status == cls.STATUS_READY, cls.market == market)).order_by(cls.id).all()
+
+    @classmethod
+    def claim_ready_in_market(cls, session, market):
+        # like 'ready_in_market()' but claims the orders (see 'ClaimMixin.claim_row()'), skipping any claimed elsewhere
+        return session.query(cls).filter(and_(cls.status == cls.STATUS_READY, cls.market == market)).order_by(cls.id) \
+            .populate_existing().with_for_update(skip_locked=True).all()
+
+    @classmethod
+    def ready_markets(cls, session):
+        return [row[0] for row in session.query(cls.market).filter(cls.status == cls.STATUS_READY).distinct().all()]
+
+class PriceAlertSchema(Schema):
+    token = fields.String()
+    date = fields.DateTime()
+    market = fields.String()
+    direction = fields.String()
+    quote_asset = fields.String()
+    threshold = fields.Integer()
+    threshold_dec = fields.Method('get_threshold_dec')
+    status = fields.String()
+    fired_at = fields.DateTime()
+
+    def get_threshold_dec(self, obj):
+        return str(assets.asset_int_to_dec(obj.quote_asset, obj.threshold))
+
+class PriceAlert(db.Model, FromUserMixin, FromTokenMixin):
+    STATUS_ACTIVE = 'active'
+    STATUS_FIRED = 'fired'
+    STATUS_DELETED = 'deleted'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    token = db.Column(db.String(255), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user = db.relationship('User', backref=db.backref('price_alerts', lazy='dynamic'))
+    date = db.Column(db.DateTime(), nullable=False)
+    market = db.Column(db.String, nullable=False)
+    direction = db.Column(db.String, nullable=False)
+    quote_asset = db.Column(db.String, nullable=False)
+    # mid price threshold in quote asset integer units
+    threshold = db.Column(db.BigInteger, nullable=False)
+    # optional device to push the alert to (in addition to the users websocket room)
+    fcm_registration_token = db.Column(db.String)
+    status = db.Column(db.String, nullable=False)
+    fired_at = db.Column(db.DateTime())
+
+    def __init__(self, user, market, direction, quote_asset, threshold, fcm_registration_token):
+        self.token = generate_key()
+        self.user = user
+        self.date = datetime.now()
+        self.market = market
+        self.direction = direction
+        self.quote_asset = quote_asset
+        self.threshold = threshold
+        self.fcm_registration_token = fcm_registration_token
+        self.status = self.STATUS_ACTIVE
+
+    def to_json(self):
+        alert_schema = PriceAlertSchema()
+        return alert_schema.dump(self)
+
+    @classmethod
+    def all_active(cls, session):
+        return session.query(cls).filter(cls.status == cls.STATUS_ACTIVE).all()
+
+    @classmethod
+    def active_for_user(cls, session, user):
+        return session.query(cls).filter(and_(cls.user_id == user.id, cls.status == cls.STATUS_ACTIVE)).order_by(cls.id.desc()).all()
+
+    @classmethod
+    def fire_from_tokens(cls, session, tokens, now):
+        # fires the alerts still active in a single conditional update and returns them, an alert fired by another
+        # instance (from its own order book) is not returned so it is only pushed once
+        stmt = cls.__table__.update().where(and_(cls.token.in_(tokens), cls.status == cls.STATUS_ACTIVE)).values(status=cls.STATUS_FIRED, fired_at=now).returning(cls.id)
+        ids = [row[0] for row in session.execute(stmt)]
+        if not ids:
+            return []
+        return session.query(cls).filter(cls.id.in_(ids)).populate_existing().all()
+
+class RecurringBuySchema(Schema):
+    token = fields.String()
+    date = fields.DateTime()
+    market = fields.String()
+    quote_asset = fields.String()
+    quote_amount = fields.Integer()
+    quote_amount_dec = fields.Method('get_quote_amount_dec')
+    interval_days = fields.Integer()
+    next_run_at = fields.DateTime()
+    last_run_at = fields.DateTime()
+    last_result = fields.String()
+    last_broker_order_token = fields.String()
+    status = fields.String()
+
+    def get_quote_amount_dec(self, obj):
+        return str(assets.asset_int_to_dec(obj.quote_asset, obj.quote_amount))
+
+class RecurringBuy(db.Model, FromUserMixin, FromTokenMixin):
+    STATUS_ACTIVE = 'active'
+    STATUS_CANCELLED = 'cancelled'
+
+    RESULT_ORDERED = 'ordered'
+    RESULT_INSUFFICIENT_FUNDS = 'insufficient_funds'
+    RESULT_AMOUNT_TOO_LOW = 'amount_too_low'
+    RESULT_MARKET_UNAVAILABLE = 'market_unavailable'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    token = db.Column(db.String(255), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user = db.relationship('User', backref=db.backref('recurring_buys', lazy='dynamic'))
+    date = db.Column(db.DateTime(), nullable=False)
+    market = db.Column(db.String, nullable=False)
+    quote_asset = db.Column(db.String, nullable=False)
+    # the amount spent each run (including the broker fee)
+    quote_amount = db.Column(db.BigInteger, nullable=False)
+    interval_days = db.Column(db.Integer, nullable=False)
+    next_run_at = db.Column(db.DateTime(), nullable=False, index=True)
+    last_run_at = db.Column(db.DateTime())
+    last_result = db.Column(db.String)
+    last_broker_order_token = db.Column(db.String(255))
+    status = db.Column(db.String, nullable=False)
+
+    def __init__(self, user, market, quote_asset, quote_amount, interval_days, next_run_at):
+        self.token = generate_key()
+        self.user = user
+        self.date = datetime.now()
+        self.market = market
+        self.quote_asset = quote_asset
+        self.quote_amount = quote_amount
+        self.interval_days = interval_days
+        self.next_run_at = next_run_at
+        self.status = self.STATUS_ACTIVE
+
+    def to_json(self):
+        rb_schema = RecurringBuySchema()
+        return rb_schema.dump(self)
+
+    @classmethod
+    def all_active(cls, session):
+        return session.query(cls.token, cls.next_run_at).filter(cls.status == cls.STATUS_ACTIVE).all()
+
+    @classmethod
+    def created_since(cls, session, since):
+        return session.query(cls.token, cls.next_run_at).filter(and_(cls.status == cls.STATUS_ACTIVE, cls.date >= since)).all()
+
+    @classmethod
+    def due_from_tokens(cls, session, tokens, now):
+        # the active recurring buys of active users that are due
+        return session.query(cls).join(User, cls.user_id == User.id).filter(and_(cls.token.in_(tokens), and_(cls.status == cls.STATUS_ACTIVE, and_(cls.next_run_at <= now, User.active.is_(True))))).all()
 
 class DassetSubaccount(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime(), nullable=False, unique=False)
     subaccount_id = db.Column(db.String, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # pool subaccounts have no user until they are claimed
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship('User', uselist=False, back_populates='dasset_subaccount')
+    # a pool subaccount is provisioned once it has a deposit address for every crypto asset
+    provisioned = db.Column(db.Boolean, nullable=False, default=False)
 
     def __init__(self, user, subaccount_id):
         self.user = user
         self.date = datetime.now()
         self.subaccount_id = subaccount_id
+        self.provisioned = False
+
+    @classmethod
+    def claim(cls, session, user):
+        # assigns a provisioned pool subaccount to the user with a single update, concurrent claims skip each others
+        # rows rather than wait on them
+        table = cls.__table__
+        free = select([table.c.id]).where(and_(table.c.user_id.is_(None), table.c.provisioned.is_(True))).order_by(table.c.id).limit(1).with_for_update(skip_locked=True).as_scalar()
+        row = session.execute(table.update().where(table.c.id == free).values(user_id=user.id).returning(table.c.id)).first()
+        if not row:
+            return None
+        session.expire(user, ['dasset_subaccount'])
+        return session.query(cls).get(row[0])
+
+    @classmethod
+    def pool_free_count(cls, session):
+        return session.query(cls).filter(and_(cls.user_id.is_(None), cls.provisioned.is_(True))).count()
+
+    @classmethod
+    def pool_unprovisioned(cls, session):
+        return session.query(cls).filter(and_(cls.user_id.is_(None), cls.provisioned.is_(False))).all()
 
     @classmethod
     def count(cls, session):
@@ -447,16 +683,42 @@ class DassetSubaccount(db.Model):
     def __repr__(self):
         return f'<DassetSubaccount {self.subaccount_id}>'
 
+class DassetSubaccountAddress(db.Model):
+    # deposit addresses provisioned ahead of time for the pool subaccounts
+    id = db.Column(db.Integer, primary_key=True)
+    dasset_subaccount_id = db.Column(db.Integer, db.ForeignKey('dasset_subaccount.id'), nullable=False)
+    dasset_subaccount = db.relationship('DassetSubaccount', backref=db.backref('pool_addresses', lazy='dynamic'))
+    asset = db.Column(db.String(255), nullable=False)
+    address = db.Column(db.String(255), unique=True, nullable=False)
+
+    def __init__(self, dasset_subaccount, asset, address):
+        self.dasset_subaccount = dasset_subaccount
+        self.asset = asset
+        self.address = address
+
+    @classmethod
+    def from_subaccount_asset(cls, session, dasset_subaccount, asset):
+        return session.query(cls).filter(and_(cls.dasset_subaccount_id == dasset_subaccount.id, cls.asset == asset)).first()
+
+    def __repr__(self):
+        return f'<DassetSubaccountAddress {self.asset} {self.address}>'
+
 class ExchangeOrder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(255), unique=True, nullable=False)
     date = db.Column(db.DateTime(), nullable=False)
     exchange_reference = db.Column(db.String, nullable=False)
+    market = db.Column(db.String)
+    side = db.Column(db.String)
+    base_amount = db.Column(db.BigInteger)
 
-    def __init__(self, exchange_reference):
+    def __init__(self, exchange_reference, market=None, side=None, base_amount=None):
         self.token = generate_key()
         self.date = datetime.now()
         self.exchange_reference = exchange_reference
+        self.market = market
+        self.side = side
+        self.base_amount = base_amount
 
 class CryptoWithdrawalSchema(Schema):
     token = fields.String()
@@ -471,10 +733,12 @@ class CryptoWithdrawalSchema(Schema):
     def get_amount_dec(self, obj):
         return str(assets.asset_int_to_dec(obj.asset, obj.amount))
 
-class CryptoWithdrawal(db.Model, FromUserMixin):
+class CryptoWithdrawal(db.Model, FromUserMixin, FromTokenMixin, ClaimMixin):
     STATUS_CREATED = 'created'
     STATUS_COMPLETED = 'completed'
     STATUS_CANCELLED = 'cancelled'
+    # the exchange may or may not have created the withdrawal, the funds stay on hold until it is reconciled
+    STATUS_UNKNOWN = 'unknown'
 
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(255), unique=True, nullable=False)
@@ -484,8 +748,14 @@ class CryptoWithdrawal(db.Model, FromUserMixin):
     asset = db.Column(db.String, nullable=False)
     amount = db.Column(db.BigInteger, nullable=False)
     recipient = db.Column(db.String, nullable=False)
-    exchange_reference = db.Column(db.String, nullable=False)
+    # null while the status is unknown
+    exchange_reference = db.Column(db.String)
+    # the hold on the users funds while the status is unknown
+    hold_id = db.Column(db.Integer, db.ForeignKey('fiat_db_transaction.id'))
+    hold = db.relationship('FiatDbTransaction')
     txid = db.Column(db.String)
+    # when the 2fa of the exchange withdrawal was confirmed, it is only ever confirmed once
+    mfa_confirmed_at = db.Column(db.DateTime())
     status = db.Column(db.String, nullable=False)
 
     def __init__(self, user, asset, amount, recipient, exchange_reference):
@@ -506,6 +776,13 @@ class CryptoWithdrawal(db.Model, FromUserMixin):
     def all_active(cls, session):
         return session.query(cls).filter(and_(cls.status != cls.STATUS_COMPLETED, cls.status != cls.STATUS_CANCELLED)).all()
 
+    @classmethod
+    def exchange_references_in(cls, session, exchange_references):
+        # the subset of 'exchange_references' already recorded against a withdrawal
+        if not exchange_references:
+            return set()
+        return {row[0] for row in session.query(cls.exchange_reference).filter(cls.exchange_reference.in_(exchange_references))}
+
 class CryptoDepositSchema(Schema):
     token = fields.String()
     date = fields.DateTime()
@@ -518,7 +795,7 @@ class CryptoDepositSchema(Schema):
     def get_amount_dec(self, obj):
         return str(assets.asset_int_to_dec(obj.asset, obj.amount))
 
-class CryptoDeposit(db.Model, FromUserMixin):
+class CryptoDeposit(db.Model, FromUserMixin, ClaimMixin):
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(255), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -550,6 +827,13 @@ class CryptoDeposit(db.Model, FromUserMixin):
     def from_txid(cls, session, txid):
         return session.query(cls).filter(cls.txid == txid).first()
 
+    @classmethod
+    def from_txids(cls, session, txids):
+        # txid -> deposit
+        if not txids:
+            return {}
+        return {deposit.txid: deposit for deposit in session.query(cls).filter(cls.txid.in_(txids))}
+
     @classmethod
     def not_in_broker_orders(cls, session, asset, amount):
         session.query(cls).filter(cls.asset == asset).filter(cls.amount == amount) \
@@ -815,6 +1099,9 @@ class FiatDbTransactionSchema(Schema):
 class FiatDbTransaction(db.Model, FromTokenMixin):
     ACTION_CREDIT = 'credit'
     ACTION_DEBIT = 'debit'
+    # a reservation that counts as a debit until it is confirmed (becomes a debit) or released
+    ACTION_HOLD = 'hold'
+    ACTION_RELEASED = 'released'
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -865,7 +1152,7 @@ class FiatDepositSchema(Schema):
             payment_url = url_for('payments.payment_interstitial', token=obj.windcave_payment_request.token, _external=True)
         return payment_url
 
-class FiatDeposit(db.Model, FromUserMixin, FromTokenMixin):
+class FiatDeposit(db.Model, FromUserMixin, FromTokenMixin, ClaimMixin):
     STATUS_CREATED = 'created'
     STATUS_COMPLETED = 'completed'
     STATUS_EXPIRED = 'expired'
@@ -904,6 +1191,34 @@ class FiatDeposit(db.Model, FromUserMixin, FromTokenMixin):
     def all_active(cls, session):
         return session.query(cls).filter(and_(cls.status != cls.STATUS_COMPLETED, and_(cls.status != cls.STATUS_EXPIRED, cls.status != cls.STATUS_CANCELLED))).all()
 
+    @classmethod
+    def active_expiring(cls, session, before):
+        return session.query(cls).filter(and_(cls.status == cls.STATUS_CREATED, cls.expiry < before)).all()
+
+    @classmethod
+    def without_session(cls, session, before):
+        # tokens of the created deposits (made before 'before') still without a windcave session
+        return [row[0] for row in session.query(cls.token).filter(and_(cls.status == cls.STATUS_CREATED, cls.windcave_payment_request_id.is_(None), cls.date < before)).all()]
+
+    @classmethod
+    def expire_created(cls, session, before):
+        # expires the created deposits with an expiry before 'before' in a single statement, returns their ids, deposits
+        # claimed elsewhere (eg being completed) are skipped rather than waited on
+        table = cls.__table__
+        expired = select([table.c.id]).where(and_(table.c.status == cls.STATUS_CREATED, table.c.expiry < before)).with_for_update(skip_locked=True)
+        stmt = table.update().where(table.c.id.in_(expired)).values(status=cls.STATUS_EXPIRED).returning(cls.id, cls.user_id)
+        return [row[0] for row in session.execute(stmt)]
+
+    @classmethod
+    def mark_completed(cls, session, id_):
+        # completes the deposit only if it is still created, returns False otherwise so it is never credited twice
+        stmt = cls.__table__.update().where(and_(cls.id == id_, cls.status == cls.STATUS_CREATED)).values(status=cls.STATUS_COMPLETED)
+        return session.execute(stmt).rowcount == 1
+
+    @classmethod
+    def from_ids(cls, session, ids):
+        return session.query(cls).options(joinedload(cls.user)).filter(cls.id.in_(ids)).all()
+
 class FiatWithdrawalSchema(Schema):
     token = fields.String()
     date = fields.DateTime()
@@ -916,7 +1231,7 @@ class FiatWithdrawalSchema(Schema):
     def get_amount_dec(self, obj):
         return str(assets.asset_int_to_dec(obj.asset, obj.amount))
 
-class FiatWithdrawal(db.Model, FromUserMixin, FromTokenMixin):
+class FiatWithdrawal(db.Model, FromUserMixin, FromTokenMixin, ClaimMixin):
     STATUS_CREATED = 'created'
     STATUS_COMPLETED = 'completed'
     STATUS_CANCELLED = 'cancelled'
@@ -982,6 +1297,39 @@ class CryptoAddress(db.Model, FromUserMixin):
         return session.query(cls).filter(cls.address == addr).first()
 
     @classmethod
-    def need_to_be_checked(cls, session):
-        now = datetime.timestamp(datetime.now())
-        return session.query(cls).filter(now - cls.checked_at > (cls.checked_at - cls.viewed_at) * 2).all()
+    def from_addrs(cls, session, addrs):
+        # address -> crypto address
+        if not addrs:
+            return {}
+        return {addr.address: addr for addr in session.query(cls).filter(cls.address.in_(addrs))}
+
+    @classmethod
+    def from_ids(cls, session, ids):
+        return session.query(cls).options(joinedload(cls.user)).filter(cls.id.in_(ids)).all()
+
+    @classmethod
+    def poll_schedule(cls, session):
+        return session.query(cls.id, cls.viewed_at, cls.checked_at).all()
+
+    @classmethod
+    def viewed_since(cls, session, since):
+        return session.query(cls.id, cls.viewed_at).filter(cls.viewed_at >= since).all()
+
+class JobLease(db.Model):
+    # a periodic job runs only on the app instance holding its lease, the holder renews the lease while alive and
+    # another instance takes it over once it expires
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), unique=True, nullable=False)
+    holder = db.Column(db.String(255))
+    heartbeat_at = db.Column(db.DateTime())
+    expires_at = db.Column(db.DateTime())
+    last_run_at = db.Column(db.DateTime())
+    last_run_holder = db.Column(db.String(255))
+    last_run_seconds = db.Column(db.Float())
+
+    @classmethod
+    def all(cls, session):
+        return session.query(cls).order_by(cls.name).all()
+
+    def __repr__(self):
+        return f'<JobLease {self.name}>'
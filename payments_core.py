@@ -5,6 +5,8 @@ import logging
 import base64
 import json
 import decimal
+import hmac
+import hashlib
 
 from flask import url_for
 import requests
@@ -18,6 +20,7 @@ from models import WindcavePaymentRequest, PayoutRequest, PayoutGroup, PayoutGro
 logger = logging.getLogger(__name__)
 
 WINDCAVE_API_URL = 'https://sec.windcave.com/api/v1'
+WINDCAVE_TIMEOUT = 10 # seconds
 WINDCAVE_MOCK = os.environ.get('WINDCAVE_MOCK', '')
 WINDCAVE_API_USER = os.environ.get('WINDCAVE_API_USER', '')
 WINDCAVE_API_KEY = os.environ.get('WINDCAVE_API_KEY', '')
@@ -94,6 +97,13 @@ def auth_header():
     data = base64.b64encode(raw).decode('utf-8')
     return 'Basic ' + data
 
+def notification_sig(token):
+    # authenticates the windcave notification url of a payment request
+    return hmac.new(app.config['SECRET_KEY'].encode(), token.encode(), hashlib.sha256).hexdigest()
+
+def notification_sig_check(token, sig):
+    return hmac.compare_digest(notification_sig(token), sig)
+
 def windcave_create_session(amount_cents, token, expiry):
     body = {'type': 'purchase', 'amount': moneyfmt(decimal.Decimal(amount_cents) / decimal.Decimal(100), sep=''), 'currency': 'NZD', 'merchantReference': token}
     body['methods'] = ['account2account']
@@ -103,10 +113,10 @@ def windcave_create_session(amount_cents, token, expiry):
     body['expires'] = expiry.isoformat()
     callback_url = url_for('payments.payment', token=token, _external=True)
     body['callbackUrls'] = {'approved': callback_url, 'declined': callback_url, 'cancelled': callback_url}
-    body['notificationUrl'] = callback_url
+    body['notificationUrl'] = url_for('payments.payment_notification', token=token, sig=notification_sig(token), _external=True)
     logger.info(json.dumps(body))
     headers = {'Content-Type': 'application/json', 'Authorization': auth_header()}
-    r = requests.post(WINDCAVE_API_URL + '/sessions', headers=headers, json=body)
+    r = requests.post(WINDCAVE_API_URL + '/sessions', headers=headers, json=body, timeout=WINDCAVE_TIMEOUT)
     logger.info(r.text)
     r.raise_for_status()
     if r.status_code == 202:
@@ -116,7 +126,7 @@ def windcave_create_session(amount_cents, token, expiry):
 
 def windcave_get_session_status(windcave_session_id):
     headers = {'Authorization': auth_header()}
-    r = requests.get(WINDCAVE_API_URL + '/sessions/' + windcave_session_id, headers=headers)
+    r = requests.get(WINDCAVE_API_URL + '/sessions/' + windcave_session_id, headers=headers, timeout=WINDCAVE_TIMEOUT)
     logger.info(r.text)
     r.raise_for_status()
     jsn = r.json()
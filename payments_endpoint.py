@@ -28,10 +28,6 @@ def payment_interstitial(token=None):
         return redirect('/')
     if req.status != req.STATUS_CREATED:
         return redirect(url_for('payments.payment', token=token))
-    if req.fiat_deposit:
-        depwith.fiat_deposit_update_and_commit(db.session, req.fiat_deposit)
-    if req.status != req.STATUS_CREATED:
-        return redirect(url_for('payments.payment', token=token))
     return render_template('payments/payment_request.html', token=token, interstitial=True, mock=payments_core.mock())
 
 @payments.route('/payment/mock/<token>', methods=['GET'])
@@ -47,6 +43,23 @@ def payment_mock_confirm(token=None):
         depwith.fiat_deposit_update_and_commit(db.session, req.fiat_deposit)
     return redirect(url_for('payments.payment', token=token))
 
+@payments.route('/payment/notification/<token>/<sig>', methods=['GET', 'POST'])
+@limiter.exempt
+def payment_notification(token=None, sig=None):
+    # windcave notifies us of a session update, the notification is only a hint to fetch the session status
+    if not payments_core.notification_sig_check(token, sig):
+        return web_utils.bad_request('not found', code=404)
+    req = WindcavePaymentRequest.from_token(db.session, token)
+    if not req:
+        return web_utils.bad_request('not found', code=404)
+    session_id = request.args.get('sessionId')
+    if session_id and session_id != req.windcave_session_id:
+        logger.warning('windcave notification for %s has session id %s (expected %s)', token, session_id, req.windcave_session_id)
+        return web_utils.bad_request('not found', code=404)
+    if req.status == req.STATUS_CREATED and req.fiat_deposit:
+        depwith.fiat_deposit_queue.put(req.fiat_deposit.token)
+    return 'ok'
+
 @payments.route('/payment/x/<token>', methods=['GET'])
 def payment(token=None):
     req = WindcavePaymentRequest.from_token(db.session, token)
@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+import gevent
+import gevent.event
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_MEDIUM = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = {PRIORITY_HIGH: 'high', PRIORITY_MEDIUM: 'medium', PRIORITY_LOW: 'low'}
+
+MIN_SLEEP = 0.01
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        # returns zero if a token was taken, otherwise the seconds until one will be available
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+        self.updated = now
+
+class PrioritySemaphore:
+    # a counting semaphore that hands a released slot to the highest priority waiter (first come first served within a
+    # priority class)
+
+    def __init__(self, value: int):
+        self.value = value
+        self.waiters = []
+        self.seq = itertools.count()
+
+    def acquire(self, priority: int):
+        if self.value > 0 and not self.waiters:
+            self.value -= 1
+            return
+        entry = (priority, next(self.seq), gevent.event.Event())
+        heapq.heappush(self.waiters, entry)
+        try:
+            entry[2].wait()
+        except BaseException:
+            # killed while waiting, pass the slot on if it was already handed to us
+            if entry[2].is_set():
+                self.release()
+            else:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+            raise
+
+    def release(self):
+        if self.waiters:
+            heapq.heappop(self.waiters)[2].set()
+        else:
+            self.value += 1
+
+    @contextmanager
+    def slot(self, priority: int):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+class Scheduler:
+    # token bucket per budget key, waiters of a lower priority class yield to any waiting higher priority class of the
+    # same group (eg all the budget keys of an account)
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.waiting = {}
+
+    def _bucket(self, key) -> TokenBucket:
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return self.buckets[key]
+
+    def _higher_priority_waiting(self, group, priority: int) -> bool:
+        waiting = self.waiting[group]
+        return any(waiting[p] for p in range(priority))
+
+    def _queue_depth_update(self, priority: int, amount: int):
+        metrics.gauge_inc(f'{self.name}_queue_depth_{PRIORITY_NAMES[priority]}', amount)
+
+    def acquire(self, key, priority: int, group=None):
+        # 'group' defaults to the budget key itself
+        start = time.time()
+        if group is None:
+            group = key
+        if group not in self.waiting:
+            self.waiting[group] = [0] * len(PRIORITY_NAMES)
+        waiting = self.waiting[group]
+        waiting[priority] += 1
+        self._queue_depth_update(priority, 1)
+        try:
+            while True:
+                if self._higher_priority_waiting(group, priority):
+                    wait = 1 / self.rate
+                else:
+                    wait = self._bucket(key).take(time.time())
+                    if wait <= 0:
+                        break
+                gevent.sleep(max(wait, MIN_SLEEP))
+        finally:
+            waiting[priority] -= 1
+            self._queue_depth_update(priority, -1)
+        metrics.timing_record(f'{self.name}_wait_{PRIORITY_NAMES[priority]}', time.time() - start)
+
+    def retry_after(self, key, seconds: float):
+        logger.warning('%s budget %s throttled for %.1f seconds', self.name, key, seconds)
+        self._bucket(key).block(time.time(), seconds)
+        metrics.counter_inc(f'{self.name}_throttled')
@@ -0,0 +1,218 @@
+from datetime import datetime, timedelta
+import logging
+import time
+
+import gevent
+
+from app_core import app, db
+import assets
+from assets import MarketSide
+from models import RecurringBuy, BrokerOrder, FiatDbTransaction
+import dasset
+import fiatdb_core
+import coordinator
+import broker
+import leases
+from utils import generate_key
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOT_SECONDS = app.config['RECURRING_BUY_SLOT_SECONDS']
+LEASE = 'recurring_buys'
+
+class TimingWheel:
+    # hashed timing wheel, each slot maps the keys due in it (or a whole number of revolutions later) to their absolute
+    # tick, so adding or removing a key is O(1) and a tick only visits the keys of its own slot
+
+    def __init__(self, slot_seconds, slots):
+        self.slot_seconds = slot_seconds
+        self.slots = [{} for _ in range(slots)]
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def tick_of(self, timestamp):
+        return int(timestamp // self.slot_seconds)
+
+    def add(self, key, timestamp):
+        tick = self.tick_of(timestamp)
+        self.slots[tick % len(self.slots)][key] = tick
+
+    def remove(self, key, timestamp):
+        self.slots[self.tick_of(timestamp) % len(self.slots)].pop(key, None)
+
+    def clear(self):
+        for slot in self.slots:
+            slot.clear()
+
+    def pop_due(self, tick):
+        slot = self.slots[tick % len(self.slots)]
+        keys = [key for key, key_tick in slot.items() if key_tick <= tick]
+        for key in keys:
+            del slot[key]
+        return keys
+
+# one revolution per day
+_wheel = TimingWheel(SLOT_SECONDS, max(1, 24 * 60 * 60 // SLOT_SECONDS))
+_greenlet = None
+
+def _wheel_add(token, next_run_at):
+    # a run that is already due goes in the current slot (processed when the slot ends)
+    _wheel.add(token, max(next_run_at.timestamp(), time.time()))
+
+def add(recurring_buy):
+    _wheel_add(recurring_buy.token, recurring_buy.next_run_at)
+
+def remove(recurring_buy):
+    _wheel.remove(recurring_buy.token, max(recurring_buy.next_run_at.timestamp(), time.time()))
+
+def next_run(recurring_buy, now):
+    # runs missed while we were down are skipped rather than bought all at once
+    next_run_at = recurring_buy.next_run_at
+    while next_run_at <= now:
+        next_run_at += timedelta(days=recurring_buy.interval_days)
+    return next_run_at
+
+def _market_execute(db_session, market, recurring_buys, now):
+    # buys for all the due recurring buys of a market with one quote and one balance query, the orders are handed to the
+    # broker order pipeline READY (which nets them in to a single exchange order), returns the per recurring buy updates
+    # (written back with a bulk update)
+    base_asset, quote_asset = assets.assets_from_market(market)
+    updates = {}
+    for recurring_buy in recurring_buys:
+        updates[recurring_buy.id] = dict(id=recurring_buy.id, next_run_at=next_run(recurring_buy, now), last_run_at=now, last_result=RecurringBuy.RESULT_INSUFFICIENT_FUNDS, last_broker_order_token=None)
+    order_mappings = []
+    # quote the total due before taking any locks, the users that cannot pay just leave some of it unused
+    total_quote = sum(recurring_buy.quote_amount for recurring_buy in recurring_buys)
+    total_base_dec, quote_result = dasset.bid_base_amount(market, assets.asset_int_to_dec(quote_asset, total_quote))
+    if quote_result != dasset.QuoteResult.OK:
+        result = RecurringBuy.RESULT_AMOUNT_TOO_LOW if quote_result == dasset.QuoteResult.AMOUNT_TOO_LOW else RecurringBuy.RESULT_MARKET_UNAVAILABLE
+        for recurring_buy in recurring_buys:
+            updates[recurring_buy.id]['last_result'] = result
+        db_session.bulk_update_mappings(RecurringBuy, list(updates.values()))
+        db_session.commit()
+        logger.info('%s recurring buys: %d due, quote failed (%s)', market, len(recurring_buys), quote_result)
+        return updates
+    total_base = assets.asset_dec_to_int(base_asset, total_base_dec)
+    user_ids = [recurring_buy.user_id for recurring_buy in recurring_buys]
+    with coordinator.user_locks(user_ids):
+        balances = fiatdb_core.user_balances_bulk(db_session, quote_asset, user_ids)
+        funded = []
+        for recurring_buy in recurring_buys:
+            # a user with several recurring buys in the market can only spend their balance once
+            if balances[recurring_buy.user_id] >= recurring_buy.quote_amount:
+                balances[recurring_buy.user_id] -= recurring_buy.quote_amount
+                funded.append(recurring_buy)
+        if funded:
+            expiry = now + timedelta(minutes=BrokerOrder.MINUTES_EXPIRY)
+            for recurring_buy in funded:
+                # every user gets the average price of the quote
+                base_amount = total_base * recurring_buy.quote_amount // total_quote
+                if base_amount <= 0:
+                    updates[recurring_buy.id]['last_result'] = RecurringBuy.RESULT_AMOUNT_TOO_LOW
+                    continue
+                token = generate_key()
+                order_mappings.append(dict(token=token, user_id=recurring_buy.user_id, date=now, expiry=expiry, market=market, side=MarketSide.BID.value, base_asset=base_asset, quote_asset=quote_asset, base_amount=base_amount, quote_amount=recurring_buy.quote_amount, attempts=0, order_type=BrokerOrder.ORDER_TYPE_MARKET, status=BrokerOrder.STATUS_READY))
+                updates[recurring_buy.id].update(last_result=RecurringBuy.RESULT_ORDERED, last_broker_order_token=token)
+        if order_mappings:
+            # debit users accounts
+            ftx_mappings = fiatdb_core.tx_mappings_create(FiatDbTransaction.ACTION_DEBIT, quote_asset, [(order['user_id'], order['quote_amount'], f'broker order: {order["token"]}') for order in order_mappings])
+            if ftx_mappings is None:
+                raise Exception(f'failed to create fiatdb transactions for {market} recurring buys')
+            db_session.bulk_insert_mappings(BrokerOrder, order_mappings)
+            db_session.bulk_insert_mappings(FiatDbTransaction, ftx_mappings)
+        db_session.bulk_update_mappings(RecurringBuy, list(updates.values()))
+        db_session.commit()
+    logger.info('%s recurring buys: %d due, %d ordered', market, len(recurring_buys), len(order_mappings))
+    metrics.counter_inc('recurring_buys_ordered', len(order_mappings))
+    # the (committed and debited) orders are placed by the broker order pipeline
+    if order_mappings:
+        broker.broker_market_queue.put(market)
+    return updates
+
+def _process_due(tokens):
+    start = time.time()
+    with app.app_context():
+        now = datetime.now()
+        recurring_buys = RecurringBuy.due_from_tokens(db.session, tokens, now)
+        markets = {}
+        for recurring_buy in recurring_buys:
+            markets.setdefault(recurring_buy.market, []).append(recurring_buy)
+        for market, market_buys in markets.items():
+            tokens_by_id = {recurring_buy.id: recurring_buy.token for recurring_buy in market_buys}
+            try:
+                updates = _market_execute(db.session, market, market_buys, now)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('failed to execute %s recurring buys', market)
+                db.session.rollback()
+                # try again next slot
+                for token in tokens_by_id.values():
+                    _wheel_add(token, now)
+                continue
+            for update in updates.values():
+                _wheel_add(tokens_by_id[update['id']], update['next_run_at'])
+    metrics.timing_record('recurring_buy_slot', time.time() - start)
+
+def _load():
+    # (re)builds the wheel from the database, when we start or take over from another instance
+    _wheel.clear()
+    with app.app_context():
+        for token, next_run_at in RecurringBuy.all_active(db.session):
+            _wheel_add(token, next_run_at)
+    logger.info('loaded %d recurring buys', len(_wheel))
+
+def _sync_created(since):
+    # recurring buys created on the other app instances
+    with app.app_context():
+        for token, next_run_at in RecurringBuy.created_since(db.session, since):
+            _wheel_add(token, next_run_at)
+
+def _run():
+    # 'tick' is the last slot processed, a slot is processed once it has ended so every run in it is due
+    tick = _wheel.tick_of(time.time()) - 1
+    leader = False
+    synced_at = None
+    while True:
+        # wake at the end of the next slot and catch up on any slots we overslept
+        gevent.sleep(max(0, (tick + 2) * SLOT_SECONDS - time.time()))
+        completed = _wheel.tick_of(time.time()) - 1
+        tokens = []
+        while tick < completed:
+            tick += 1
+            tokens += _wheel.pop_due(tick)
+        # only the instance holding the lease executes the recurring buys, the others drop their due tokens and
+        # reload the wheel if they take over
+        if not leases.held(LEASE):
+            leader = False
+            continue
+        now = datetime.now()
+        try:
+            if not leader:
+                _load()
+                leader = True
+                # the slots already ended were run by the previous holder
+                tick = completed
+                tokens = []
+            else:
+                _sync_created(synced_at - timedelta(seconds=SLOT_SECONDS))
+            synced_at = now
+        except Exception: # pylint: disable=broad-except
+            logger.exception('failed to load recurring buys')
+            leader = False
+            continue
+        if not tokens:
+            continue
+        try:
+            _process_due(tokens)
+        except Exception: # pylint: disable=broad-except
+            logger.exception('failed to process %d recurring buys', len(tokens))
+
+def start():
+    global _greenlet # pylint: disable=global-statement
+    # the wheel is loaded once we hold the lease
+    _greenlet = gevent.spawn(_run)
+
+def stop():
+    if _greenlet:
+        _greenlet.kill()
@@ -0,0 +1,93 @@
+import logging
+import time
+
+import gevent
+import gevent.event
+
+from app_core import app, db
+from models import DassetSubaccount, DassetSubaccountAddress
+import assets
+import dasset
+import leases
+import metrics
+from utils import generate_key
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = app.config['SUBACCOUNT_POOL_SIZE']
+INTERVAL = app.config['SUBACCOUNT_POOL_INTERVAL']
+LEASE = 'subaccount_pool'
+CRYPTO_ASSETS = [asset.symbol for asset in assets.ASSETS.values() if asset.is_crypto]
+
+# (subaccount id, asset) of the addresses already requested from dasset
+_requested = set()
+_wakeup = gevent.event.Event()
+_greenlet = None
+
+def claimed():
+    # a subaccount was taken from the pool, top it up early
+    _wakeup.set()
+
+def _subaccount_provision(db_session, subaccount):
+    have = {addr.asset for addr in subaccount.pool_addresses}
+    for asset in CRYPTO_ASSETS:
+        if asset in have:
+            continue
+        addrs = dasset.addresses_provisioned(asset, subaccount.subaccount_id)
+        if addrs:
+            db_session.add(DassetSubaccountAddress(subaccount, asset, addrs[0]))
+            have.add(asset)
+        elif addrs is not None and (subaccount.subaccount_id, asset) not in _requested:
+            if dasset.address_request(asset, subaccount.subaccount_id):
+                _requested.add((subaccount.subaccount_id, asset))
+    if len(have) == len(CRYPTO_ASSETS):
+        subaccount.provisioned = True
+        for asset in CRYPTO_ASSETS:
+            _requested.discard((subaccount.subaccount_id, asset))
+    db_session.add(subaccount)
+    db_session.commit()
+
+def _provision(db_session):
+    start = time.time()
+    unprovisioned = DassetSubaccount.pool_unprovisioned(db_session)
+    free = DassetSubaccount.pool_free_count(db_session)
+    for _ in range(POOL_SIZE - free - len(unprovisioned)):
+        subaccount_id = dasset.subaccount_create(f'pool-{generate_key()}')
+        if not subaccount_id:
+            logger.error('failed to create pool subaccount')
+            break
+        subaccount = DassetSubaccount(None, subaccount_id)
+        db_session.add(subaccount)
+        db_session.commit()
+        unprovisioned.append(subaccount)
+    for subaccount in unprovisioned:
+        try:
+            _subaccount_provision(db_session, subaccount)
+        except Exception: # pylint: disable=broad-except
+            logger.exception('failed to provision pool subaccount %s', subaccount.subaccount_id)
+            db_session.rollback()
+    free = DassetSubaccount.pool_free_count(db_session)
+    if free < POOL_SIZE:
+        logger.info('subaccount pool: %d free, %d provisioning', free, len(unprovisioned))
+    metrics.gauge_set('subaccount_pool_free', free)
+    metrics.timing_record('subaccount_pool_round', time.time() - start)
+
+def _run():
+    while True:
+        # only the instance holding the lease provisions the pool
+        if leases.held(LEASE):
+            try:
+                with app.app_context():
+                    _provision(db.session)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('failed to provision the subaccount pool')
+        _wakeup.clear()
+        _wakeup.wait(INTERVAL)
+
+def start():
+    global _greenlet # pylint: disable=global-statement
+    _greenlet = gevent.spawn(_run)
+
+def stop():
+    if _greenlet:
+        _greenlet.kill()
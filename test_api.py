@@ -109,6 +109,7 @@ def construct_parser():
     parser_broker_order_create.add_argument('side', metavar='SIDE', type=str, help='the market side (bid/ask)')
     parser_broker_order_create.add_argument('amount', metavar='AMOUNT', type=str, help='the amount to buy or sell')
     parser_broker_order_create.add_argument('recipient', metavar='RECIPIENT', type=str, help='the of the funds')
+    parser_broker_order_create.add_argument('--quote-token', type=str, help='the quote token returned by broker_order_validate')
 
     parser_broker_order_status = subparsers.add_parser('broker_order_status', help='Get the status of a broker order')
     parser_broker_order_status.add_argument('api_key_token', metavar='API_KEY_TOKEN', type=str, help='the API KEY token')
@@ -290,7 +291,10 @@ def order_book(args):
 
 def broker_order_create(args):
     print(':: calling broker_order_create..')
-    r = api_req('broker_order_create', {'market': args.market, 'side': args.side, 'amount_dec': args.amount, 'recipient': args.recipient}, args.api_key_token, args.api_key_secret)
+    params = {'market': args.market, 'side': args.side, 'amount_dec': args.amount, 'recipient': args.recipient}
+    if args.quote_token:
+        params['quote_token'] = args.quote_token
+    r = api_req('broker_order_create', params, args.api_key_token, args.api_key_secret)
     check_request_status(r)
     print(r.text)
 
@@ -0,0 +1,136 @@
+import bisect
+import logging
+import decimal
+
+import gevent
+
+from app_core import app, db
+import assets
+from assets import MarketSide
+from models import BrokerOrder
+import dasset
+import broker
+
+logger = logging.getLogger(__name__)
+
+DIRECTION_BELOW = 'below' # fires when the price falls to or below the threshold
+DIRECTION_ABOVE = 'above' # fires when the price rises to or above the threshold
+
+class ThresholdIndex:
+    # keys sorted by threshold so that the keys crossed by a price move can be found (and removed) with a bisect,
+    # thresholds of the 'above' direction are stored negated so that crossed keys are always at the tail of the lists
+    # and a tick costs O(log n) plus the number of keys crossed
+
+    def __init__(self, direction):
+        self.sign = 1 if direction == DIRECTION_BELOW else -1
+        self.thresholds = []
+        self.keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_items(cls, direction, items):
+        # builds the index from (threshold, key) items with a single sort rather than an insert per item
+        index = cls(direction)
+        items = sorted(((threshold * index.sign, key) for threshold, key in items), key=lambda item: item[0])
+        index.thresholds = [threshold for threshold, _ in items]
+        index.keys = [key for _, key in items]
+        return index
+
+    def add(self, threshold, key):
+        threshold = threshold * self.sign
+        n = bisect.bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(n, threshold)
+        self.keys.insert(n, key)
+
+    def remove(self, threshold, key):
+        threshold = threshold * self.sign
+        n = bisect.bisect_left(self.thresholds, threshold)
+        while n < len(self.thresholds) and self.thresholds[n] == threshold:
+            if self.keys[n] == key:
+                del self.thresholds[n]
+                del self.keys[n]
+                return True
+            n += 1
+        return False
+
+    def pop_crossed(self, price):
+        # removes and returns the keys whose threshold is crossed by 'price'
+        n = bisect.bisect_left(self.thresholds, price * self.sign)
+        keys = self.keys[n:]
+        del self.thresholds[n:]
+        del self.keys[n:]
+        return keys
+
+# (market, side, direction) -> ThresholdIndex of waiting broker order tokens keyed by trigger price
+_indexes = {}
+
+def trigger_direction(side, order_type):
+    # limit orders buy below or sell above the trigger price, stop orders buy above or sell below it
+    if order_type == BrokerOrder.ORDER_TYPE_LIMIT:
+        return DIRECTION_BELOW if side is MarketSide.BID else DIRECTION_ABOVE
+    return DIRECTION_ABOVE if side is MarketSide.BID else DIRECTION_BELOW
+
+def _index_key(broker_order):
+    side = MarketSide.parse(broker_order.side)
+    return broker_order.market, side, trigger_direction(side, broker_order.order_type)
+
+def add(broker_order):
+    key = _index_key(broker_order)
+    if key not in _indexes:
+        _indexes[key] = ThresholdIndex(key[2])
+    _indexes[key].add(broker_order.trigger_price, broker_order.token)
+
+def remove(broker_order):
+    key = _index_key(broker_order)
+    if key in _indexes:
+        _indexes[key].remove(broker_order.trigger_price, broker_order.token)
+
+def markets():
+    return {market for (market, _, _), index in _indexes.items() if len(index)}
+
+def best_price(market, levels):
+    # the best price of an order book side in quote asset integer units
+    if not levels:
+        return None
+    _, quote_asset = assets.assets_from_market(market)
+    return assets.asset_dec_to_int(quote_asset, decimal.Decimal(levels[0]['rate']))
+
+def _order_book_updated(market, order_book):
+    # buy orders trigger off the best ask, sell orders off the best bid
+    tokens = []
+    for side, levels in ((MarketSide.BID, order_book.asks), (MarketSide.ASK, order_book.bids)):
+        price = best_price(market, levels)
+        if price is None:
+            continue
+        for direction in (DIRECTION_BELOW, DIRECTION_ABOVE):
+            index = _indexes.get((market, side, direction))
+            if index:
+                tokens += index.pop_crossed(price)
+    if tokens:
+        logger.info('%s: %d broker orders triggered', market, len(tokens))
+        gevent.spawn(_promote, tokens)
+
+def _promote(tokens):
+    # each promoted order queues its market with the broker
+    with app.app_context():
+        for token in tokens:
+            broker.broker_order_promote(db.session, token)
+
+def reload():
+    # rebuilds the indexes from the database, this picks up the orders placed or cancelled on the other app instances
+    # and puts back the orders whose promotion failed (a crossed order is promoted again on the next order book update,
+    # the promotion skips an order that is no longer waiting)
+    items = {}
+    with app.app_context():
+        for broker_order in BrokerOrder.all_waiting(db.session):
+            items.setdefault(_index_key(broker_order), []).append((broker_order.trigger_price, broker_order.token))
+    indexes = {key: ThresholdIndex.from_items(key[2], key_items) for key, key_items in items.items()}
+    _indexes.clear()
+    _indexes.update(indexes)
+    logger.info('loaded %d waiting broker orders', sum(len(index) for index in _indexes.values()))
+
+def start():
+    reload()
+    dasset.order_book_listener_add(_order_book_updated)
@@ -13,7 +13,7 @@ from flask import render_template, request, flash, jsonify, Response
 from flask_security import roles_accepted
 
 from app_core import app, db, socketio
-from models import User, Role, Topic, PushNotificationLocation, BrokerOrder, CryptoDeposit, FiatDeposit, KycRequest, FiatDbTransaction
+from models import User, Role, Topic, PushNotificationLocation, BrokerOrder, CryptoDeposit, CryptoWithdrawal, FiatDeposit, KycRequest, FiatDbTransaction, JobLease
 import email_utils
 from fcm import FCM
 from web_utils import bad_request, get_json_params, get_json_params_optional
@@ -33,6 +33,13 @@ import kyc_core
 import fiatdb_core
 import coordinator
 import tripwire
+import metrics
+import triggers
+import alerts
+import recurring
+import addresspoll
+import leases
+import subaccountpool
 
 USER_BALANCE_SHOW = 'show balance'
 USER_BALANCE_CREDIT = 'credit'
@@ -42,6 +49,9 @@ USER_BALANCE_SWEEP = 'sweep'
 USER_ORDER_SHOW = 'show'
 USER_ORDER_CANCEL = 'cancel'
 
+USER_WITHDRAWAL_SHOW = 'show'
+USER_WITHDRAWAL_RELEASE = 'release hold'
+
 #jsonrpc = JSONRPC(app, "/api")
 logger = logging.getLogger(__name__)
 fcm = FCM(app.config["FIREBASE_CREDENTIALS"])
@@ -64,11 +74,16 @@ def process_email_alerts():
                     msg = f"Available {balance.symbol} Balance needs to be replenished in the dasset account.<br/><br/>Available {balance.symbol} balance is: ${balance_format}"
                     email_utils.email_notification_alert(logger, subject, msg, app.config["ADMIN_EMAIL"])
 
+def process_order_books():
+    with app.app_context():
+        # refreshing an order book evaluates the broker order triggers and price alerts of its market
+        for market in triggers.markets() | alerts.markets():
+            dasset.order_book_read(market)
+
 def process_deposits_and_broker_orders():
     with app.app_context():
         logger.info('process deposits..')
         depwith.fiat_deposits_update(db.session)
-        depwith.crypto_deposits_check(db.session)
         logger.info('process withdrawals..')
         depwith.fiat_withdrawals_update(db.session)
         depwith.crypto_withdrawals_update(db.session)
@@ -336,12 +351,17 @@ def user_order():
         if action == USER_ORDER_SHOW:
             flash(f'order: {order.to_json()}')
         elif action == USER_ORDER_CANCEL:
-            if order.status not in (order.STATUS_READY,):
-                return return_response('invalid order status')
-            with coordinator.lock:
+            # claim the row so a broker worker cannot execute the order while it is refunded
+            if not BrokerOrder.claim_row(db.session, order.id):
+                return return_response('order is being processed, try again')
+            with coordinator.user_lock(order.user.id):
+                if order.status not in (order.STATUS_READY,):
+                    db.session.rollback()
+                    return return_response('invalid order status')
                 side = assets.MarketSide.parse(order.side)
                 ftx = broker.order_refund(db.session, order, side)
                 if not ftx:
+                    db.session.rollback()
                     return return_response('failed to create refund')
                 order.status = order.STATUS_CANCELLED
                 db.session.add(ftx)
@@ -350,16 +370,61 @@ def user_order():
             flash(f'canceled and refunded order {token}')
     return return_response()
 
+@app.route('/user_withdrawal', methods=['GET', 'POST'])
+@roles_accepted(Role.ROLE_ADMIN)
+def user_withdrawal():
+    actions = (USER_WITHDRAWAL_SHOW, USER_WITHDRAWAL_RELEASE)
+    action = token = ''
+    def return_response(err_msg=None):
+        if err_msg:
+            flash(err_msg, 'danger')
+        return render_template('user_withdrawal.html', actions=actions, action=action, token=token)
+    if request.method == 'POST':
+        action = request.form['action']
+        token = request.form['token']
+        if action not in actions:
+            return return_response('invalid action')
+        if not token:
+            return return_response('please enter a withdrawal token')
+        withdrawal = CryptoWithdrawal.from_token(db.session, token)
+        if not withdrawal:
+            return return_response('Withdrawal not found')
+        if action == USER_WITHDRAWAL_SHOW:
+            flash(f'withdrawal: {withdrawal.to_json()}, exchange reference: {withdrawal.exchange_reference}')
+        elif action == USER_WITHDRAWAL_RELEASE:
+            # only a withdrawal of unknown outcome has a hold to release, check the exchange has no such withdrawal first
+            if not CryptoWithdrawal.claim_row(db.session, withdrawal.id):
+                return return_response('withdrawal is being processed, try again')
+            with coordinator.user_lock(withdrawal.user_id):
+                if withdrawal.status != withdrawal.STATUS_UNKNOWN:
+                    db.session.rollback()
+                    return return_response('invalid withdrawal status')
+                updated_records = depwith.crypto_withdrawal_release(withdrawal)
+                if not updated_records:
+                    db.session.rollback()
+                    return return_response('failed to release hold')
+                for rec in updated_records:
+                    db.session.add(rec)
+                db.session.commit()
+            websocket.crypto_withdrawal_update_event(withdrawal)
+            flash(f'canceled withdrawal and released hold {token}')
+    return return_response()
+
 @app.route('/config', methods=['GET'])
 @roles_accepted(Role.ROLE_ADMIN)
 def config():
-    return render_template('config.html')
+    return render_template('config.html', job_leases=JobLease.all(db.session), instance=leases.INSTANCE_ID)
 
 @app.route('/tripwire', methods=['GET'])
 @roles_accepted(Role.ROLE_ADMIN)
 def tripwire_ep():
     return render_template('tripwire.html', data=tripwire.DATA)
 
+@app.route('/metrics', methods=['GET'])
+@roles_accepted(Role.ROLE_ADMIN)
+def metrics_ep():
+    return render_template('metrics.html', counters=metrics.COUNTERS, gauges=metrics.GAUGES, timings=metrics.TIMINGS)
+
 #
 # gevent class
 #
@@ -383,13 +448,25 @@ class WebGreenlet():
             current = int(time.time())
             email_alerts_timer_last = current
             deposits_and_orders_timer_last = current
+            order_books_timer_last = current
+            indexes_timer_last = current
             while True:
                 current = time.time()
+                # the jobs below run only on the app instance holding their lease, the order books are refreshed on
+                # every instance as each keeps its own trigger and price alert indexes
+                gevent.spawn(leases.heartbeat)
+                if current - order_books_timer_last > app.config['TRIGGER_REFRESH_SECONDS']:
+                    gevent.spawn(process_order_books)
+                    order_books_timer_last = current
+                if current - indexes_timer_last > app.config['TRIGGER_RELOAD_SECONDS']:
+                    gevent.spawn(triggers.reload)
+                    gevent.spawn(alerts.reload)
+                    indexes_timer_last = current
                 if current - email_alerts_timer_last > 1800:
-                    gevent.spawn(process_email_alerts)
+                    gevent.spawn(leases.run, 'email_alerts', process_email_alerts)
                     email_alerts_timer_last += 1800
                 if current - deposits_and_orders_timer_last > 300:
-                    gevent.spawn(process_deposits_and_broker_orders)
+                    gevent.spawn(leases.run, 'deposits_and_broker_orders', process_deposits_and_broker_orders)
                     deposits_and_orders_timer_last += 300
                 gevent.sleep(5)
 
@@ -405,8 +482,24 @@ class WebGreenlet():
             self.runloop_greenlet.link_exception(self.exception_func)
         # start greenlets
         gevent.spawn(start_greenlets)
+        broker.broker_market_queue.start()
+        depwith.fiat_deposit_queue.start()
+        depwith.fiat_deposit_session_queue.start()
+        subaccountpool.start()
+        depwith.crypto_withdrawal_confirm_queue.start()
+        triggers.start()
+        alerts.start(fcm)
+        recurring.start()
+        addresspoll.start()
 
     def stop(self):
+        broker.broker_market_queue.stop()
+        depwith.fiat_deposit_queue.stop()
+        depwith.fiat_deposit_session_queue.stop()
+        subaccountpool.stop()
+        depwith.crypto_withdrawal_confirm_queue.stop()
+        recurring.stop()
+        addresspoll.stop()
         self.runloop_greenlet.kill()
         self.process_periodic_events_greenlet.kill()
         gevent.joinall([self.runloop_greenlet, self.process_periodic_events_greenlet])
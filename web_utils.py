@@ -39,6 +39,7 @@ INSUFFICIENT_BALANCE = 'insufficient balance'
 AMOUNT_TOO_LOW = 'amount too low'
 INVALID_RECIPIENT = 'invalid recipient'
 EXPIRED = 'expired'
+INVALID_QUOTE = 'invalid quote'
 INVALID_STATUS = 'invalid status'
 FAILED_PAYMENT_CREATE = 'payment creation failed'
 FAILED_EXCHANGE = 'exchange operation failed'
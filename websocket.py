@@ -8,7 +8,7 @@ from flask_socketio import Namespace, emit, join_room, leave_room
 from app_core import SERVER_VERSION, CLIENT_VERSION_DEPLOYED, db, socketio
 from web_utils import check_auth
 from security import tf_enabled_check
-from models import BrokerOrder, CryptoDeposit, CryptoWithdrawal, FiatDeposit, FiatWithdrawal, User, ApiKey
+from models import BrokerOrder, CryptoDeposit, CryptoWithdrawal, FiatDeposit, FiatWithdrawal, PriceAlert, User, ApiKey
 
 logger = logging.getLogger(__name__)
 ws_sids = {}
@@ -110,6 +110,11 @@ def fiat_withdrawal_new_event(fiat_withdrawal: FiatWithdrawal):
     socketio.emit('fiat_withdrawal_new', data, json=True, room=fiat_withdrawal.user.email, namespace=NS)
     logger.info('fiat_withdrawal_new: %s', fiat_withdrawal.token)
 
+def price_alert_event(price_alert: PriceAlert):
+    data = json.dumps(price_alert.to_json())
+    socketio.emit('price_alert', data, json=True, room=price_alert.user.email, namespace=NS)
+    logger.info('price_alert: %s', price_alert.token)
+
 class EventsNamespace(Namespace):
 
     def on_error(self, err):
@@ -0,0 +1,59 @@
+import logging
+import time
+
+import gevent
+import gevent.queue
+
+from app_core import app, db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class WorkQueue:
+    # in process queue of keys processed by worker greenlets, a key that is already waiting is not queued twice,
+    # with a delay a key is held back for that many seconds so repeated puts within the window are processed once
+
+    def __init__(self, name: str, handler, workers: int, delay: float = 0):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.delay = delay
+        self.queue = gevent.queue.Queue()
+        self.pending = set()
+        self.greenlets = []
+
+    def put(self, key):
+        if key in self.pending:
+            return
+        self.pending.add(key)
+        if self.delay:
+            gevent.spawn_later(self.delay, self.queue.put, key)
+        else:
+            self.queue.put(key)
+        metrics.gauge_set(f'{self.name}_queue_depth', len(self.pending))
+
+    def _process(self, key):
+        start = time.time()
+        try:
+            with app.app_context():
+                self.handler(db.session, key)
+        except Exception: # pylint: disable=broad-except
+            logger.exception('%s failed to process %s', self.name, key)
+            metrics.counter_inc(f'{self.name}_failures')
+        metrics.timing_record(f'{self.name}_process', time.time() - start)
+
+    def _worker(self):
+        while True:
+            key = self.queue.get()
+            self.pending.discard(key)
+            metrics.gauge_set(f'{self.name}_queue_depth', len(self.pending))
+            self._process(key)
+
+    def start(self):
+        logger.info('starting %d %s workers', self.workers, self.name)
+        for _ in range(self.workers):
+            self.greenlets.append(gevent.spawn(self._worker))
+
+    def stop(self):
+        gevent.killall(self.greenlets)
+        self.greenlets = []